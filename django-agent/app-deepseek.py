@@ -1,14 +1,23 @@
 import os
-import re
+import socket
+import asyncio
 import requests
 import json
 import time
 import logging
 import sys
 import traceback
+from collections import Counter, deque
 from dotenv import load_dotenv
 from utils.django import prepare_ai_request
-from typing import List, Dict, Any
+from utils.analysis_cache import AnalysisCache
+from utils.pipeline import Pipeline
+from utils.http_client import HttpClient
+from utils.prompt import PromptBuilder, Prompt, count_tokens, format_body, issue_log_excerpt, repair_prompt
+from utils.issue_schema import (
+    JsonScanner, extract_json, format_analysis, is_batch_answer, parse_batch_answer, validate_issue
+)
+from typing import List, Dict, Any, Optional
 
 load_dotenv()
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
@@ -16,6 +25,63 @@ TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_ID = os.getenv('TELEGRAM_ID')
 GITLAB_TOKEN = os.getenv('GITLAB_TOKEN')
 
+# Адреса внешних сервисов; переопределяются, например, для проверки агента на локальных заглушках
+LOG_SERVER_URL = os.getenv('LOG_SERVER_URL', 'https://kuber.ninja360.ru/api/logs')
+DEEPSEEK_API_URL = os.getenv('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1')
+GITLAB_API_URL = os.getenv('GITLAB_API_URL', 'https://gitlab.com/api/v4')
+GITLAB_PROJECT_ID = os.getenv('GITLAB_PROJECT_ID', '10046060')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Размер пачки и срок аренды логов: за срок аренды агент должен успеть обработать пачку
+CLAIM_BATCH_SIZE = int(os.getenv('CLAIM_BATCH_SIZE', '20'))
+CLAIM_LEASE_SECONDS = int(os.getenv('CLAIM_LEASE_SECONDS', '900'))
+
+# Кэш ответов DeepSeek по fingerprint ошибки: каталог, срок жизни записи и предельный размер.
+# Каталог по умолчанию - том /var/lib/ai-issue-genius из Dockerfile, кэш переживает пересоздание контейнера
+ANALYSIS_CACHE_DIR = os.getenv('ANALYSIS_CACHE_DIR', '/var/lib/ai-issue-genius/analysis_cache')
+ANALYSIS_CACHE_TTL_HOURS = int(os.getenv('ANALYSIS_CACHE_TTL_HOURS', '168'))
+ANALYSIS_CACHE_SIZE_MB = int(os.getenv('ANALYSIS_CACHE_SIZE_MB', '256'))
+
+# Одновременные обращения к внешним сервисам в конвейере анализа и размер очередей между стадиями
+DEEPSEEK_CONCURRENCY = int(os.getenv('DEEPSEEK_CONCURRENCY', '4'))
+SERVER_CONCURRENCY = int(os.getenv('SERVER_CONCURRENCY', '4'))
+GITLAB_CONCURRENCY = int(os.getenv('GITLAB_CONCURRENCY', '2'))
+TELEGRAM_CONCURRENCY = int(os.getenv('TELEGRAM_CONCURRENCY', '1'))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', str(CLAIM_BATCH_SIZE)))
+
+# Бюджет промпта в токенах: весь промпт, body и traceback; лог в описании issue
+PROMPT_MAX_TOKENS = int(os.getenv('PROMPT_MAX_TOKENS', '3000'))
+PROMPT_BODY_TOKENS = int(os.getenv('PROMPT_BODY_TOKENS', '300'))
+PROMPT_TRACEBACK_TOKENS = int(os.getenv('PROMPT_TRACEBACK_TOKENS', '800'))
+ISSUE_LOG_MAX_TOKENS = int(os.getenv('ISSUE_LOG_MAX_TOKENS', '2000'))
+
+# Длина ответа DeepSeek на одну ошибку в токенах
+ANALYSIS_MAX_TOKENS = int(os.getenv('ANALYSIS_MAX_TOKENS', '500'))
+# При очереди несколько ошибок анализируются одним запросом: не больше LLM_BATCH_MAX_ERRORS
+# ошибок и LLM_BATCH_MAX_TOKENS токенов промпта; LLM_BATCH_MAX_ERRORS=1 отключает пакеты
+LLM_BATCH_MAX_ERRORS = int(os.getenv('LLM_BATCH_MAX_ERRORS', '5'))
+LLM_BATCH_MAX_TOKENS = int(os.getenv('LLM_BATCH_MAX_TOKENS', '6000'))
+# Отметка вместо анализа для лога, который нельзя разобрать: сервер больше не выдает его в аренду
+UNANALYZABLE_ANALYSIS = {
+    'status': 'unanalyzable',
+    'problem_description': 'Лог не содержит полей ошибки Django, анализ невозможен',
+}
+
+# Исходящие HTTP-запросы: таймауты, повторы с задержкой, предохранитель хоста, размер пула соединений
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv('DEEPSEEK_READ_TIMEOUT', '120'))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+HTTP_BACKOFF_SECONDS = float(os.getenv('HTTP_BACKOFF_SECONDS', '0.5'))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv('HTTP_BACKOFF_MAX_SECONDS', '30'))
+HTTP_CIRCUIT_FAILURES = int(os.getenv('HTTP_CIRCUIT_FAILURES', '5'))
+HTTP_CIRCUIT_RESET_SECONDS = float(os.getenv('HTTP_CIRCUIT_RESET_SECONDS', '30'))
+# Соединений на хост: стадии конвейера плюс поток новых логов
+HTTP_POOL_SIZE = int(os.getenv(
+    'HTTP_POOL_SIZE',
+    str(max(DEEPSEEK_CONCURRENCY, SERVER_CONCURRENCY, GITLAB_CONCURRENCY, TELEGRAM_CONCURRENCY) + 1)
+))
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -25,21 +91,53 @@ class LogAnalyzerService:
     def __init__(self, telegram_bot_token: str, telegram_chat_id: str):
         self.telegram_bot_token = telegram_bot_token
         self.telegram_chat_id = telegram_chat_id
-        self.api_url = "https://kuber.ninja360.ru/api/logs"
+        self.api_url = LOG_SERVER_URL.rstrip('/')
+        # Идентификатор агента для аренды логов, у каждой реплики свой
+        self.worker_id = os.getenv('AGENT_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+        # Наибольший ID из уже разобранных логов, чтобы не реагировать на старые события
+        self.last_seen_id = 0
+        # Логов, взятых в аренду за последний проход конвейера
+        self.claimed = 0
+        self.analysis_cache = AnalysisCache(
+            ANALYSIS_CACHE_DIR,
+            ttl_seconds=ANALYSIS_CACHE_TTL_HOURS * 3600,
+            size_limit=ANALYSIS_CACHE_SIZE_MB * 1024 * 1024
+        )
+        self.prompt_builder = PromptBuilder(
+            max_tokens=PROMPT_MAX_TOKENS,
+            budgets={'body': PROMPT_BODY_TOKENS, 'traceback': PROMPT_TRACEBACK_TOKENS}
+        )
+        # Запросы к DeepSeek: всего, ошибок в пакетных, повторно по одной после пакета,
+        # остановленных по концу JSON, исправлений ответа
+        self.llm_stats = Counter()
+        # Время до первого токена и генерации целиком по последним запросам, секунды
+        self.llm_timings = {'ttft': deque(maxlen=500), 'total': deque(maxlen=500)}
+        self.http = HttpClient(
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            read_timeout=HTTP_READ_TIMEOUT,
+            retries=HTTP_RETRIES,
+            backoff_seconds=HTTP_BACKOFF_SECONDS,
+            backoff_max_seconds=HTTP_BACKOFF_MAX_SECONDS,
+            pool_size=HTTP_POOL_SIZE,
+            failure_threshold=HTTP_CIRCUIT_FAILURES,
+            reset_seconds=HTTP_CIRCUIT_RESET_SECONDS
+        )
 
     def fetch_logs(self) -> List[Dict]:
-        """Получение логов Django за указанный период"""
+        """Берет в аренду пачку непроанализированных логов Django"""
         try:
-            params = {
-                'service': 'django'
+            payload = {
+                'worker_id': self.worker_id,
+                'service': 'django',
+                'limit': CLAIM_BATCH_SIZE,
+                'lease_seconds': CLAIM_LEASE_SECONDS
             }
 
-            logger.info(f"Запрос логов с параметрами: {params}")
+            logger.info(f"Запрос логов с параметрами: {payload}")
 
-            response = requests.get(
-                self.api_url,
-                params=params,
-                timeout=30
+            response = self.http.post(
+                f"{self.api_url}/claim",
+                json=payload
             )
             response.raise_for_status()
 
@@ -56,65 +154,179 @@ class LogAnalyzerService:
             logger.error(f"Ошибка парсинга JSON: {e}")
             return []
 
-    def analyze_log(self, log_data: Dict) -> str:
+    def get_cached_analysis(self, cache_key: Optional[str]):
+        """Готовый ответ DeepSeek по fingerprint ошибки или None"""
+        cached = self.analysis_cache.get(cache_key)
+        if cached is None:
+            return None
+
+        try:
+            self.prepare_analysis(cached)
+        except ValueError as e:
+            # Ответ из кэша старых версий агента без проверки схемы - анализируем заново
+            logger.info(f"Анализ ошибки {cache_key} в кэше не прошел проверку: {e}")
+            return None
+        logger.info(f"Анализ ошибки {cache_key} взят из кэша")
+        return cached
+
+    def _chat(self, prompt: str, max_tokens: int, opening: str = '{[', accept=None):
         """
-        Анализирует ошибку Python/Django с помощью DeepSeek API
+        Потоковый запрос к DeepSeek API: ответ разбирается по мере прихода токенов,
+        и поток закрывается, как только JSON ответа закончен (opening - его первая скобка,
+        accept - проверка, что законченный JSON и есть ответ).
+        :return: текст ответа, разобранный JSON или None, usage
         """
-        try:
-            # Подготавливаем структурированный запрос
-            ai_request = prepare_ai_request(log_data)
-
-            # Создаем промпт для модели
-            prompt = self.create_analysis_prompt(ai_request)
+        url = f"{DEEPSEEK_API_URL.rstrip('/')}/chat/completions"
 
-            # logger.info(f"prompt {prompt}")
+        headers = {
+            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+            "Content-Type": "application/json"
+        }
 
-            url = "https://api.deepseek.com/v1/chat/completions"
+        payload = {
+            "model": "deepseek-coder",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "Ты опытный Python/Django разработчик, специализирующийся на анализе ошибок и поиске решений."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.1,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
 
-            headers = {
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                "Content-Type": "application/json"
-            }
+        self.llm_stats['requests'] += 1
+        scanner = JsonScanner(opening, accept)
+        usage = {}
+        started = time.perf_counter()
+        first_token = None
+
+        with self.http.post(
+            url,
+            headers=headers,
+            json=payload,
+            stream=True,
+            # Повтор анализа ничего не меняет на стороне DeepSeek
+            idempotent=True,
+            timeout=(HTTP_CONNECT_TIMEOUT, DEEPSEEK_READ_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+            response.encoding = 'utf-8'
 
-            payload = {
-                "model": "deepseek-coder",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "Ты опытный Python/Django разработчик, специализирующийся на анализе ошибок и поиске решений."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.1,
-                "max_tokens": 500
-            }
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+
+                event = json.loads(data)
+                usage = event.get('usage') or usage
+                content = ''.join(
+                    (choice.get('delta') or {}).get('content') or '' for choice in event.get('choices') or []
+                )
+                if not content:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                # Закрытие потока останавливает генерацию: хвост после JSON не нужен
+                if scanner.feed(content):
+                    self.llm_stats['stopped_early'] += 1
+                    break
+
+        total = time.perf_counter() - started
+        self.llm_timings['total'].append(total)
+        if first_token is not None:
+            self.llm_timings['ttft'].append(first_token - started)
+        if not usage.get('total_tokens'):
+            # При остановке потока usage не приходит: расход оценивается по длине промпта и ответа
+            usage = {'prompt_tokens': count_tokens(prompt), 'completion_tokens': count_tokens(scanner.text)}
+            usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        logger.info(
+            f"DeepSeek: первый токен через {(first_token or time.perf_counter()) - started:.2f} с, "
+            f"ответ за {total:.2f} с, usage {usage}"
+        )
+        return scanner.text, scanner.value if scanner.done else None, usage
 
+    def checked_issue(self, content: str, issue: Any) -> Dict[str, Any]:
+        """Issue, прошедшее проверку схемы; некорректный ответ отправляется модели на исправление"""
+        if issue is None:
             try:
-                response = requests.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-
-                result = response.json()
-                return result['choices'][0]['message']['content']
+                issue = extract_json(content)
+            except ValueError:
+                issue = None
+
+        errors = validate_issue(issue)
+        if not errors:
+            return issue
+
+        # Исправление - короткий запрос с самим ответом, без повторного анализа лога
+        self.llm_stats['repairs'] += 1
+        logger.warning(f"Ответ модели не прошел проверку ({'; '.join(errors)}), запрос исправления")
+        content, issue, _ = self._chat(repair_prompt(content, errors), ANALYSIS_MAX_TOKENS, opening='{')
+        if issue is None:
+            issue = extract_json(content)
+
+        errors = validate_issue(issue)
+        if errors:
+            raise ValueError(f"Ответ модели не прошел проверку схемы: {'; '.join(errors)}")
+        return issue
+
+    def request_analysis(self, prompt: str, cache_key: Optional[str]) -> str:
+        """Запрос к DeepSeek API, проверенный ответ сохраняется в кэш по fingerprint ошибки"""
+        content, issue, usage = self._chat(prompt, ANALYSIS_MAX_TOKENS, opening='{')
+        analysis = format_analysis(self.checked_issue(content, issue))
+        self.analysis_cache.set(cache_key, analysis, usage.get('total_tokens'))
+        return analysis
+
+    def request_batch_analysis(self, jobs: List[Dict[str, Any]]):
+        """
+        Анализ нескольких ошибок одним запросом: модель отвечает JSON-массивом issue по log_id.
+        Прошедшие проверку схемы issue записываются в job['analysis'] и в кэш,
+        у остальных analysis остается None - их анализируют по одной
+        """
+        prompt = self.prompt_builder.build_batch([(job['log_id'], job['block']) for job in jobs])
+        logger.info(f"Пакетный промпт на {len(jobs)} ошибок ~{prompt.tokens} токенов")
 
-            except Exception as e:
-                return f"Ошибка при обращении к API: {str(e)}"
+        try:
+            content, answer, usage = self._chat(
+                prompt.text, ANALYSIS_MAX_TOKENS * len(jobs), opening='[', accept=is_batch_answer
+            )
+            if answer is None:
+                answer = extract_json(content)
+            issues = parse_batch_answer(answer, [job['log_id'] for job in jobs])
         except Exception as e:
-            logger.error(f"Ошибка при анализе лога: {e}")
-            return f"Ошибка анализа: {str(e)}"
+            logger.error(f"Пакетный анализ {len(jobs)} ошибок не удался: {e}")
+            return
+
+        self.llm_stats['batched_errors'] += len(issues)
+        # Расход пакета делится поровну между ошибками для статистики кэша
+        tokens = (usage.get('total_tokens') or 0) // len(jobs) or None
+        for job in jobs:
+            issue = issues.get(job['log_id'])
+            if issue is not None:
+                job['analysis'] = format_analysis(issue)
+                self.analysis_cache.set(job['cache_key'], job['analysis'], tokens)
+
+        if len(issues) < len(jobs):
+            logger.warning(f"В ответе на пакет нет корректных issue для {len(jobs) - len(issues)} ошибок")
 
     def send_telegram_message(self, message: str, issue_url: str) -> bool:
         """Отправка сообщения в Telegram с разбивкой на части"""
         try:
-            url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendMessage"
+            url = f"{TELEGRAM_API_URL.rstrip('/')}/bot{self.telegram_bot_token}/sendMessage"
             payload = {
                 'chat_id': self.telegram_chat_id,
                 'text': f"{message}\n\n[Ссылка на issue]({issue_url})",
                 'parse_mode': 'Markdown'
             }
-            response = requests.post(url, json=payload, timeout=10)
+            response = self.http.post(url, json=payload, timeout=(HTTP_CONNECT_TIMEOUT, 10))
             response.raise_for_status()
             time.sleep(1)  # Пауза между сообщениями
 
@@ -124,100 +336,25 @@ class LogAnalyzerService:
             logger.error(f"Ошибка отправки в Telegram: {e}")
             return False
 
-    def create_analysis_prompt(self, ai_request):
-        """
-        Создает текстовый промпт из структурированного запроса
-        """
-        try:
-            prompt = f"""
-                Ты — AIssueGenius, эксперт по созданию технических issue.             
-                На основе анализа ошибки создай структурированное issue для разработчиков.
-                
-                ДАННЫЕ ДЛЯ АНАЛИЗА:
-                
-                ИНФОРМАЦИЯ О ПОЛЬЗОВАТЕЛЕ:
-                - {'Пользователь авторизован. USER ID: ' + str(ai_request['user']['id']) if ai_request['user']['is_authenticated'] else 'Анонимный'}
-                
-                КОНТЕКСТ ОШИБКИ:
-                - Время: {ai_request['error_context']['timestamp']}
-                - Окружение: {ai_request['error_context']['environment']}
-                - Приложение: {ai_request['error_context']['application']}
-                - Сервис: {ai_request['error_context']['service']}
-                - Метод: {ai_request['error_context']['request_method']}
-                - Путь: {ai_request['error_context']['request_path']}
-                - Body: {ai_request['error_context']['request_body']}
-    
-                ДЕТАЛИ ОШИБКИ:
-                Тип: {ai_request['error_details']['type']}
-                Сообщение: {ai_request['error_details']['message']}
-    
-                TRACEBACK:
-                {chr(10).join(ai_request['error_details']['traceback'][-5:])}
-    
-                КОД С ОШИБКОЙ:
-                Файл: {ai_request['error_details']['code_context'].get('file', 'unknown')}
-                Строка: {ai_request['error_details']['code_context'].get('line', 'unknown')}
-                Код: {ai_request['error_details']['code_context'].get('code_snippet', 'unknown')}
-    
-                ОКРУЖЕНИЕ:
-                Python: {ai_request['environment_info']['python_version']}
-                Django: {ai_request['environment_info']['django_version']}
-                Debug: {ai_request['environment_info']['debug_mode']}
-                Database: {ai_request['environment_info']['database_engine']}
-    
-                ИНСТРУКЦИЯ ДЛЯ СОЗДАНИЯ ISSUE:
-                1. Title: Краткое описательное название (максимум 10 слов)                
-                2. Description:                
-                    - Краткое описание проблемы                
-                    - Шаги для воспроизведения (если применимо)                
-                3. Labels: Добавь соответствующие метки (через запятую)                
-                4. Priority: Определи приоритет (Critical, High, Medium, Low)                
-                5. Assignee: Укажи suggested assignee (backend, frontend, devops, database)                
-                6. Milestone: Предложи milestone если это критичный баг                
-                7 .Checklist: Создай чеклист для решения проблемы
-                                
-                ФОРМАТ ВЫВОДА:
-                Выведи результат строго в формате JSON:
-                {{
-                  "title": "string",
-                  "description": "string",
-                  "labels": "string,string,string",
-                  "priority": "Critical|High|Medium|Low",
-                  "assignee": "backend|frontend|devops|database",
-                  "milestone": "string|null",
-                  "checklist": [
-                    "Шаг 1: Описание действия",
-                    "Шаг 2: Описание действия"
-                  ]
-                }}
-    
-                ПРИМЕР ХОРОШЕГО ISSUE:
-                Title: "Тайм-аут соединения с базой данных в приложении Django"
-                Priority: "High"
-                Labels: "bug,database,backend"
-                Assignee: "backend"
-                
-                Будь конкретным и практичным в рекомендациях!
-            """
-
-            return prompt
-        except Exception as e:
-            logger.error(f"create_analysis_prompt: {e}", exc_info=True)
-            exit()
+    def single_prompt(self, block: Prompt) -> str:
+        """Промпт одной ошибки из блока ее данных"""
+        prompt = self.prompt_builder.single(block)
+        logger.info(
+            f"Промпт ~{prompt.tokens} токенов, обрезано ~{prompt.truncated_tokens}, по секциям {prompt.sections}"
+        )
+        return prompt.text
 
     def prepare_analysis(self, payload: str) -> Dict[str, Any]:
         """
         Получает json из анализа
-        :param payload:
-        :return:
+        :param payload: ответ модели
+        :return: issue; ValueError, если в ответе нет JSON или он не по схеме issue
         """
-        pattern = r'```json\s*(.*?)\s*```'
-        match = re.search(pattern, payload, re.DOTALL)
-        if match:
-            json_string = match.group(1).strip()
-            payload = json.loads(json_string)
-
-        return payload
+        issue = extract_json(payload)
+        errors = validate_issue(issue)
+        if errors:
+            raise ValueError('; '.join(errors))
+        return issue
 
 
     def create_issue(self, payload: Dict[str, Any], log_data: Dict[str, Any]) -> str:
@@ -231,13 +368,14 @@ class LogAnalyzerService:
         for item in payload.get('checklist', []):
             checklist += f"- [ ] {item}\n"
 
-        body = log_data["request"]["body"]
+        body = format_body(log_data["request"]["body"], PROMPT_BODY_TOKENS)
+        log_excerpt = issue_log_excerpt(log_data, ISSUE_LOG_MAX_TOKENS)
 
         description = (
             f"{payload.get('description')}\n\n"
             f"Body:\n\n {body}\n\n"
             f"{checklist}\n\n"
-            f"Лог:\n\n{log_data}"
+            f"Лог:\n\n```json\n{log_excerpt}\n```"
         )
 
         labels = ''
@@ -253,7 +391,7 @@ class LogAnalyzerService:
         except Exception as e:
             pass
 
-        url = "https://gitlab.com/api/v4/projects/10046060/issues"
+        url = f"{GITLAB_API_URL.rstrip('/')}/projects/{GITLAB_PROJECT_ID}/issues"
         headers = {"PRIVATE-TOKEN": GITLAB_TOKEN}
         data = {
             "title": payload.get('title'),
@@ -261,7 +399,7 @@ class LogAnalyzerService:
             "labels": f"{payload.get('labels')},priority::{payload.get('priority').lower()}",
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        response = self.http.post(url, headers=headers, json=data)
         return response.json().get('web_url')
 
 
@@ -269,72 +407,183 @@ class LogAnalyzerService:
         """
         Сохраняет ответ от ИИ в базу
         :param analysis:
-        :return:
+        :return: RequestException, если сервер анализ не принял: issue по логу не создается
         """
-        try:
-            logger.info(f"Сохраняет анализ для лога log_id {log_id}")
+        logger.info(f"Сохраняет анализ для лога log_id {log_id}")
 
-            headers = {
-                'Content-Type': 'application/json'
-            }
+        headers = {
+            'Content-Type': 'application/json'
+        }
 
-            response = requests.put(
+        try:
+            response = self.http.put(
                 self.api_url,
                 json={
                     'log_id': log_id,
                     'analysis': analysis
                 },
-                timeout=30,
                 headers=headers
             )
             response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ошибка при сохранении анализа лога {log_id}: {e}")
+            raise
 
+        try:
             logs = response.json()
             logger.info(f"Анализ лога успешно сохранен log_id {log_id} logs {logs}")
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при получении логов: {e}")
         except json.JSONDecodeError as e:
             logger.error(f"Ошибка парсинга JSON: {e}")
 
 
-    def run_analysis_cycle(self, interval_minutes: int = 30):
-        """Основной цикл анализа"""
-        logger.info("Запуск сервиса анализа логов...")
+    def build_pipeline(self) -> Pipeline:
+        """
+        Конвейер анализа: промпт -> DeepSeek -> разбор ответа -> сохранение -> issue -> Telegram.
+        У каждого внешнего сервиса свой лимит одновременных запросов, стадии связаны
+        ограниченными очередями: медленный Telegram не задерживает анализ следующих ошибок
+        """
+        pipeline = Pipeline(
+            resources={
+                'server': SERVER_CONCURRENCY,
+                'deepseek': DEEPSEEK_CONCURRENCY,
+                'gitlab': GITLAB_CONCURRENCY,
+                'telegram': TELEGRAM_CONCURRENCY,
+            },
+            queue_size=PIPELINE_QUEUE_SIZE
+        )
+        return (
+            pipeline
+            .add_stage('prompt', self._stage_prompt, blocking=True)
+            .add_stage(
+                'llm', self._stage_llm, workers=DEEPSEEK_CONCURRENCY, resource='deepseek', blocking=True,
+                batch_size=LLM_BATCH_MAX_ERRORS,
+                batch_weight=LLM_BATCH_MAX_TOKENS - self.prompt_builder.batch_static_tokens,
+                weight=lambda job: job['block'].tokens if job['analysis'] is None else 0
+            )
+            .add_stage('parse', self._stage_parse)
+            .add_stage('persist', self._stage_persist, workers=SERVER_CONCURRENCY, resource='server', blocking=True)
+            .add_stage('issue', self._stage_issue, workers=GITLAB_CONCURRENCY, resource='gitlab', blocking=True)
+            .add_stage('notify', self._stage_notify, workers=TELEGRAM_CONCURRENCY, resource='telegram', blocking=True)
+        )
 
+    async def _claimed_jobs(self, pipeline: Pipeline):
+        """Берет логи в аренду пачками, пока сервер их выдает; очередь конвейера сдерживает аренду"""
+        # Повторы одной ошибки сервер отмечает анализом первого появления
+        fingerprints = set()
         while True:
-            try:
-                # Получаем логи
-                logs = self.fetch_logs()  # За последний час
-
-                if not logs:
-                    logger.info("Новых ошибок не обнаружено")
-                    time.sleep(interval_minutes * 60)
+            logs = await pipeline.call('server', self.fetch_logs)
+            if not logs:
+                return
+            self.claimed += len(logs)
+            self.last_seen_id = max(self.last_seen_id, max(log.get('id') for log in logs))
+
+            for log in logs:
+                log_id = log.get('id')
+                fingerprint = log.get('fingerprint')
+                if fingerprint and fingerprint in fingerprints:
+                    logger.info(f"Лог {log_id} - повтор уже проанализированной ошибки {fingerprint}")
                     continue
+                if fingerprint:
+                    fingerprints.add(fingerprint)
 
-                # Анализируем каждую ошибку
-                for log in logs:
-                    logger.info(f"log {log}")
-                    log_id = log.get('id')
-                    log_data = json.loads(log.get('log'))
-
-                    analysis = self.analyze_log(log_data)
-
-                    payload = self.prepare_analysis(analysis)
-
-                    # Сохранить ответ от ИИ
-                    self.save_analysis(log_id, payload)
+                log_data = log.get('log')
+                # Старые версии сервера отдают jsonb строкой
+                if isinstance(log_data, str):
+                    log_data = json.loads(log_data)
 
-                    # Создает issue
-                    issue_url = self.create_issue(payload, log_data)
+                yield {
+                    'log_id': log_id,
+                    'cache_key': fingerprint,
+                    'log_data': log_data,
+                }
+
+    def _stage_prompt(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        job['analysis'] = self.get_cached_analysis(job['cache_key'])
+        if job['analysis'] is None:
+            ai_request = prepare_ai_request(job['log_data'])
+            if ai_request is None:
+                # Лог без нужных полей не разобрать: сохраняем отметку вместо анализа,
+                # иначе после истечения аренды он будет взят снова
+                logger.warning(f"Лог {job['log_id']} не содержит полей ошибки Django, анализ пропущен")
+                self.save_analysis(job['log_id'], UNANALYZABLE_ANALYSIS)
+                return None
+            job['block'] = self.prompt_builder.error_block(ai_request)
+        return job
+
+    def _stage_llm(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Ошибки, ждущие в очереди, анализируются одним запросом; не разобранные из пакета - по одной"""
+        pending = [job for job in jobs if job['analysis'] is None]
+        if len(pending) > 1:
+            self.request_batch_analysis(pending)
+
+        for job in pending:
+            if job['analysis'] is not None:
+                continue
+            if len(pending) > 1:
+                self.llm_stats['fallbacks'] += 1
+            try:
+                job['analysis'] = self.request_analysis(self.single_prompt(job['block']), job['cache_key'])
+            except Exception as e:
+                # Лог остается без анализа и вернется в очередь по истечении аренды
+                logger.error(f"Анализ лога {job['log_id']} не удался: {e}", exc_info=True)
+
+        return [job for job in jobs if job['analysis'] is not None]
+
+    async def _stage_parse(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        # Некорректный ответ отбрасывает лог: он вернется в очередь по истечении аренды
+        job['payload'] = self.prepare_analysis(job['analysis'])
+        return job
+
+    def _stage_persist(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        # Не сохраненный анализ отбрасывает лог до создания issue: иначе после истечения
+        # аренды лог будет взят снова и issue создастся второй раз
+        self.save_analysis(job['log_id'], job['payload'])
+        return job
+
+    def _stage_issue(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        job['issue_url'] = self.create_issue(job['payload'], job['log_data'])
+        return job
+
+    def _stage_notify(self, job: Dict[str, Any]) -> None:
+        self.send_telegram_message(job['analysis'], job['issue_url'])
+
+    async def process_pending_async(self) -> int:
+        """Разбирает очередь конвейером, пока сервер выдает логи"""
+        pipeline = self.build_pipeline()
+        self.claimed = 0
+        started = time.perf_counter()
+        processed = await pipeline.run(self._claimed_jobs(pipeline))
+
+        if processed:
+            logger.info(f"Обработано {processed.get('notify', 0)} ошибок за {time.perf_counter() - started:.1f} с")
+            pipeline.log_stats()
+            self.analysis_cache.log_stats()
+            self.prompt_builder.log_stats()
+            ttft = sorted(self.llm_timings['ttft'])
+            total = sorted(self.llm_timings['total'])
+            logger.info(
+                f"DeepSeek: запросов {self.llm_stats['requests']}, ошибок разобрано пакетами "
+                f"{self.llm_stats['batched_errors']}, повторно по одной {self.llm_stats['fallbacks']}, "
+                f"остановлено по концу JSON {self.llm_stats['stopped_early']}, "
+                f"исправлений ответа {self.llm_stats['repairs']}, "
+                f"первый токен p50 {ttft[len(ttft) // 2] if ttft else 0:.2f} с, "
+                f"ответ p50 {total[len(total) // 2] if total else 0:.2f} с"
+            )
+            self.http.log_stats()
+        return self.claimed
 
-                    # Отправляем в Telegram
-                    self.send_telegram_message(analysis, issue_url)
+    def process_pending(self) -> int:
+        """Разбирает очередь, пока сервер выдает логи, возвращает количество обработанных"""
+        return asyncio.run(self.process_pending_async())
 
-                    # Небольшая пауза между сообщениями
-                    time.sleep(2)
+    def run_analysis_cycle(self, interval_minutes: int = 30):
+        """Основной цикл анализа"""
+        logger.info("Запуск сервиса анализа логов...")
 
-                logger.info(f"Обработано {len(logs)} ошибок")
+        while True:
+            try:
+                if not self.process_pending():
+                    logger.info("Новых ошибок не обнаружено")
             except Exception as e:
                 traceback.print_exception(*sys.exc_info())
                 logger.error(f"Критическая ошибка в цикле анализа: {e}")
@@ -342,11 +591,50 @@ class LogAnalyzerService:
             # Ожидание следующего цикла
             time.sleep(interval_minutes * 60)
 
+    def run_stream_cycle(self, reconnect_seconds: int = 5):
+        """
+        Цикл анализа по событиям: вместо сна слушает поток новых логов сервера
+        и разбирает очередь, как только приходит лог Django
+        """
+        logger.info("Запуск сервиса анализа логов в режиме потока...")
+
+        while True:
+            try:
+                # При (пере)подключении забираем то, что пришло, пока потока не было
+                self.process_pending()
+
+                with self.http.get(
+                    f"{self.api_url}/stream",
+                    params={'service': 'django'},
+                    stream=True,
+                    timeout=(10, 60)  # сервер шлет heartbeat каждые 15 секунд
+                ) as response:
+                    response.raise_for_status()
+                    logger.info("Подключен поток новых логов")
+
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith('data:'):
+                            continue
+
+                        event = json.loads(line[len('data:'):])
+                        # Лог уже разобран вместе с предыдущей пачкой
+                        if event.get('id') <= self.last_seen_id:
+                            continue
+
+                        self.process_pending()
+            except Exception as e:
+                traceback.print_exception(*sys.exc_info())
+                logger.error(f"Обрыв потока новых логов: {e}")
+
+            time.sleep(reconnect_seconds)
+
 # Конфигурация
 CONFIG = {
     'telegram_bot_token': TELEGRAM_TOKEN,
     'telegram_chat_id': TELEGRAM_ID,
-    'check_interval_minutes': 30
+    'check_interval_minutes': 30,
+    # poll - опрос раз в check_interval_minutes, stream - по событиям /api/logs/stream
+    'mode': os.getenv('AGENT_MODE', 'poll')
 }
 
 if __name__ == "__main__":
@@ -355,4 +643,7 @@ if __name__ == "__main__":
         telegram_chat_id=CONFIG['telegram_chat_id']
     )
 
-    service.run_analysis_cycle(interval_minutes=CONFIG['check_interval_minutes'])
\ No newline at end of file
+    if CONFIG['mode'] == 'stream':
+        service.run_stream_cycle()
+    else:
+        service.run_analysis_cycle(interval_minutes=CONFIG['check_interval_minutes'])
\ No newline at end of file
@@ -3,6 +3,7 @@ import json
 import time
 import logging
 from utils.django import prepare_ai_request
+from utils.prompt import PromptBuilder
 from typing import List, Dict
 from llama_cpp import Llama
 
@@ -10,12 +11,16 @@ from llama_cpp import Llama
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Контекст модели и длина ответа: промпт должен поместиться в оставшееся
+MODEL_N_CTX = 4000
+MAX_ANSWER_TOKENS = 1024
+
 
 class LogAnalyzerService:
     def __init__(self, model_path: str, telegram_bot_token: str, telegram_chat_id: str):
         self.llm = Llama(
             model_path=model_path,
-            n_ctx=4000,
+            n_ctx=MODEL_N_CTX,
             n_threads=8,
             n_gpu_layers=0,
             temperature=0.1,
@@ -29,6 +34,16 @@ class LogAnalyzerService:
         # logger.info(f"Количество параметров: {self.llm.n_params()}")
         logger.info(f"Размер словаря: {self.llm.n_vocab()}")
 
+        # Запас на системное сообщение и разметку чата
+        self.prompt_builder = PromptBuilder(
+            max_tokens=MODEL_N_CTX - MAX_ANSWER_TOKENS - 200,
+            budgets={'body': 0},
+            closing="Будь конкретным и практичным в рекомендациях, ответ дай на русском языке!",
+            include_user=False,
+            # Оценка по символам занижает русский текст, контекст считается токенизатором модели
+            counter=lambda text: len(self.llm.tokenize(text.encode('utf-8'), add_bos=False))
+        )
+
         self.telegram_bot_token = telegram_bot_token
         self.telegram_chat_id = telegram_chat_id
         self.api_url = "https://solar.ninja360.ru/api/logs"
@@ -81,7 +96,7 @@ class LogAnalyzerService:
             # Выполняем запрос к модели
             response = self.llm.create_chat_completion(
                 messages=messages,
-                max_tokens=1024,
+                max_tokens=MAX_ANSWER_TOKENS,
                 frequency_penalty=0.5,
                 temperature=0.3,  # Низкая температура для детерминированных ответов
                 stop=["</analysis>", "###", "---", "\n\n"]
@@ -127,74 +142,9 @@ class LogAnalyzerService:
         """
         Создает текстовый промпт из структурированного запроса
         """
-        prompt = f"""
-                    Ты — AIssueGenius, эксперт по созданию технических issue.             
-                    На основе анализа ошибки создай структурированное issue для разработчиков.
-
-                    ДАННЫЕ ДЛЯ АНАЛИЗА:
-
-                    КОНТЕКСТ ОШИБКИ:
-                    - Время: {ai_request['error_context']['timestamp']}
-                    - Окружение: {ai_request['error_context']['environment']}
-                    - Приложение: {ai_request['error_context']['application']}
-                    - Сервис: {ai_request['error_context']['service']}
-                    - Метод: {ai_request['error_context']['request_method']}
-                    - Путь: {ai_request['error_context']['request_path']}
-
-                    ДЕТАЛИ ОШИБКИ:
-                    Тип: {ai_request['error_details']['type']}
-                    Сообщение: {ai_request['error_details']['message']}
-
-                    TRACEBACK:
-                    {chr(10).join(ai_request['error_details']['traceback'][-5:])}
-
-                    КОД С ОШИБКОЙ:
-                    Файл: {ai_request['error_details']['code_context'].get('file', 'unknown')}
-                    Строка: {ai_request['error_details']['code_context'].get('line', 'unknown')}
-                    Код: {ai_request['error_details']['code_context'].get('code_snippet', 'unknown')}
-
-                    ОКРУЖЕНИЕ:
-                    Python: {ai_request['environment_info']['python_version']}
-                    Django: {ai_request['environment_info']['django_version']}
-                    Debug: {ai_request['environment_info']['debug_mode']}
-                    Database: {ai_request['environment_info']['database_engine']}
-
-                    ИНСТРУКЦИЯ ДЛЯ СОЗДАНИЯ ISSUE:
-                    1. Title: Краткое описательное название (максимум 10 слов)                
-                    2. Description:                
-                        - Краткое описание проблемы                
-                        - Шаги для воспроизведения (если применимо)                
-                    3. Labels: Добавь соответствующие метки (через запятую)                
-                    4. Priority: Определи приоритет (Critical, High, Medium, Low)                
-                    5. Assignee: Укажи suggested assignee (backend, frontend, devops, database)                
-                    6. Milestone: Предложи milestone если это критичный баг                
-                    7 .Checklist: Создай чеклист для решения проблемы
-
-                    ФОРМАТ ВЫВОДА:
-                    Выведи результат строго в формате JSON:
-                    {{
-                      "title": "string",
-                      "description": "string",
-                      "labels": "string,string,string",
-                      "priority": "Critical|High|Medium|Low",
-                      "assignee": "backend|frontend|devops|database",
-                      "milestone": "string|null",
-                      "checklist": [
-                        "Шаг 1: Описание действия",
-                        "Шаг 2: Описание действия"
-                      ]
-                    }}
-
-                    ПРИМЕР ХОРОШЕГО ISSUE:
-                    Title: "Тайм-аут соединения с базой данных в приложении Django"
-                    Priority: "High"
-                    Labels: "bug,database,backend"
-                    Assignee: "backend"
-
-                    Будь конкретным и практичным в рекомендациях, ответ дай на русском языке!
-                """
-        logger.info(prompt)
-        return prompt
+        prompt = self.prompt_builder.build(ai_request)
+        logger.info(f"Промпт ~{prompt.tokens} токенов, обрезано ~{prompt.truncated_tokens}")
+        return prompt.text
 
 
     def save_analysis(self, log_id: int, analysis: str):
@@ -226,7 +176,10 @@ class LogAnalyzerService:
                 # Анализируем каждую ошибку
                 for log in logs:
                     log_id = log.get('id')
-                    log_data = json.loads(log.get('log'))
+                    log_data = log.get('log')
+                    # Старые версии сервера отдают jsonb строкой
+                    if isinstance(log_data, str):
+                        log_data = json.loads(log_data)
 
                     analysis = self.analyze_log(log_data)
 
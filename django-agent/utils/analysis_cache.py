@@ -0,0 +1,63 @@
+import logging
+from typing import Any, Dict, Optional
+
+from diskcache import Cache
+
+logger = logging.getLogger(__name__)
+
+# Грубая оценка для ответов без usage: около 4 символов на токен
+CHARS_PER_TOKEN = 4
+
+
+class AnalysisCache:
+    """
+    Дисковый кэш ответов LLM по fingerprint ошибки, который присылает сервер.
+    Лог без fingerprint (старые версии сервера) не кэшируется: ключ None.
+
+    Записи живут ttl_seconds; при превышении size_limit diskcache вытесняет
+    давно не использованные. Кэш переживает перезапуск агента.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int = 7 * 24 * 3600, size_limit: int = 256 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.cache = Cache(directory, size_limit=size_limit, eviction_policy='least-recently-used')
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        entry = self.cache.get(f"analysis:{key}") if key else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.tokens_saved += entry['tokens']
+        return entry['analysis']
+
+    def set(self, key: Optional[str], analysis: str, tokens: Optional[int] = None):
+        """Сохраняет ответ; tokens - расход на запрос, без usage оценивается по длине"""
+        if not key:
+            return
+        if tokens is None:
+            tokens = len(analysis) // CHARS_PER_TOKEN
+        self.cache.set(f"analysis:{key}", {'analysis': analysis, 'tokens': tokens}, expire=self.ttl_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'tokens_saved': self.tokens_saved,
+            'entries': len(self.cache),
+            'size_bytes': self.cache.volume(),
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"Кэш анализа: попаданий {stats['hits']}, промахов {stats['misses']} "
+            f"(hit rate {stats['hit_rate']:.1%}), сэкономлено ~{stats['tokens_saved']} токенов, "
+            f"записей {stats['entries']}, {stats['size_bytes'] // 1024} КБ"
+        )
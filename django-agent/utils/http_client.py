@@ -0,0 +1,261 @@
+import random
+import threading
+import time
+import logging
+from collections import Counter, defaultdict, deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+# Ответы, после которых запрос повторяется: сервис перегружен или временно недоступен
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# После 500/502/504 сервер мог уже выполнить запрос: неидемпотентные повторяются только
+# после этих ответов, когда запрос точно не выполнялся
+REJECTED_STATUSES = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# Последние задержки хоста для перцентилей
+LATENCY_WINDOW = 500
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """Хост отключен предохранителем после серии ошибок"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель хоста: после failure_threshold ошибок подряд запросы
+    сразу отклоняются reset_seconds секунд, затем пропускается один пробный.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self._probe or time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # Пока пробный запрос не вернулся, остальные отклоняются
+            if self._probe or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self._probe = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probe = False
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Retry-After в секундах: число или HTTP-дата"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def connect_failed(error: Exception) -> bool:
+    """Ошибка до отправки запроса: соединение не установлено, сервер запрос не получил"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = error.args[0]
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, NewConnectionError)
+
+
+class HttpClient:
+    """
+    Общий HTTP-клиент агента.
+
+    Соединения с каждым хостом переиспользуются (keep-alive пул requests.Session),
+    у каждого запроса есть таймауты подключения и чтения. Ответы 429/5xx и ошибки
+    соединения повторяются с экспоненциальной задержкой и случайным разбросом,
+    Retry-After сервера учитывается; неидемпотентные запросы (POST) - только если
+    сервер их точно не выполнил. У каждого хоста свой предохранитель.
+    """
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, retries: int = 3,
+                 backoff_seconds: float = 0.5, backoff_max_seconds: float = 30.0, max_retry_after: float = 60.0,
+                 pool_size: int = 10, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        # Больший Retry-After не ждем: ответ сразу возвращается вызывающему
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self.session = requests.Session()
+        # Повторы делает сам клиент, у адаптера они отключены
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.counters: Dict[str, Counter] = defaultdict(Counter)
+        self.latencies: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._lock = threading.Lock()
+
+    def _breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return self.breakers[host]
+
+    def _count(self, host: str, name: str, latency: Optional[float] = None):
+        with self._lock:
+            self.counters[host][name] += 1
+            if latency is not None:
+                self.latencies[host].append(latency)
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед повтором attempt: случайная в пределах base * 2^attempt (full jitter)"""
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def request(self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+        """
+        Запрос с повторами; возвращает последний ответ, статус проверяет вызывающий.
+        :param idempotent: повторять ли после ошибок, когда сервер мог выполнить запрос
+            (обрыв соединения, таймаут чтения, 500/502/504); по умолчанию - по методу.
+            Неидемпотентные повторяются только после ошибки подключения и 429/503
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+
+        host = urlsplit(url).netloc
+        breaker = self._breaker(host)
+
+        attempt = 0
+        response = None
+        while True:
+            if not breaker.allow():
+                self._count(host, 'circuit_rejected')
+                # Предохранитель сработал между повторами: вызывающий получает последний ответ
+                if response is not None:
+                    return response
+                raise CircuitOpen(f"Хост {host} временно отключен после серии ошибок")
+
+            started = time.perf_counter()
+            if response is not None:
+                # Соединение предыдущего ответа (в том числе потокового) возвращается в пул
+                response.close()
+                response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._count(host, 'errors', time.perf_counter() - started)
+                breaker.record_failure()
+                # Соединение оборвалось после отправки или истек таймаут чтения:
+                # сервер мог выполнить запрос, неидемпотентный не повторяем
+                retryable = idempotent or connect_failed(e)
+                if not retryable or attempt >= self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"{method} {host}: {e}, повтор через {delay:.1f} с")
+            except BaseException:
+                # Любая другая ошибка тоже считается отказом хоста, иначе пробный запрос
+                # полуоткрытого предохранителя не завершится и хост останется отключенным
+                self._count(host, 'errors', time.perf_counter() - started)
+                breaker.record_failure()
+                raise
+            else:
+                self._count(host, 'requests', time.perf_counter() - started)
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+                retryable = response.status_code in (RETRY_STATUSES if idempotent else REJECTED_STATUSES)
+                if not retryable or attempt >= self.retries:
+                    return response
+
+                delay = self.backoff(attempt)
+                retry_after = retry_after_seconds(response)
+                if retry_after is not None:
+                    if retry_after > self.max_retry_after:
+                        return response
+                    delay = max(delay, retry_after)
+                logger.warning(f"{method} {host}: HTTP {response.status_code}, повтор через {delay:.1f} с")
+
+            self._count(host, 'retries')
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Счетчики, задержки (p50/p95/max, мс) и состояние предохранителя по хостам"""
+        with self._lock:
+            hosts = {}
+            for host, counters in self.counters.items():
+                latencies = sorted(self.latencies[host])
+                breaker = self.breakers.get(host)
+                hosts[host] = {
+                    'requests': counters['requests'],
+                    'errors': counters['errors'],
+                    'retries': counters['retries'],
+                    'circuit_rejected': counters['circuit_rejected'],
+                    'circuit': breaker.state if breaker else 'closed',
+                    'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                    'latency_p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+                    'latency_max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+                }
+            return hosts
+
+    def log_stats(self):
+        for host, stats in self.stats().items():
+            logger.info(
+                f"HTTP {host}: запросов {stats['requests']}, ошибок {stats['errors']}, "
+                f"повторов {stats['retries']}, отклонено предохранителем {stats['circuit_rejected']} "
+                f"({stats['circuit']}), p50 {stats['latency_p50_ms']} мс, p95 {stats['latency_p95_ms']} мс"
+            )
+
+    def close(self):
+        self.session.close()
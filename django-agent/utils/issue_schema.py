@@ -0,0 +1,162 @@
+import re
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+PRIORITIES = ('critical', 'high', 'medium', 'low')
+ASSIGNEES = ('backend', 'frontend', 'devops', 'database')
+# Обязательные поля issue и их типы; milestone необязателен
+REQUIRED_FIELDS = {
+    'title': str,
+    'description': str,
+    'labels': str,
+    'priority': str,
+    'assignee': str,
+    'checklist': list,
+}
+
+_JSON_BLOCK = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+
+
+def validate_issue(item: Any) -> List[str]:
+    """Ошибки схемы issue из ответа модели; пустой список - issue годится для create_issue"""
+    if not isinstance(item, dict):
+        return ['ответ не JSON-объект']
+
+    errors = []
+    for name, kind in REQUIRED_FIELDS.items():
+        value = item.get(name)
+        if not isinstance(value, kind):
+            errors.append(f"поле {name}: ожидается {kind.__name__}")
+        elif kind is str and not value.strip() and name != 'labels':
+            errors.append(f"поле {name} пустое")
+
+    for name, allowed in (('priority', PRIORITIES), ('assignee', ASSIGNEES)):
+        if isinstance(item.get(name), str) and item[name].strip().lower() not in allowed:
+            errors.append(f"поле {name}: {item[name]} не из {', '.join(allowed)}")
+    if isinstance(item.get('checklist'), list) and not all(isinstance(step, str) for step in item['checklist']):
+        errors.append('поле checklist: ожидается список строк')
+    return errors
+
+
+def extract_json(content: str) -> Any:
+    """JSON из ответа модели: из блока ```json```, иначе от первой скобки до последней"""
+    match = _JSON_BLOCK.search(content)
+    if match:
+        return json.loads(match.group(1))
+
+    starts = [index for index in (content.find('['), content.find('{')) if index >= 0]
+    if not starts:
+        raise ValueError('в ответе нет JSON')
+    start = min(starts)
+    end = content.rfind(']' if content[start] == '[' else '}')
+    return json.loads(content[start:end + 1])
+
+
+def format_analysis(issue: Dict[str, Any]) -> str:
+    """Issue в виде ответа модели: блок ```json```, как его разбирает prepare_analysis"""
+    return f"```json\n{json.dumps(issue, ensure_ascii=False, indent=2)}\n```"
+
+
+def parse_batch_answer(answer: Any, log_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Issue по log_id из разобранного ответа на пакетный промпт.
+    В результат попадают только прошедшие проверку схемы issue запрошенных логов;
+    остальные логи вызывающий анализирует по одному.
+    """
+    if isinstance(answer, dict):
+        # Модель иногда оборачивает массив в объект
+        answer = next((value for value in answer.values() if isinstance(value, list)), [answer])
+    if not isinstance(answer, list):
+        raise ValueError('ответ не JSON-массив')
+
+    expected = set(log_ids)
+    issues = {}
+    for item in answer:
+        if not isinstance(item, dict):
+            continue
+        log_id = _log_id(item.get('log_id'))
+        if log_id not in expected or log_id in issues or validate_issue(item):
+            continue
+        issues[log_id] = {key: value for key, value in item.items() if key != 'log_id'}
+    return issues
+
+
+def is_batch_answer(value: Any) -> bool:
+    """Похоже ли значение на ответ на пакетный промпт: массив с объектами issue по log_id"""
+    return isinstance(value, list) and any(isinstance(item, dict) and 'log_id' in item for item in value)
+
+
+def _log_id(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class JsonScanner:
+    """
+    Ищет первый законченный JSON-объект или массив в тексте, который приходит кусками.
+
+    Скобки считаются с учетом строк и экранирования, поэтому конец объекта виден
+    сразу по приходу закрывающей скобки, без ожидания конца ответа. Скобки в тексте
+    перед JSON, которые не дают корректного JSON или не проходят проверку accept, пропускаются.
+    """
+
+    def __init__(self, opening: str = '{[', accept: Optional[Callable[[Any], bool]] = None):
+        self.opening = opening
+        self.accept = accept
+        self.text = ''
+        self.done = False
+        self.value: Any = None
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> bool:
+        """Добавляет кусок ответа; True - JSON закончен и лежит в value"""
+        self.text += chunk
+        while not self.done and self._pos < len(self.text):
+            char = self.text[self._pos]
+            self._pos += 1
+
+            if self._start is None:
+                if char in self.opening:
+                    self._start = self._pos - 1
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete()
+        return self.done
+
+    def _complete(self):
+        try:
+            value = json.loads(self.text[self._start:self._pos])
+        except ValueError:
+            value = None
+        else:
+            if self.accept is None or self.accept(value):
+                self.value = value
+                self.done = True
+                return
+
+        # Не JSON или не тот JSON (например, [1] в тексте): продолжаем со следующего символа после открывающей скобки
+        self._pos = self._start + 1
+        self._start = None
+        self._in_string = False
+        self._escape = False
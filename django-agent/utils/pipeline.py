@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterable, Callable, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Stage(NamedTuple):
+    name: str
+    # Обработчик элемента: возвращает элемент для следующей стадии или None, чтобы отбросить его
+    handler: Callable[[Any], Any]
+    workers: int
+    # Внешний сервис стадии: его лимит одновременных вызовов общий для всех стадий
+    resource: Optional[str]
+    # Блокирующий обработчик выполняется в пуле потоков
+    blocking: bool
+    # batch_size > 1: обработчик получает список элементов, уже ждущих в очереди,
+    # и возвращает список результатов; суммарный вес пачки не больше batch_weight
+    batch_size: int
+    batch_weight: Optional[float]
+    weight: Optional[Callable[[Any], float]]
+
+
+class Pipeline:
+    """
+    Конвейер стадий, соединенных ограниченными очередями.
+
+    Каждая стадия обрабатывает элементы своими воркерами, поэтому медленная
+    стадия (например, отправка в Telegram) не задерживает предыдущие, пока
+    ее очередь не заполнится. Заполненная очередь останавливает источник:
+    в работе не бывает больше элементов, чем помещается в очереди.
+    Ошибка обработчика отбрасывает только этот элемент (пачку).
+
+    Пакетная стадия забирает элементы, которые уже ждут в очереди, но не
+    ждет новых: пачки образуются только при очереди, одиночный элемент
+    обрабатывается без задержки.
+    """
+
+    def __init__(self, resources: Dict[str, int], queue_size: int = 20):
+        self.resources = resources
+        self.queue_size = queue_size
+        self.stages: List[Stage] = []
+        self.processed: Counter = Counter()
+        self.failed: Counter = Counter()
+        self.busy_seconds: Counter = Counter()
+        self.batches: Counter = Counter()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def add_stage(self, name: str, handler: Callable[[Any], Any], workers: int = 1,
+                  resource: Optional[str] = None, blocking: bool = False, batch_size: int = 1,
+                  batch_weight: Optional[float] = None, weight: Optional[Callable[[Any], float]] = None) -> "Pipeline":
+        self.stages.append(Stage(name, handler, workers, resource, blocking, batch_size, batch_weight, weight))
+        return self
+
+    async def call(self, resource: Optional[str], func: Callable, *args) -> Any:
+        """Вызывает блокирующую функцию в пуле потоков в пределах лимита сервиса"""
+        loop = asyncio.get_running_loop()
+        if resource is None:
+            return await loop.run_in_executor(self._executor, func, *args)
+
+        async with self._semaphores[resource]:
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    async def run(self, source: AsyncIterable[Any]) -> Dict[str, int]:
+        """Прогоняет элементы источника через все стадии, возвращает число прошедших каждую стадию"""
+        # Семафоры и очереди создаются в работающем цикле событий
+        self._semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.resources.items()}
+        threads = sum(self.resources.values()) + sum(stage.workers for stage in self.stages if stage.blocking)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="pipeline")
+
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        workers = []
+        for index, stage in enumerate(self.stages):
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            for _ in range(stage.workers):
+                workers.append(asyncio.create_task(self._work(stage, queues[index], outbox)))
+
+        try:
+            async for item in source:
+                await queues[0].put(item)
+
+            # Очереди дожидаются по порядку: элемент попадает в следующую до task_done() в текущей
+            for queue in queues:
+                await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+        return dict(self.processed)
+
+    @staticmethod
+    async def _take(stage: Stage, inbox: asyncio.Queue, carry: List[Any]) -> List[Any]:
+        """Следующий элемент или пачка из уже ждущих в очереди; элемент сверх веса откладывается в carry"""
+        items = [carry.pop() if carry else await inbox.get()]
+        if stage.batch_size <= 1:
+            return items
+
+        weight = stage.weight or (lambda item: 1)
+        total = weight(items[0])
+        while len(items) < stage.batch_size and not inbox.empty():
+            item = inbox.get_nowait()
+            item_weight = weight(item)
+            if stage.batch_weight is not None and total + item_weight > stage.batch_weight:
+                carry.append(item)
+                break
+            items.append(item)
+            total += item_weight
+        return items
+
+    async def _work(self, stage: Stage, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]):
+        carry = []
+        while True:
+            items = await self._take(stage, inbox, carry)
+            argument = items if stage.batch_size > 1 else items[0]
+            started = time.perf_counter()
+            try:
+                if stage.blocking:
+                    result = await self.call(stage.resource, stage.handler, argument)
+                elif stage.resource:
+                    async with self._semaphores[stage.resource]:
+                        result = await stage.handler(argument)
+                else:
+                    result = await stage.handler(argument)
+                self.busy_seconds[stage.name] += time.perf_counter() - started
+                self.processed[stage.name] += len(items)
+                if stage.batch_size > 1:
+                    self.batches[stage.name] += 1
+
+                # Ожидание места в очереди следующей стадии - обратное давление, не работа стадии
+                results = result if stage.batch_size > 1 else [result]
+                if outbox is not None:
+                    for item in results or []:
+                        if item is not None:
+                            await outbox.put(item)
+            except Exception as e:
+                self.failed[stage.name] += len(items)
+                logger.error(f"Стадия {stage.name}: {e}", exc_info=True)
+            finally:
+                for _ in items:
+                    inbox.task_done()
+
+    def log_stats(self):
+        for stage in self.stages:
+            batches = f" пачками: {self.batches[stage.name]}," if stage.batch_size > 1 else ""
+            logger.info(
+                f"Стадия {stage.name}: обработано {self.processed[stage.name]},{batches} "
+                f"ошибок {self.failed[stage.name]}, занята {self.busy_seconds[stage.name]:.1f} с"
+            )
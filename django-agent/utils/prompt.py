@@ -0,0 +1,419 @@
+import re
+import json
+import logging
+import textwrap
+from string import Template
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+# Бюджет секций промпта в токенах по умолчанию
+DEFAULT_BUDGETS = {
+    'context': 150,
+    'error': 200,
+    'code': 150,
+    'environment': 80,
+    'traceback': 800,
+    'body': 300,
+}
+# Порядок заполнения: секции в начале получают бюджет первыми, если общий лимит исчерпан
+SECTION_ORDER = ('context', 'error', 'code', 'environment', 'traceback', 'body')
+
+DEFAULT_CLOSING = "Будь конкретным и практичным в рекомендациях!"
+
+# Статические части промпта: отступы убраны один раз при импорте, а не в каждом промпте
+ERROR_BLOCK = textwrap.dedent("""
+    $context
+
+    ДЕТАЛИ ОШИБКИ:
+    $error
+
+    TRACEBACK:
+    $traceback
+
+    КОД С ОШИБКОЙ:
+    $code
+
+    ОКРУЖЕНИЕ:
+    $environment
+""").strip()
+
+INSTRUCTIONS = textwrap.dedent("""
+    ИНСТРУКЦИЯ ДЛЯ СОЗДАНИЯ ISSUE:
+    1. Title: Краткое описательное название (максимум 10 слов)
+    2. Description:
+        - Краткое описание проблемы
+        - Шаги для воспроизведения (если применимо)
+    3. Labels: Добавь соответствующие метки (через запятую)
+    4. Priority: Определи приоритет (Critical, High, Medium, Low)
+    5. Assignee: Укажи suggested assignee (backend, frontend, devops, database)
+    6. Milestone: Предложи milestone если это критичный баг
+    7. Checklist: Создай чеклист для решения проблемы
+""").strip()
+
+ISSUE_FORMAT = textwrap.dedent("""
+    {
+      "title": "string",
+      "description": "string",
+      "labels": "string,string,string",
+      "priority": "Critical|High|Medium|Low",
+      "assignee": "backend|frontend|devops|database",
+      "milestone": "string|null",
+      "checklist": [
+        "Шаг 1: Описание действия",
+        "Шаг 2: Описание действия"
+      ]
+    }
+""").strip()
+
+EXAMPLE = textwrap.dedent("""
+    ПРИМЕР ХОРОШЕГО ISSUE:
+    Title: "Тайм-аут соединения с базой данных в приложении Django"
+    Priority: "High"
+    Labels: "bug,database,backend"
+    Assignee: "backend"
+""").strip()
+
+ISSUE_PROMPT = '\n\n'.join((
+    "Ты — AIssueGenius, эксперт по созданию технических issue.\n"
+    "На основе анализа ошибки создай структурированное issue для разработчиков.",
+    "ДАННЫЕ ДЛЯ АНАЛИЗА:",
+    "$errors",
+    INSTRUCTIONS,
+    f"ФОРМАТ ВЫВОДА:\nВыведи результат строго в формате JSON:\n{ISSUE_FORMAT}",
+    EXAMPLE,
+    "$closing",
+))
+
+# Несколько ошибок в одном запросе: инструкции и формат передаются один раз на всю пачку
+BATCH_PROMPT = '\n\n'.join((
+    "Ты — AIssueGenius, эксперт по созданию технических issue.\n"
+    "Ниже несколько независимых ошибок. Для каждой создай отдельное структурированное issue для разработчиков.",
+    "ДАННЫЕ ДЛЯ АНАЛИЗА:",
+    "$errors",
+    INSTRUCTIONS,
+    "ФОРМАТ ВЫВОДА:\n"
+    "Выведи результат строго JSON-массивом, по одному объекту на каждую ошибку. "
+    "В каждом объекте поле \"log_id\" - число из заголовка ошибки, остальные поля:\n"
+    f"{ISSUE_FORMAT}",
+    EXAMPLE,
+    "$closing",
+))
+
+# Исправление ответа, не прошедшего проверку схемы: исходный лог повторно не отправляется
+REPAIR_PROMPT = Template('\n\n'.join((
+    "Твой ответ с issue не прошел проверку. Исправь его.",
+    "ОШИБКИ:\n$errors",
+    "ОТВЕТ:\n$answer",
+    f"Выведи только исправленный JSON-объект без пояснений, строго в формате:\n{ISSUE_FORMAT}",
+)))
+
+
+def count_tokens(text: str) -> int:
+    """
+    Оценка числа токенов BPE без токенизатора модели: латинское слово - токен
+    на каждые 4 символа, слово с не-ASCII буквами (кириллица) - на каждые 2,
+    знак препинания - отдельный токен. Точный счет - токенизатором модели (PromptBuilder(counter=...))
+    """
+    return sum(
+        ((len(token) + 3) // 4 if token.isascii() else (len(token) + 1) // 2)
+        if token[0].isalnum() or token[0] == '_' else 1
+        for token in _TOKEN_PATTERN.findall(text)
+    )
+
+
+TokenCounter = Callable[[str], int]
+
+
+def truncate_text(text: str, max_tokens: int, keep: str = 'both', counter: TokenCounter = count_tokens) -> str:
+    """
+    Обрезает текст до max_tokens с пометкой о пропуске.
+    :param keep: head - начало, tail - конец, both - начало и конец
+    :param counter: счетчик токенов
+    """
+    tokens = counter(text)
+    if tokens <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ''
+
+    # Длина подбирается пропорционально и уточняется, пока не влезет в бюджет
+    chars = int(len(text) * max_tokens / tokens)
+    while True:
+        if keep == 'head':
+            result = f"{text[:chars]} …[обрезано]"
+        elif keep == 'tail':
+            result = f"[обрезано]… {text[len(text) - chars:]}"
+        else:
+            head = chars * 2 // 3
+            result = f"{text[:head]} …[обрезано]… {text[len(text) - (chars - head):]}"
+        if chars <= 0 or counter(result) <= max_tokens:
+            return result
+        chars = int(chars * 0.9)
+
+
+def summarize_value(value: Any, max_string: int = 200, max_items: int = 10, depth: int = 3) -> Any:
+    """Сокращенная копия JSON: длинные строки, списки и вложенность обрезаются с пометкой"""
+    if isinstance(value, str):
+        if len(value) > max_string:
+            return f"{value[:max_string]}…(+{len(value) - max_string} симв.)"
+        return value
+
+    if isinstance(value, dict):
+        if depth <= 0:
+            return f"{{…{len(value)} полей}}"
+        items = list(value.items())
+        result = {
+            key: summarize_value(item, max_string, max_items, depth - 1)
+            for key, item in items[:max_items]
+        }
+        if len(items) > max_items:
+            result['…'] = f"ещё {len(items) - max_items} полей"
+        return result
+
+    if isinstance(value, list):
+        if depth <= 0:
+            return f"[…{len(value)} элементов]"
+        result = [summarize_value(item, max_string, max_items, depth - 1) for item in value[:max_items]]
+        if len(value) > max_items:
+            result.append(f"…ещё {len(value) - max_items} элементов")
+        return result
+
+    return value
+
+
+def format_body(body: Any, max_tokens: int, counter: TokenCounter = count_tokens) -> str:
+    """Тело запроса в пределах max_tokens: JSON сокращается по структуре, остальное обрезается"""
+    if body is None or body == '':
+        return ''
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return truncate_text(body, max_tokens, keep='head', counter=counter)
+    if not isinstance(body, (dict, list)):
+        return truncate_text(str(body), max_tokens, keep='head', counter=counter)
+
+    text = ''
+    for max_string, max_items in ((200, 20), (80, 10), (30, 5)):
+        text = json.dumps(summarize_value(body, max_string, max_items), ensure_ascii=False, separators=(',', ':'))
+        if counter(text) <= max_tokens:
+            return text
+    return truncate_text(text, max_tokens, keep='head', counter=counter)
+
+
+def dedupe_frames(frames: List[str]) -> List[str]:
+    """Схлопывает подряд идущие одинаковые кадры traceback (рекурсия) в один с пометкой"""
+    result = []
+    repeats = 0
+    for frame in frames:
+        if result and frame == result[-1]:
+            repeats += 1
+            continue
+        if repeats:
+            result.append(f"[предыдущий кадр повторяется еще {repeats} раз]")
+            repeats = 0
+        result.append(frame)
+    if repeats:
+        result.append(f"[предыдущий кадр повторяется еще {repeats} раз]")
+    return result
+
+
+def format_traceback(traceback: Any, max_tokens: int, counter: TokenCounter = count_tokens) -> str:
+    """Последние кадры traceback, сколько влезает в max_tokens; место ошибки - в конце, он важнее"""
+    frames = traceback if isinstance(traceback, list) else str(traceback or '').splitlines()
+    frames = dedupe_frames([str(frame).rstrip() for frame in frames if str(frame).strip()])
+    if not frames:
+        return ''
+
+    selected = []
+    used = 0
+    for frame in reversed(frames):
+        tokens = counter(frame) + 1
+        if used + tokens > max_tokens:
+            # Последний кадр нужен всегда, хотя бы обрезанный
+            if not selected:
+                selected.append(truncate_text(frame, max_tokens, keep='tail', counter=counter))
+            break
+        selected.append(frame)
+        used += tokens
+
+    skipped = len(frames) - len(selected)
+    lines = ([f"[пропущено кадров: {skipped}]"] if skipped else []) + list(reversed(selected))
+    return '\n'.join(lines)
+
+
+def issue_log_excerpt(log_data: Dict[str, Any], max_tokens: int) -> str:
+    """Лог для описания issue: сокращенный JSON в пределах max_tokens"""
+    text = json.dumps(summarize_value(log_data, max_string=500, max_items=30, depth=4), ensure_ascii=False, indent=2)
+    return truncate_text(text, max_tokens, keep='head')
+
+
+class Prompt(NamedTuple):
+    text: str
+    tokens: int
+    # Токены по секциям после обрезки
+    sections: Dict[str, int]
+    # Сколько токенов сэкономлено обрезкой
+    truncated_tokens: int
+
+
+class PromptBuilder:
+    """
+    Промпт анализа ошибки Django в пределах бюджета токенов.
+
+    Каждая секция (контекст, ошибка, traceback, body, окружение) ограничена
+    своим бюджетом, а все вместе - max_tokens. Повторяющиеся значения
+    (приложение = сервис, код уже есть в traceback) в промпт не попадают.
+    Несколько ошибок можно описать одним промптом (build_batch).
+    Токены считает counter: по умолчанию оценка count_tokens, для локальной
+    модели - ее токенизатор, чтобы промпт точно поместился в контекст.
+    """
+
+    def __init__(self, max_tokens: int = 3000, budgets: Optional[Dict[str, int]] = None,
+                 closing: str = DEFAULT_CLOSING, include_user: bool = True,
+                 counter: TokenCounter = count_tokens):
+        self.max_tokens = max_tokens
+        self.count = counter
+        self.budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+        self.include_user = include_user
+        self.error_template = Template(ERROR_BLOCK)
+        self.template = Template(Template(ISSUE_PROMPT).safe_substitute(closing=closing))
+        self.batch_template = Template(Template(BATCH_PROMPT).safe_substitute(closing=closing))
+        self.static_tokens = counter(self.template.substitute(errors=''))
+        self.batch_static_tokens = counter(self.batch_template.substitute(errors=''))
+
+        self.prompts = 0
+        self.errors = 0
+        self.tokens = 0
+        self.truncated_tokens = 0
+
+    def _context(self, ai_request: Dict[str, Any]) -> List[str]:
+        context = ai_request['error_context']
+        lines = []
+        if self.include_user:
+            user = ai_request['user']
+            lines += [
+                'ИНФОРМАЦИЯ О ПОЛЬЗОВАТЕЛЕ:',
+                f"- Пользователь авторизован. USER ID: {user['id']}" if user['is_authenticated'] else '- Анонимный',
+                '',
+            ]
+        lines += [
+            'КОНТЕКСТ ОШИБКИ:',
+            f"- Время: {context['timestamp']}",
+            f"- Окружение: {context['environment']}",
+        ]
+        if context['application'] != context['service']:
+            lines.append(f"- Приложение: {context['application']}")
+        lines += [
+            f"- Сервис: {context['service']}",
+            f"- Метод: {context['request_method']}",
+            f"- Путь: {context['request_path']}",
+        ]
+        return lines
+
+    def error_block(self, ai_request: Dict[str, Any]) -> Prompt:
+        """Данные одной ошибки без инструкций; бюджет - max_tokens за вычетом статической части"""
+        details = ai_request['error_details']
+        environment = ai_request['environment_info']
+        code_context = details['code_context']
+
+        # Сырые секции до обрезки
+        raw = {
+            'context': '\n'.join(self._context(ai_request)),
+            'error': f"Тип: {details['type']}\nСообщение: {details['message']}",
+            'environment': (
+                f"Python: {environment['python_version']}\n"
+                f"Django: {environment['django_version']}\n"
+                f"Debug: {environment['debug_mode']}\n"
+                f"Database: {environment['database_engine']}"
+            ),
+        }
+        code_lines = [f"Файл: {code_context.get('file', 'unknown')}", f"Строка: {code_context.get('line', 'unknown')}"]
+        snippet = code_context.get('code_snippet')
+        traceback_text = '\n'.join(str(frame) for frame in details['traceback'] or [])
+        # Строка кода уже есть в traceback - второй раз не нужна
+        if snippet and snippet not in traceback_text:
+            code_lines.append(f"Код: {snippet}")
+        raw['code'] = '\n'.join(code_lines)
+
+        remaining = self.max_tokens - self.static_tokens
+        sections = {}
+        section_tokens = {}
+        truncated = 0
+        for name in SECTION_ORDER:
+            budget = max(0, min(self.budgets.get(name, 0), remaining))
+            if name == 'traceback':
+                text = format_traceback(details['traceback'], budget, self.count)
+                full = self.count(traceback_text)
+            elif name == 'body':
+                body = ai_request['error_context'].get('request_body')
+                text = format_body(body, budget, self.count) if budget else ''
+                full = self.count(body if isinstance(body, str) else json.dumps(body, ensure_ascii=False))
+            else:
+                text = truncate_text(raw[name], budget, keep='head', counter=self.count)
+                full = self.count(raw[name])
+
+            tokens = self.count(text)
+            sections[name] = text
+            section_tokens[name] = tokens
+            truncated += max(0, full - tokens)
+            remaining -= tokens
+
+        if sections['body']:
+            sections['context'] += f"\n- Body: {sections.pop('body')}"
+        else:
+            sections.pop('body')
+
+        text = self.error_template.substitute(sections)
+        return Prompt(text, self.count(text), section_tokens, truncated)
+
+    def _count(self, prompt: Prompt, errors: int) -> Prompt:
+        self.prompts += 1
+        self.errors += errors
+        self.tokens += prompt.tokens
+        self.truncated_tokens += prompt.truncated_tokens
+        return prompt
+
+    def single(self, block: Prompt) -> Prompt:
+        """Промпт одной ошибки из готового блока данных"""
+        text = self.template.substitute(errors=block.text)
+        return self._count(Prompt(text, self.count(text), block.sections, block.truncated_tokens), 1)
+
+    def build(self, ai_request: Dict[str, Any]) -> Prompt:
+        return self.single(self.error_block(ai_request))
+
+    def build_batch(self, blocks: List[Tuple[Any, Prompt]]) -> Prompt:
+        """Один промпт на несколько ошибок: blocks - пары (log_id, блок данных ошибки)"""
+        errors = '\n\n'.join(f"=== ОШИБКА log_id={log_id} ===\n{block.text}" for log_id, block in blocks)
+        text = self.batch_template.substitute(errors=errors)
+        sections = {'errors': sum(block.tokens for _, block in blocks)}
+        truncated = sum(block.truncated_tokens for _, block in blocks)
+        return self._count(Prompt(text, self.count(text), sections, truncated), len(blocks))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'prompts': self.prompts,
+            'errors': self.errors,
+            'tokens': self.tokens,
+            'avg_tokens_per_error': round(self.tokens / self.errors) if self.errors else 0,
+            'truncated_tokens': self.truncated_tokens,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"Промпты: {stats['prompts']} на {stats['errors']} ошибок, ~{stats['tokens']} токенов "
+            f"(в среднем {stats['avg_tokens_per_error']} на ошибку), "
+            f"обрезкой сэкономлено ~{stats['truncated_tokens']} токенов"
+        )
+
+
+def repair_prompt(answer: str, errors: List[str], max_tokens: int = 1500) -> str:
+    """Короткий промпт исправления ответа: сам ответ и список ошибок схемы"""
+    return REPAIR_PROMPT.substitute(
+        errors='\n'.join(f"- {error}" for error in errors),
+        answer=truncate_text(answer, max_tokens, keep='head')
+    )
@@ -0,0 +1,120 @@
+"""
+Сравнение стоимости JSON для ответа GET /api/logs: до и после перехода на orjson.
+
+До: asyncpg отдает jsonb строкой, FastAPI прогоняет ответ через jsonable_encoder
+и json.dumps, агент делает json.loads ответа и json.loads поля log в каждой строке.
+
+После: кодек пула разбирает jsonb через orjson.loads при чтении строк,
+ORJSONResponse сериализует ответ orjson.dumps, агенту достаточно одного разбора.
+
+Запуск: python benchmarks/json_responses.py
+"""
+import json
+import time
+import random
+from datetime import datetime, timezone, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+
+def make_log(index: int) -> dict:
+    """Синтетический лог Django в формате, который присылает middleware"""
+    return {
+        "service": "django",
+        "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+        "level": "ERROR",
+        "environment": "production",
+        "application": "shop",
+        "request_id": f"req-{index:08d}",
+        "user": {"is_authenticated": True, "id": random.randint(1, 10000)},
+        "request": {
+            "method": "POST",
+            "path": "/api/orders/",
+            "client_ip": "10.0.0.1",
+            "body": json.dumps({"items": [{"sku": i, "qty": 1} for i in range(5)]}),
+        },
+        "error": {
+            "type": "IntegrityError",
+            "message": f'duplicate key value violates unique constraint "orders_pkey" (id={index})',
+            "traceback": [
+                f'  File "/opt/app/orders/views.py", line {40 + i}, in create\n    order.save()'
+                for i in range(12)
+            ],
+        },
+        "versions": {"python": "3.12.1", "django": "5.0.2"},
+        "settings": {"debug": False, "database_engine": "django.db.backends.postgresql"},
+    }
+
+
+def make_rows(count: int):
+    """Строки в том виде, в каком их возвращает asyncpg до и после"""
+    now = datetime.now(tz=timezone.utc)
+    logs = [make_log(i) for i in range(count)]
+    raw = [json.dumps(log) for log in logs]
+
+    def row(i, log):
+        return {
+            "id": i,
+            "timestamp": now - timedelta(seconds=i),
+            "service": "django",
+            "log": log,
+            "ai_analysis": None,
+            "analysis_time": None,
+        }
+
+    return [row(i, text) for i, text in enumerate(raw)], raw
+
+
+def bench(func, repeat: int) -> float:
+    """Лучшее время из repeat запусков в миллисекундах"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def run(count: int, repeat: int):
+    text_rows, raw_logs = make_rows(count)
+
+    # До: jsonb строкой, jsonable_encoder + json.dumps, двойной разбор у агента
+    def old_server():
+        return JSONResponse(jsonable_encoder({"count": count, "logs": text_rows})).body
+
+    old_body = old_server()
+
+    def old_agent():
+        for row in json.loads(old_body)["logs"]:
+            json.loads(row["log"])
+
+    # После: orjson.loads в кодеке jsonb (для каждой строки) + orjson.dumps ответа
+    def new_server():
+        rows = [dict(row, log=orjson.loads(raw)) for row, raw in zip(text_rows, raw_logs)]
+        return ORJSONResponse({"count": count, "logs": rows}).body
+
+    new_body = new_server()
+
+    def new_agent():
+        json.loads(new_body)["logs"]
+
+    results = {
+        "server_old_ms": bench(old_server, repeat),
+        "server_new_ms": bench(new_server, repeat),
+        "agent_old_ms": bench(old_agent, repeat),
+        "agent_new_ms": bench(new_agent, repeat),
+    }
+
+    print(f"\n{count} строк (тело ответа: до {len(old_body)} байт, после {len(new_body)} байт)")
+    for side in ("server", "agent"):
+        old = results[f"{side}_old_ms"]
+        new = results[f"{side}_new_ms"]
+        print(f"  {side:<6} до {old:9.2f} мс   после {new:9.2f} мс   ускорение x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    run(100, repeat=50)
+    run(10000, repeat=5)
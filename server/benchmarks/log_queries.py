@@ -0,0 +1,80 @@
+"""
+Размер и время ответа GET /api/logs: все колонки против проекции fields=,
+без сжатия против gzip и zstd.
+
+Нужен запущенный сервер; --load N предварительно загружает N синтетических
+логов Django через POST /api/logs/batch.
+
+Запуск: python benchmarks/log_queries.py --url http://127.0.0.1:9000 --load 2000 --limit 1000
+"""
+import argparse
+import statistics
+import time
+import urllib.parse
+import urllib.request
+
+import orjson
+
+from json_responses import make_log
+
+# Набор полей списка ошибок в дашборде
+DASHBOARD_FIELDS = "id,timestamp,service,error_type,log.error.message,ai_analysis.problem_description"
+
+
+def load(base_url: str, count: int, batch_size: int = 500):
+    for start in range(0, count, batch_size):
+        body = orjson.dumps([make_log(i) for i in range(start, min(count, start + batch_size))])
+        request = urllib.request.Request(
+            f"{base_url}/api/logs/batch", data=body, headers={"Content-Type": "application/json"}
+        )
+        urllib.request.urlopen(request).read()
+
+
+def fetch(url: str, encoding: str) -> bytes:
+    request = urllib.request.Request(url, headers={"Accept-Encoding": encoding or "identity"})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def bench(url: str, encoding: str, repeat: int):
+    """Размер тела на проводе и медиана времени ответа в миллисекундах"""
+    body = fetch(url, encoding)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fetch(url, encoding)
+        timings.append((time.perf_counter() - started) * 1000)
+    return len(body), statistics.median(timings)
+
+
+def run(base_url: str, limit: int, hours: int, repeat: int):
+    variants = {
+        "все колонки": {"limit": limit, "hours": hours},
+        "fields=": {"limit": limit, "hours": hours, "fields": DASHBOARD_FIELDS},
+    }
+
+    print(f"\n{limit} строк, медиана из {repeat} запросов")
+    baseline = None
+    for name, params in variants.items():
+        url = f"{base_url}/api/logs?{urllib.parse.urlencode(params)}"
+        for encoding in ("", "gzip", "zstd"):
+            size, latency = bench(url, encoding, repeat)
+            baseline = baseline or (size, latency)
+            print(
+                f"  {name:<12} {encoding or 'identity':<9} {size:>11} байт ({size / baseline[0]:6.1%})"
+                f"   {latency:8.2f} мс"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:9000")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--load", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.load:
+        load(args.url.rstrip("/"), args.load)
+    run(args.url.rstrip("/"), args.limit, args.hours, args.repeat)
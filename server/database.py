@@ -1,33 +1,140 @@
 import os
-import json
+import asyncio
+import time
 import asyncpg
-import bcrypt
-from typing import Optional, Dict, Any, List
-from datetime import datetime
+import orjson
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple, Callable
+from datetime import datetime, timezone
+
+from utils.metrics import metrics
+from utils.events import NEW_LOGS_CHANNEL, pack_log_events
+from utils.fingerprint import compute_fingerprint, error_summary
+from utils.ttl_cache import TTLCache, MISSING
+from utils.password_hasher import PasswordHasher
+from utils.log_fields import HOT_FIELDS, extract_log_fields
+from utils.blobs import (
+    BLOB_PATHS, BLOB_TOUCH_SECONDS, BLOB_WRITE_CACHE_SECONDS, split_log, join_log, blob_refs, blob_rows
+)
+from utils.projection import Field, extract_path
+
+# Сообщение группы ошибок хранится в усеченном виде, полный текст есть в логах
+GROUP_MESSAGE_MAX_LENGTH = 1000
+
+# Колонки строки лога, если проекция fields= не задана
+LOG_SELECT = "id, timestamp, service, fingerprint, log, ai_analysis, analysis_time"
+
+# Ошибки вставки из-за самих записей, а не БД: повтор той же пачки их не исправит.
+# TypeError/ValueError - от кодека orjson (например, целое шире 64 бит)
+INSERT_DATA_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError, TypeError, ValueError)
+
+# Анализ группы устарел ({ttl} - параметр дней жизни анализа) или ошибка вернулась после
+# затишья ({quiet} - дней без повторов): группа снова ждет анализа. NULL-параметр отключает правило
+GROUP_REOPEN_SQL = """
+    error_groups.analysis_time < NOW() - {ttl} * INTERVAL '1 day'
+    OR error_groups.last_seen < NOW() - {quiet} * INTERVAL '1 day'
+"""
 
 
 class Database:
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        self.dsn: Optional[str] = None
+        self.pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+        # Отпечаток лога при вставке: точный или кластер похожих ошибок (utils/clustering.py)
+        self.fingerprinter: Callable[[str, Dict[Any, Any]], str] = compute_fingerprint
+        # Пачка больше стольких логов получает отпечатки в отдельном потоке: MinHash новых
+        # ошибок стоит ~2 мс на лог и не должен останавливать цикл событий
+        self.fingerprint_inline_records = int(os.getenv("FINGERPRINT_INLINE_RECORDS", "20"))
+        # Повторение проанализированной ошибки получает анализ группы, пока он не устарел.
+        # Группа открывается заново (анализ сбрасывается, новый лог уходит агентам), если анализу
+        # больше GROUP_ANALYSIS_TTL_DAYS дней или ошибка не повторялась GROUP_REOPEN_AFTER_DAYS дней
+        # и вернулась (регрессия после исправления). 0 отключает соответствующее правило
+        self.group_analysis_ttl_days = float(os.getenv("GROUP_ANALYSIS_TTL_DAYS", "30")) or None
+        self.group_reopen_after_days = float(os.getenv("GROUP_REOPEN_AFTER_DAYS", "7")) or None
+        # Вызывается после коммита вставки со списком (service, level, fingerprint) новых логов
+        self.on_insert: Optional[Callable[[List[Tuple[str, Optional[str], str]]], None]] = None
+        # Пользователи по email для проверки JWT; None тоже кэшируется (неизвестный email)
+        self.user_cache = TTLCache(
+            max_size=int(os.getenv("USER_CACHE_SIZE", "10000")),
+            ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "30")),
+        )
+        self._user_cache_version = 0
+        # bcrypt вне цикла событий: число одновременных операций и ожидание слота в секундах
+        self.password_hasher = PasswordHasher(
+            max_concurrency=int(os.getenv("BCRYPT_CONCURRENCY", "4")),
+            queue_timeout=float(os.getenv("BCRYPT_QUEUE_TIMEOUT", "2")),
+        )
+        # Части логов от blob_min_bytes байт хранятся один раз в log_blobs (utils/blobs.py)
+        self.blob_min_bytes = int(os.getenv("LOG_BLOB_MIN_BYTES", "512"))
+        # Содержимое блобов не меняется, кэш только экономит чтения из log_blobs
+        self.blob_cache = TTLCache(max_size=int(os.getenv("LOG_BLOB_CACHE_SIZE", "2000")), ttl_seconds=3600)
+        self._blobs_written = TTLCache(max_size=100000, ttl_seconds=BLOB_WRITE_CACHE_SECONDS)
+        # split - байт вынесено из логов, stored - байт новых блобов, skipped - записей, пропущенных по кэшу
+        self.blob_stats = {"split_bytes": 0, "stored_bytes": 0, "skipped": 0}
 
     async def connect(self):
         """Создает пул подключений к БД"""
-        database_url = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/ai_issue_genius"
+        self.dsn = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/ai_issue_genius"
 
         self.pool = await asyncpg.create_pool(
-            dsn=database_url,
+            dsn=self.dsn,
             min_size=1,
-            max_size=10,
-            command_timeout=60
+            max_size=self.pool_max_size,
+            command_timeout=60,
+            init=self._init_connection
         )
         print("Подключение к БД установлено")
 
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection):
+        """Регистрирует кодеки json/jsonb на orjson: словари на входе и на выходе"""
+        # Бинарный формат jsonb - байт версии формата и текст документа
+        await conn.set_type_codec(
+            'jsonb',
+            encoder=lambda value: b'\x01' + orjson.dumps(value),
+            decoder=lambda data: orjson.loads(data[1:]),
+            schema='pg_catalog',
+            format='binary'
+        )
+        await conn.set_type_codec(
+            'json',
+            encoder=orjson.dumps,
+            decoder=orjson.loads,
+            schema='pg_catalog',
+            format='binary'
+        )
+
+    async def connect_listener(self) -> asyncpg.Connection:
+        """Отдельное соединение вне пула для LISTEN: оно занято все время работы"""
+        if not self.dsn:
+            raise Exception("Database connection not established")
+
+        return await asyncpg.connect(dsn=self.dsn)
+
     async def disconnect(self):
         """Закрывает пул подключений"""
         if self.pool:
             await self.pool.close()
             print("Подключение к БД закрыто")
 
+    @asynccontextmanager
+    async def acquire(self):
+        """Берет соединение из пула и учитывает время ожидания в метриках"""
+        started = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            metrics.observe_pool_acquire(time.perf_counter() - started)
+            yield conn
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Состояние пула подключений"""
+        if not self.pool:
+            return {"size": 0, "idle": 0, "in_use": 0, "max_size": 0}
+
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {"size": size, "idle": idle, "in_use": size - idle, "max_size": self.pool.get_max_size()}
+
         # Методы для работы с пользователями
 
     async def create_user(self, email: str, password: str) -> Optional[int]:
@@ -36,9 +143,9 @@ class Database:
             raise Exception("Database connection not established")
 
         # Хешируем пароль
-        hashed_password = self._hash_password(password)
+        hashed_password = await self.password_hasher.hash(password)
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             try:
                 query = """
                        INSERT INTO users (email, password_hash, created_at)
@@ -47,6 +154,7 @@ class Database:
                    """
 
                 user_id = await conn.fetchval(query, email, hashed_password)
+                self._invalidate_user(email)
                 return user_id
             except asyncpg.exceptions.UniqueViolationError:
                 return None  # Пользователь уже существует
@@ -56,7 +164,7 @@ class Database:
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
                    SELECT id, email, password_hash, created_at, is_active
                    FROM users 
@@ -64,25 +172,26 @@ class Database:
                """
 
             row = await conn.fetchrow(query, email)
-            if not row:
-                return None
 
-            user_data = dict(row)
+        if not row:
+            return None
+
+        user_data = dict(row)
 
-            # Проверяем пароль
-            if self._verify_password(password, user_data['password_hash']):
-                # Не возвращаем хеш пароля в результатах
-                user_data.pop('password_hash', None)
-                return user_data
+        # Проверяем пароль уже без соединения: bcrypt не должен держать соединение пула
+        if await self.password_hasher.verify(password, user_data['password_hash']):
+            # Не возвращаем хеш пароля в результатах
+            user_data.pop('password_hash', None)
+            return user_data
 
-            return None
+        return None
 
     async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получает пользователя по ID"""
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
                    SELECT id, email, created_at, is_active
                    FROM users 
@@ -99,7 +208,7 @@ class Database:
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
                    SELECT id, email, created_at, is_active
                    FROM users 
@@ -111,44 +220,71 @@ class Database:
                 return dict(row)
             return None
 
+    async def get_user_by_email_cached(self, email: str) -> Optional[Dict[str, Any]]:
+        """Получает пользователя по email через кэш с коротким сроком жизни"""
+        user = self.user_cache.get(email)
+        if user is not MISSING:
+            return dict(user) if user is not None else None
+
+        # Изменение пользователя во время запроса не должно оставить в кэше старую запись
+        version = self._user_cache_version
+        user = await self.get_user_by_email(email)
+        if version == self._user_cache_version:
+            self.user_cache.set(email, user)
+        return dict(user) if user is not None else None
+
+    def _invalidate_user(self, email: str):
+        self._user_cache_version += 1
+        self.user_cache.invalidate(email)
+
     async def update_user_password(self, user_id: int, new_password: str) -> bool:
         """Обновляет пароль пользователя"""
         if not self.pool:
             raise Exception("Database connection not established")
 
-        hashed_password = self._hash_password(new_password)
+        hashed_password = await self.password_hasher.hash(new_password)
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
                    UPDATE users 
                    SET password_hash = $1
                    WHERE id = $2
+                   RETURNING email
                """
 
-            result = await conn.execute(query, hashed_password, user_id)
-            return "UPDATE 1" in result
+            email = await conn.fetchval(query, hashed_password, user_id)
+            if email is None:
+                return False
+
+            self._invalidate_user(email)
+            return True
 
     async def deactivate_user(self, user_id: int) -> bool:
         """Деактивирует пользователя"""
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
                    UPDATE users 
                    SET is_active = false
                    WHERE id = $1
+                   RETURNING email
                """
 
-            result = await conn.execute(query, user_id)
-            return "UPDATE 1" in result
+            email = await conn.fetchval(query, user_id)
+            if email is None:
+                return False
+
+            self._invalidate_user(email)
+            return True
 
     async def get_all_users(self, limit: int = 100) -> List[Dict[str, Any]]:
         """Получает всех пользователей"""
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
                    SELECT id, email, created_at, is_active
                    FROM users 
@@ -159,62 +295,290 @@ class Database:
             rows = await conn.fetch(query, limit)
             return [dict(row) for row in rows]
 
-        # Вспомогательные методы для работы с паролями
-
-    def _hash_password(self, password: str) -> str:
-        """Хеширует пароль с использованием bcrypt"""
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-        return hashed.decode('utf-8')
-
-    def _verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Проверяет пароль против хеша"""
-        try:
-            return bcrypt.checkpw(
-                plain_password.encode('utf-8'),
-                hashed_password.encode('utf-8')
-            )
-        except (ValueError, TypeError):
-            return False
-
     async def insert_log(self, service: str, log_data: Dict[Any, Any]) -> int:
-        """Вставляет лог в базу данных и возвращает ID"""
+        """Вставляет лог в базу данных, обновляет группу ошибки и возвращает ID"""
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        fingerprint = self.fingerprinter(service, log_data)
+        error_type, message = error_summary(log_data)
+        stored_log, blobs = self._split_log(log_data)
+
+        async with self.acquire() as conn:
+            # Блобы пишутся до лога: триггер поискового индекса читает их при вставке
+            self._blobs_saved(await self._save_blobs(conn, blobs))
+
+            # Повторение уже проанализированной ошибки сразу получает анализ группы
+            # и не попадает в очередь агентов, если группа не открыта заново (GROUP_REOPEN_SQL).
+            # Уведомление подписчиков уходит в том же запросе и доставляется после коммита
             query = """
-                INSERT INTO logs (service, log)
-                VALUES ($1, $2)
-                RETURNING id
-            """
+                WITH new_log AS (
+                    SELECT nextval('logs_id_seq') AS id
+                ),
+                grp AS (
+                    INSERT INTO error_groups (fingerprint, service, error_type, message, count, last_log_id)
+                    SELECT $5, $1, $6, $7, 1, id FROM new_log
+                    ON CONFLICT (fingerprint) DO UPDATE
+                    SET last_seen = NOW(),
+                        count = error_groups.count + 1,
+                        last_log_id = EXCLUDED.last_log_id,
+                        ai_analysis = CASE WHEN {reopen} THEN NULL ELSE error_groups.ai_analysis END,
+                        analysis_time = CASE WHEN {reopen} THEN NULL ELSE error_groups.analysis_time END
+                    RETURNING ai_analysis, analysis_time
+                ),
+                inserted AS (
+                    INSERT INTO logs (id, service, log, fingerprint, ai_analysis, analysis_time,
+                                      level, error_type, request_path, request_id, environment, event_time)
+                    SELECT new_log.id, $1, $2, $5,
+                           CASE WHEN grp.analysis_time IS NULL THEN NULL ELSE grp.ai_analysis END,
+                           CASE WHEN grp.analysis_time IS NULL THEN NULL ELSE NOW() END,
+                           $8, $9, $10, $11, $12, $13
+                    FROM new_log, grp
+                    RETURNING id
+                )
+                SELECT id, pg_notify($3, json_build_array(json_build_array(id, $1::text, $4::text))::text)
+                FROM inserted
+            """.format(reopen=GROUP_REOPEN_SQL.format(ttl="$14::float8", quiet="$15::float8"))
 
             log_id = await conn.fetchval(
-                query,
-                service,
-                json.dumps(log_data)
+                query, service, stored_log, NEW_LOGS_CHANNEL, _log_level(log_data),
+                fingerprint, error_type, message[:GROUP_MESSAGE_MAX_LENGTH],
+                *extract_log_fields(log_data),
+                self.group_analysis_ttl_days, self.group_reopen_after_days
             )
-            return log_id
+
+        if self.on_insert:
+            self.on_insert([(service, _log_level(log_data), fingerprint)])
+        return log_id
+
+    async def _fingerprints(self, records: List[Tuple[str, Dict[Any, Any]]]) -> List[str]:
+        """Отпечатки логов пачки; большие пачки считаются вне цикла событий"""
+        def compute():
+            return [self.fingerprinter(service, log_data) for service, log_data in records]
+
+        if len(records) <= self.fingerprint_inline_records:
+            return compute()
+        return await asyncio.to_thread(compute)
+
+    async def insert_logs_batch(self, records: List[Tuple[str, Dict[Any, Any]]]) -> List[int]:
+        """
+        Вставляет пачку логов одной транзакцией через бинарный COPY
+        :param records: список (service, log_data)
+        :return: ID логов в порядке записей
+        """
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        if not records:
+            return []
+
+        fingerprints = await self._fingerprints(records)
+
+        stored_logs = []
+        blobs = {}
+        for _, log_data in records:
+            stored_log, log_blobs = self._split_log(log_data)
+            stored_logs.append(stored_log)
+            blobs.update(log_blobs)
+
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                # COPY не умеет RETURNING, поэтому резервируем ID заранее
+                rows = await conn.fetch(
+                    "SELECT nextval('logs_id_seq') AS id FROM generate_series(1, $1)",
+                    len(records)
+                )
+                log_ids = sorted(row['id'] for row in rows)
+
+                # Повторы внутри пачки сворачиваются в одно обновление группы
+                groups: Dict[str, List[Any]] = {}
+                for log_id, fingerprint, (service, log_data) in zip(log_ids, fingerprints, records):
+                    group = groups.get(fingerprint)
+                    if group is None:
+                        error_type, message = error_summary(log_data)
+                        groups[fingerprint] = [service, error_type, message[:GROUP_MESSAGE_MAX_LENGTH], 1, log_id]
+                    else:
+                        group[3] += 1
+                        group[4] = log_id
+
+                # Порядок по отпечатку: параллельные пачки блокируют группы в одном порядке
+                ordered = sorted(groups.items())
+                columns = [[fingerprint for fingerprint, _ in ordered]]
+                columns.extend([group[i] for _, group in ordered] for i in range(5))
+                group_rows = await conn.fetch("""
+                    INSERT INTO error_groups (fingerprint, service, error_type, message, count, last_log_id)
+                    SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::text[], $4::text[], $5::bigint[], $6::bigint[])
+                    ON CONFLICT (fingerprint) DO UPDATE
+                    SET last_seen = NOW(),
+                        count = error_groups.count + EXCLUDED.count,
+                        last_log_id = EXCLUDED.last_log_id,
+                        ai_analysis = CASE WHEN {reopen} THEN NULL ELSE error_groups.ai_analysis END,
+                        analysis_time = CASE WHEN {reopen} THEN NULL ELSE error_groups.analysis_time END
+                    RETURNING fingerprint, ai_analysis, analysis_time
+                """.format(reopen=GROUP_REOPEN_SQL.format(ttl="$7::float8", quiet="$8::float8")),
+                    *columns, self.group_analysis_ttl_days, self.group_reopen_after_days)
+
+                analyzed = {
+                    row['fingerprint']: row['ai_analysis']
+                    for row in group_rows if row['analysis_time'] is not None
+                }
+                now = datetime.now(tz=timezone.utc)
+
+                saved = await self._save_blobs(conn, blobs)
+
+                await conn.copy_records_to_table(
+                    'logs',
+                    records=[
+                        (log_id, service, stored_log, fingerprint, analyzed.get(fingerprint),
+                         now if fingerprint in analyzed else None, *extract_log_fields(log_data))
+                        for log_id, fingerprint, stored_log, (service, log_data)
+                        in zip(log_ids, fingerprints, stored_logs, records)
+                    ],
+                    columns=['id', 'service', 'log', 'fingerprint', 'ai_analysis', 'analysis_time',
+                             *HOT_FIELDS, 'event_time']
+                )
+
+                events = [
+                    [log_id, service, _log_level(log_data)]
+                    for log_id, (service, log_data) in zip(log_ids, records)
+                ]
+                await conn.executemany(
+                    "SELECT pg_notify($1, $2)",
+                    [(NEW_LOGS_CHANNEL, payload) for payload in pack_log_events(events)]
+                )
+
+        self._blobs_saved(saved)
+        if self.on_insert:
+            self.on_insert([
+                (service, _log_level(log_data), fingerprint)
+                for fingerprint, (service, log_data) in zip(fingerprints, records)
+            ])
+        return log_ids
+
+    def _split_log(self, log_data: Dict[Any, Any]) -> Tuple[Dict[Any, Any], Dict[str, bytes]]:
+        """Выносит крупные повторяющиеся части лога в блобы, см. utils/blobs.py"""
+        stored_log, blobs = split_log(log_data, self.blob_min_bytes)
+        self.blob_stats["split_bytes"] += sum(len(data) for data in blobs.values())
+        return stored_log, blobs
+
+    async def _save_blobs(self, conn: asyncpg.Connection,
+                          blobs: Dict[str, bytes]) -> Tuple[List[str], int]:
+        """
+        Записывает блобы, которых еще нет в log_blobs.
+        У существующих обновляется last_seen, но не чаще раза в BLOB_TOUCH_SECONDS:
+        повтор частой ошибки не порождает запись в таблицу и WAL.
+        После коммита результат передается в _blobs_saved
+        :return: записанные хеши и размер новых блобов в байтах
+        """
+        pending = {digest: blob for digest, blob in blobs.items() if self._blobs_written.get(digest) is MISSING}
+        self.blob_stats["skipped"] += len(blobs) - len(pending)
+        if not pending:
+            return [], 0
+
+        rows = await conn.fetch("""
+            INSERT INTO log_blobs (hash, value, size)
+            SELECT hash, value::jsonb, size FROM unnest($1::varchar[], $2::text[], $3::integer[]) AS b(hash, value, size)
+            ON CONFLICT (hash) DO UPDATE
+            SET last_seen = NOW()
+            WHERE log_blobs.last_seen < NOW() - make_interval(secs => $4)
+            RETURNING size, xmax = 0 AS created
+        """, *blob_rows(pending), BLOB_TOUCH_SECONDS)
+
+        return list(pending), sum(row['size'] for row in rows if row['created'])
+
+    def _blobs_saved(self, saved: Tuple[List[str], int]):
+        """Запоминает закоммиченные блобы: до отката транзакции их нельзя пропускать при записи"""
+        digests, stored_bytes = saved
+        self.blob_stats["stored_bytes"] += stored_bytes
+        for digest in digests:
+            self._blobs_written.set(digest, True)
+
+    async def _join_blobs(self, conn: asyncpg.Connection, rows: List[Dict[str, Any]],
+                          column: str = "log", path: Tuple[str, ...] = ()) -> List[Dict[str, Any]]:
+        """
+        Подставляет в логи содержимое блобов вместо ссылок
+        :param path: путь значения column внутри лога, если выбран не весь лог
+        """
+        docs = [_nest(row[column], path) for row in rows]
+        refs = blob_refs(docs)
+        if not refs:
+            return rows
+
+        blobs = {}
+        missing = []
+        for digest in refs:
+            value = self.blob_cache.get(digest)
+            if value is MISSING:
+                missing.append(digest)
+            else:
+                blobs[digest] = value
+
+        if missing:
+            for row in await conn.fetch(
+                    "SELECT hash, value FROM log_blobs WHERE hash = ANY($1::varchar[])", missing):
+                blobs[row['hash']] = row['value']
+                self.blob_cache.set(row['hash'], row['value'])
+
+        for row, doc in zip(rows, docs):
+            row[column] = extract_path(join_log(doc, blobs), path)
+        return rows
+
+    async def _project_rows(self, conn: asyncpg.Connection, rows: List[Dict[str, Any]],
+                            fields: Optional[List[Field]]) -> List[Dict[str, Any]]:
+        """Строки выборки с _select_sql: имена полей проекции и содержимое блобов"""
+        if fields is None:
+            return await self._join_blobs(conn, rows)
+
+        rows = [
+            {field.name: row[f"f{index}" if field.path else field.column] for index, field in enumerate(fields)}
+            for row in rows
+        ]
+        # Части лога, внутри которых могут быть ссылки; пути внутрь блобов разрешает SQL
+        for field in fields:
+            if field.column == "log" and any(
+                    len(field.path) < len(blob_path) and blob_path[:len(field.path)] == field.path
+                    for blob_path in BLOB_PATHS):
+                await self._join_blobs(conn, rows, column=field.name, path=field.path)
+        return rows
 
     async def update_log(self, log_id: int, analysis: Dict[Any, Any]) -> int:
-        """Вставляет лог в базу данных и возвращает ID"""
+        """Сохраняет анализ лога и переносит его на группу ошибки и ее ожидающие повторы"""
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
-                UPDATE logs 
-                SET ai_analysis = $1, 
-                    analysis_time = NOW()
-                WHERE id = $2
-                RETURNING id
+                WITH updated AS (
+                    UPDATE logs
+                    SET ai_analysis = $1,
+                        analysis_time = NOW(),
+                        lease_owner = NULL,
+                        lease_expires_at = NULL
+                    WHERE id = $2
+                    RETURNING id, fingerprint
+                ),
+                grp AS (
+                    UPDATE error_groups g
+                    SET ai_analysis = $1,
+                        analysis_time = NOW()
+                    FROM updated u
+                    WHERE g.fingerprint = u.fingerprint
+                ),
+                siblings AS (
+                    UPDATE logs l
+                    SET ai_analysis = $1,
+                        analysis_time = NOW(),
+                        lease_owner = NULL,
+                        lease_expires_at = NULL
+                    FROM updated u
+                    WHERE l.fingerprint = u.fingerprint
+                      AND l.analysis_time IS NULL
+                      AND l.id <> u.id
+                )
+                SELECT id FROM updated
             """
 
-            updated_id = await conn.fetchval(
-                query,
-                json.dumps(analysis),
-                log_id
-            )
+            updated_id = await conn.fetchval(query, analysis, log_id)
             return updated_id
 
     async def get_log_by_id(self, log_id: int) -> Optional[Dict[str, Any]]:
@@ -222,50 +586,320 @@ class Database:
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
-                SELECT id, timestamp, service, log, ai_analysis, analysis_time
+                SELECT id, timestamp, service, fingerprint, log, ai_analysis, analysis_time
                 FROM logs WHERE id = $1
             """
 
             row = await conn.fetchrow(query, log_id)
             if row:
-                return dict(row)
+                return (await self._join_blobs(conn, [dict(row)]))[0]
             return None
 
     async def get_logs_by_time_range(self, start_time: datetime, end_time: datetime,
-                                     limit: int = 100) -> List[Dict[str, Any]]:
-        """Получает логи за временной промежуток"""
+                                     limit: int = 100, before_id: Optional[int] = None,
+                                     filters: Optional[Dict[str, Any]] = None,
+                                     fields: Optional[List[Field]] = None) -> List[Dict[str, Any]]:
+        """
+        Получает логи за временной промежуток, от новых к старым
+        :param before_id: keyset-курсор, вернуть логи с id меньше указанного
+        :param filters: фильтры по колонкам лога, см. _log_filter_sql
+        :param fields: проекция, см. utils/projection.py; None - все колонки
+        """
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
-            query = """
-                SELECT id, timestamp, service, log, ai_analysis, analysis_time
+        args = [start_time, end_time, before_id, limit]
+        async with self.acquire() as conn:
+            # Сортировка по id идет по первичному ключу партиций без сортировки выборки
+            query = f"""
+                SELECT {_select_sql(fields, args)}
                 FROM logs 
                 WHERE timestamp BETWEEN $1 AND $2
-                ORDER BY timestamp DESC
-                LIMIT $3
+                  AND ($3::bigint IS NULL OR id < $3){_log_filter_sql(filters, args)}
+                ORDER BY id DESC
+                LIMIT $4
             """
 
-            rows = await conn.fetch(query, start_time, end_time, limit)
-            return [dict(row) for row in rows]
+            rows = await conn.fetch(query, *args)
+            return await self._project_rows(conn, [dict(row) for row in rows], fields)
 
-    async def get_logs_by_service(self, service: str, limit: int = 100) -> List[Dict[str, Any]]:
-        """Получает логи по сервису"""
+    async def get_logs_by_service(self, service: str, limit: int = 100,
+                                  after_id: Optional[int] = None,
+                                  filters: Optional[Dict[str, Any]] = None,
+                                  fields: Optional[List[Field]] = None) -> List[Dict[str, Any]]:
+        """
+        Получает логи по сервису
+        :param after_id: keyset-курсор, вернуть логи с id больше указанного
+        :param filters: фильтры по колонкам лога, см. _log_filter_sql
+        :param fields: проекция, см. utils/projection.py; None - все колонки
+        """
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
-            query = """
-                SELECT id, timestamp, service, log, ai_analysis, analysis_time
+        args = [service, after_id, limit]
+        async with self.acquire() as conn:
+            query = f"""
+                SELECT {_select_sql(fields, args)}
                 FROM logs 
                 WHERE service = $1 AND analysis_time is null
+                  AND ($2::bigint IS NULL OR id > $2){_log_filter_sql(filters, args)}
                 ORDER BY id ASC
+                LIMIT $3
+            """
+
+            rows = await conn.fetch(query, *args)
+            return await self._project_rows(conn, [dict(row) for row in rows], fields)
+
+    async def iter_logs_by_time_range(self, start_time: datetime, end_time: datetime,
+                                      chunk_size: int = 1000, filters: Optional[Dict[str, Any]] = None,
+                                      fields: Optional[List[Field]] = None):
+        """Выгрузка логов за промежуток серверным курсором, от новых к старым"""
+        args = [start_time, end_time]
+        query = f"""
+            SELECT {_select_sql(fields, args)}
+            FROM logs 
+            WHERE timestamp BETWEEN $1 AND $2{_log_filter_sql(filters, args)}
+            ORDER BY id DESC
+        """
+
+        async for rows in self._iter_query(query, *args, chunk_size=chunk_size, fields=fields):
+            yield rows
+
+    async def iter_logs_by_service(self, service: str, chunk_size: int = 1000,
+                                   filters: Optional[Dict[str, Any]] = None,
+                                   fields: Optional[List[Field]] = None):
+        """Выгрузка непроанализированных логов сервиса серверным курсором"""
+        args = [service]
+        query = f"""
+            SELECT {_select_sql(fields, args)}
+            FROM logs 
+            WHERE service = $1 AND analysis_time is null{_log_filter_sql(filters, args)}
+            ORDER BY id ASC
+        """
+
+        async for rows in self._iter_query(query, *args, chunk_size=chunk_size, fields=fields):
+            yield rows
+
+    async def search_logs(self, query: str, start_time: datetime, end_time: datetime,
+                          limit: int = 50, order: str = "recent", service: Optional[str] = None,
+                          after: Optional[Tuple[Optional[float], int]] = None,
+                          filters: Optional[Dict[str, Any]] = None,
+                          rank_window: int = 5000) -> List[Dict[str, Any]]:
+        """
+        Полнотекстовый поиск по логам (синтаксис websearch_to_tsquery)
+        :param order: recent - от новых к старым, rank - по релевантности
+        :param after: keyset-курсор (rank, id) последнего лога предыдущей страницы
+        :param rank_window: при order=rank ранжируются только rank_window самых новых совпадений,
+                            чтобы частое слово не заставляло считать ранг по всей таблице
+        """
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        after_rank, after_id = after if after else (None, None)
+        args = [query, start_time, end_time, service, limit]
+        conditions = f"""search_vector @@ q
+                  AND timestamp BETWEEN $2 AND $3
+                  AND ($4::varchar IS NULL OR service = $4){_log_filter_sql(filters, args)}"""
+
+        if order == "rank":
+            args.extend([rank_window, after_rank, after_id])
+            sql = f"""
+                WITH candidates AS (
+                    SELECT id, timestamp, service, fingerprint, log, ai_analysis, analysis_time,
+                           ts_rank(search_vector, q) AS rank
+                    FROM logs, websearch_to_tsquery('simple', $1) AS q
+                    WHERE {conditions}
+                    ORDER BY id DESC
+                    LIMIT ${len(args) - 2}
+                )
+                SELECT * FROM candidates
+                WHERE (${len(args)}::bigint IS NULL OR (rank, id) < (${len(args) - 1}::real, ${len(args)}))
+                ORDER BY rank DESC, id DESC
+                LIMIT $5
+            """
+        else:
+            args.append(after_id)
+            sql = f"""
+                SELECT id, timestamp, service, fingerprint, log, ai_analysis, analysis_time,
+                       ts_rank(search_vector, q) AS rank
+                FROM logs, websearch_to_tsquery('simple', $1) AS q
+                WHERE {conditions}
+                  AND (${len(args)}::bigint IS NULL OR id < ${len(args)})
+                ORDER BY id DESC
+                LIMIT $5
+            """
+
+        async with self.acquire() as conn:
+            rows = await conn.fetch(sql, *args)
+            return await self._join_blobs(conn, [dict(row) for row in rows])
+
+    async def _iter_query(self, query: str, *args, chunk_size: int = 1000,
+                          fields: Optional[List[Field]] = None):
+        """Читает результат запроса серверным курсором порциями по chunk_size строк"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            # Курсор asyncpg живет только внутри транзакции
+            async with conn.transaction():
+                cursor = await conn.cursor(query, *args)
+                while True:
+                    rows = await cursor.fetch(chunk_size)
+                    if not rows:
+                        break
+                    yield await self._project_rows(conn, [dict(row) for row in rows], fields)
+
+    async def claim_logs(self, service: str, worker_id: str, limit: int = 10,
+                         lease_seconds: int = 600) -> List[Dict[str, Any]]:
+        """
+        Атомарно берет в аренду до limit непроанализированных логов сервиса
+        :param worker_id: идентификатор агента-владельца аренды
+        :param lease_seconds: срок аренды, после него логи снова доступны другим агентам
+        """
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            # SKIP LOCKED: параллельные агенты не ждут друг друга и не получают одни и те же строки
+            query = """
+                WITH candidates AS (
+                    SELECT id, timestamp
+                    FROM logs
+                    WHERE service = $1 AND analysis_time IS NULL
+                      AND (lease_expires_at IS NULL OR lease_expires_at < NOW())
+                    ORDER BY id ASC
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE logs l
+                SET lease_owner = $3,
+                    lease_expires_at = NOW() + make_interval(secs => $4)
+                FROM candidates c
+                WHERE l.id = c.id AND l.timestamp = c.timestamp
+                RETURNING l.id, l.timestamp, l.service, l.fingerprint, l.log, l.ai_analysis, l.analysis_time,
+                          l.lease_owner, l.lease_expires_at
+            """
+
+            rows = await conn.fetch(query, service, limit, worker_id, lease_seconds)
+            return await self._join_blobs(
+                conn, sorted((dict(row) for row in rows), key=lambda row: row['id'])
+            )
+
+    async def get_pending_groups(self, service: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Группы ошибок сервиса без анализа, с последним появлением в качестве примера"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            query = """
+                SELECT g.fingerprint, g.service, g.error_type, g.message,
+                       g.first_seen, g.last_seen, g.count, g.last_log_id,
+                       l.log AS sample_log
+                FROM error_groups g
+                LEFT JOIN LATERAL (
+                    SELECT log FROM logs WHERE id = g.last_log_id LIMIT 1
+                ) l ON TRUE
+                WHERE g.service = $1 AND g.analysis_time IS NULL
+                ORDER BY g.last_seen DESC
                 LIMIT $2
             """
 
             rows = await conn.fetch(query, service, limit)
+            return await self._join_blobs(conn, [dict(row) for row in rows], column="sample_log")
+
+    async def get_error_clusters(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Кластеры ошибок с MinHash-сигнатурами, созданные после since"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            query = """
+                SELECT fingerprint, service, error_type, signature, created_at
+                FROM error_clusters
+                WHERE $1::timestamptz IS NULL OR created_at > $1
+                ORDER BY created_at
+            """
+
+            rows = await conn.fetch(query, since)
+            return [dict(row) for row in rows]
+
+    async def save_error_clusters(self, clusters: List[Tuple[str, str, Optional[str], bytes]]):
+        """
+        Сохраняет новые кластеры ошибок
+        :param clusters: список (fingerprint, service, error_type, signature)
+        """
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            await conn.executemany("""
+                INSERT INTO error_clusters (fingerprint, service, error_type, signature)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (fingerprint) DO NOTHING
+            """, clusters)
+
+    async def add_log_rollups(self, rows: List[Tuple[str, datetime, str, str, str, int]]):
+        """
+        Прибавляет счетчики к log_rollups
+        :param rows: список (bucket, bucket_start, service, level, fingerprint, count)
+        """
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        if not rows:
+            return
+
+        async with self.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO log_rollups (bucket, bucket_start, service, level, fingerprint, count)
+                SELECT * FROM unnest($1::varchar[], $2::timestamptz[], $3::varchar[], $4::text[], $5::varchar[], $6::bigint[])
+                ON CONFLICT (bucket, service, bucket_start, level, fingerprint) DO UPDATE
+                SET count = log_rollups.count + EXCLUDED.count
+            """, *(list(column) for column in zip(*rows)))
+
+    async def delete_log_rollups(self, bucket: str, before: datetime) -> int:
+        """Удаляет корзины размера bucket, начавшиеся раньше before"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            result = await conn.execute(
+                "DELETE FROM log_rollups WHERE bucket = $1 AND bucket_start < $2",
+                bucket, before
+            )
+            return int(result.split()[-1])
+
+    async def get_log_rollups(self, bucket: str, start_time: datetime, end_time: datetime,
+                              service: Optional[str] = None, level: Optional[str] = None,
+                              fingerprint: Optional[str] = None,
+                              group_by: Tuple[str, ...] = ("service", "level")) -> List[Dict[str, Any]]:
+        """
+        Количество логов по корзинам за промежуток
+        :param group_by: разрез из service, level, fingerprint; остальные поля суммируются
+        """
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        # Имена колонок подставляются только из белого списка
+        columns = [column for column in ("service", "level", "fingerprint") if column in group_by]
+        select = ", ".join(["bucket_start"] + columns)
+
+        async with self.acquire() as conn:
+            query = f"""
+                SELECT {select}, SUM(count)::bigint AS count
+                FROM log_rollups
+                WHERE bucket = $1
+                  AND bucket_start >= $2 AND bucket_start <= $3
+                  AND ($4::varchar IS NULL OR service = $4)
+                  AND ($5::text IS NULL OR level = $5)
+                  AND ($6::varchar IS NULL OR fingerprint = $6)
+                GROUP BY {select}
+                ORDER BY {select}
+            """
+
+            rows = await conn.fetch(query, bucket, start_time, end_time, service, level, fingerprint)
             return [dict(row) for row in rows]
 
     async def get_total_logs_count(self) -> int:
@@ -273,9 +907,187 @@ class Database:
         if not self.pool:
             raise Exception("Database connection not established")
 
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             return await conn.fetchval("SELECT COUNT(*) FROM logs")
 
+    async def get_blob_storage_stats(self) -> Dict[str, Any]:
+        """Размеры logs и log_blobs на диске и число блобов"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT COUNT(*) AS blobs,
+                       COALESCE(SUM(size), 0)::bigint AS blob_value_bytes,
+                       pg_total_relation_size('log_blobs') AS blobs_table_bytes,
+                       (SELECT COALESCE(SUM(pg_total_relation_size(inhrelid)), 0)::bigint
+                        FROM pg_inherits WHERE inhparent = 'logs'::regclass) AS logs_table_bytes
+                FROM log_blobs
+            """)
+            return dict(row)
+
+    async def delete_unused_log_blobs(self, before: datetime) -> int:
+        """Удаляет блобы, на которые не ссылались с момента before"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            result = await conn.execute("DELETE FROM log_blobs WHERE last_seen < $1", before)
+            return int(result.split()[-1])
+
+    # Методы для работы с партициями таблицы logs
+
+    async def get_log_partitions(self) -> List[Dict[str, Any]]:
+        """Возвращает партиции logs с границами диапазонов"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            query = """
+                SELECT c.relname AS name,
+                       (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \\(''([^'']+)''\\)'))[1]::timestamptz AS range_start,
+                       (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz AS range_end
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'logs'::regclass
+                ORDER BY range_start
+            """
+
+            rows = await conn.fetch(query)
+            return [dict(row) for row in rows]
+
+    async def create_log_partition(self, name: str, range_start: datetime, range_end: datetime):
+        """Создает партицию logs на диапазон [range_start, range_end)"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            # DDL не принимает параметры, границы подставляются как литералы
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF logs
+                FOR VALUES FROM ('{range_start.isoformat()}') TO ('{range_end.isoformat()}')
+            """)
+
+    async def iter_log_partition(self, name: str, chunk_size: int = 5000):
+        """Читает партицию серверным курсором порциями по chunk_size строк"""
+        query = f"""
+            SELECT id, timestamp, service, fingerprint, log, ai_analysis, analysis_time
+            FROM {name}
+            ORDER BY timestamp, id
+        """
+
+        async for rows in self._iter_query(query, chunk_size=chunk_size):
+            yield rows
+
+    async def count_log_partition(self, name: str) -> int:
+        """Число строк партиции logs"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            return await conn.fetchval(f"SELECT count(*) FROM {name}")
+
+    async def drop_log_partition(self, name: str):
+        """Отсоединяет партицию logs и удаляет ее целиком"""
+        if not self.pool:
+            raise Exception("Database connection not established")
+
+        async with self.acquire() as conn:
+            partitions = await conn.fetch("""
+                SELECT c.relname AS name, i.inhdetachpending AS pending,
+                       pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT' AS is_default
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'logs'::regclass
+            """)
+
+            # Прерванный DETACH ... CONCURRENTLY оставляет партицию в ожидании отсоединения;
+            # пока оно не завершено, PostgreSQL не отсоединяет и другие партиции
+            for partition in partitions:
+                if partition["pending"]:
+                    await conn.execute(f"ALTER TABLE logs DETACH PARTITION {partition['name']} FINALIZE")
+
+            if any(partition["name"] == name and not partition["pending"] for partition in partitions):
+                # CONCURRENTLY не блокирует вставку в соседние партиции, но недоступен при DEFAULT-партиции
+                concurrently = "" if any(partition["is_default"] for partition in partitions) else " CONCURRENTLY"
+                await conn.execute(f"ALTER TABLE logs DETACH PARTITION {name}{concurrently}")
+            await conn.execute(f"DROP TABLE IF EXISTS {name}")
+
+
+def _select_sql(fields: Optional[List[Field]], args: List[Any]) -> str:
+    """
+    Список SELECT для проекции fields=, пути JSON дописываются в args.
+    Путь внутрь вынесенной части лога (log.versions.python) разрешается через log_blob_value
+    """
+    if fields is None:
+        return LOG_SELECT
+
+    columns = []
+    for index, field in enumerate(fields):
+        if not field.path:
+            columns.append(field.column)
+            continue
+
+        blob_path = next((
+            blob_path for blob_path in BLOB_PATHS
+            if field.column == "log" and field.path[:len(blob_path)] == blob_path
+        ), None)
+        if blob_path:
+            args.extend([list(blob_path), list(field.path[len(blob_path):])])
+            columns.append(f"log_blob_value(log #> ${len(args) - 1}::text[]) #> ${len(args)}::text[] AS f{index}")
+        else:
+            args.append(list(field.path))
+            columns.append(f"{field.column} #> ${len(args)}::text[] AS f{index}")
+    return ", ".join(columns)
+
+
+def _nest(value: Any, path: Tuple[str, ...]) -> Any:
+    """Вкладывает значение по пути: ("error", "traceback") -> {"error": {"traceback": value}}"""
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def _log_filter_sql(filters: Optional[Dict[str, Any]], args: List[Any]) -> str:
+    """
+    Условия WHERE для фильтров GET /api/logs, значения дописываются в args.
+    Поля из HOT_FIELDS сравниваются на равенство (request_path с * на конце - по префиксу),
+    event_from/event_to ограничивают event_time, contains - вхождение JSON (jsonb @>, GIN-индекс).
+    """
+    if not filters:
+        return ""
+
+    clauses = []
+    for field in HOT_FIELDS:
+        value = filters.get(field)
+        if value is None:
+            continue
+        if field == "request_path" and value.endswith("*"):
+            prefix = value[:-1].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            args.append(prefix + "%")
+            clauses.append(f"request_path LIKE ${len(args)}")
+        else:
+            args.append(value)
+            clauses.append(f"{field} = ${len(args)}")
+
+    if filters.get("event_from") is not None:
+        args.append(filters["event_from"])
+        clauses.append(f"event_time >= ${len(args)}")
+    if filters.get("event_to") is not None:
+        args.append(filters["event_to"])
+        clauses.append(f"event_time <= ${len(args)}")
+    if filters.get("contains") is not None:
+        args.append(filters["contains"])
+        clauses.append(f"log @> ${len(args)}::jsonb")
+
+    return "".join(f"\n                  AND {clause}" for clause in clauses)
+
+
+def _log_level(log_data: Dict[Any, Any]) -> Optional[str]:
+    """Уровень лога для событий о новых логах"""
+    level = log_data.get('level')
+    return str(level) if level is not None else None
+
 
 # Глобальный экземпляр базы данных
 db = Database()
\ No newline at end of file
@@ -0,0 +1,56 @@
+-- Перевод существующей таблицы logs на партиционирование по времени.
+-- Выполнять в БД ai_issue_genius при остановленном сервере:
+--   psql -d ai_issue_genius -f migrations/001_partition_logs.sql
+-- Партиции создаются по дням за весь период существующих данных и на неделю вперед,
+-- дальше их обслуживает сервер (PARTITION_INTERVAL, PARTITION_PREMAKE, LOG_RETENTION_DAYS).
+
+BEGIN;
+
+ALTER TABLE logs RENAME TO logs_old;
+ALTER SEQUENCE logs_id_seq RENAME TO logs_old_id_seq;
+ALTER INDEX IF EXISTS idx_logs_timestamp RENAME TO idx_logs_old_timestamp;
+ALTER INDEX IF EXISTS idx_logs_service RENAME TO idx_logs_old_service;
+ALTER INDEX IF EXISTS idx_logs_analysis_time RENAME TO idx_logs_old_analysis_time;
+
+CREATE TABLE logs (
+    id BIGSERIAL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    service VARCHAR(100) NOT NULL,
+    log JSONB,
+    ai_analysis JSONB,
+    analysis_time TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs USING BRIN (timestamp);
+CREATE INDEX IF NOT EXISTS idx_logs_service ON logs(service);
+CREATE INDEX IF NOT EXISTS idx_logs_analysis_time ON logs USING BRIN (analysis_time);
+
+DO $$
+DECLARE
+    day_start TIMESTAMPTZ;
+BEGIN
+    day_start := date_trunc('day', COALESCE((SELECT MIN(timestamp) FROM logs_old), NOW()), 'UTC');
+    WHILE day_start < date_trunc('day', NOW(), 'UTC') + INTERVAL '8 days' LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+            'logs_p' || to_char(day_start AT TIME ZONE 'UTC', 'YYYYMMDD'),
+            day_start,
+            day_start + INTERVAL '1 day'
+        );
+        day_start := day_start + INTERVAL '1 day';
+    END LOOP;
+END $$;
+
+INSERT INTO logs (id, timestamp, service, log, ai_analysis, analysis_time)
+SELECT id, COALESCE(timestamp, NOW()), service, log, ai_analysis, analysis_time
+FROM logs_old;
+
+SELECT setval('logs_id_seq', COALESCE((SELECT MAX(id) FROM logs), 0) + 1, false);
+
+GRANT ALL PRIVILEGES ON TABLE logs TO ai_issue_genius;
+GRANT ALL PRIVILEGES ON SEQUENCE logs_id_seq TO ai_issue_genius;
+
+DROP TABLE logs_old;
+
+COMMIT;
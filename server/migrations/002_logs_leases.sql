@@ -0,0 +1,7 @@
+-- Аренда логов агентами (POST /api/logs/claim) и частичный индекс очереди на анализ.
+--   psql -d ai_issue_genius -f migrations/002_logs_leases.sql
+
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(100);
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS idx_logs_unanalyzed ON logs(service, id) WHERE analysis_time IS NULL;
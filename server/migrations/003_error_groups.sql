@@ -0,0 +1,22 @@
+-- Отпечатки ошибок и группы повторяющихся ошибок (GET /api/groups).
+--   psql -d ai_issue_genius -f migrations/003_error_groups.sql
+
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS fingerprint VARCHAR(40);
+CREATE INDEX IF NOT EXISTS idx_logs_fingerprint ON logs(fingerprint);
+
+CREATE TABLE IF NOT EXISTS error_groups (
+    fingerprint VARCHAR(40) PRIMARY KEY,
+    service VARCHAR(100) NOT NULL,
+    error_type TEXT,
+    message TEXT,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    count BIGINT NOT NULL DEFAULT 0,
+    last_log_id BIGINT,
+    ai_analysis JSONB,
+    analysis_time TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_error_groups_pending ON error_groups(service, last_seen) WHERE analysis_time IS NULL;
+
+GRANT ALL PRIVILEGES ON TABLE error_groups TO ai_issue_genius;
@@ -0,0 +1,14 @@
+-- Кластеры похожих ошибок (MinHash/LSH, utils/clustering.py).
+--   psql -d ai_issue_genius -f migrations/004_error_clusters.sql
+
+CREATE TABLE IF NOT EXISTS error_clusters (
+    fingerprint VARCHAR(40) PRIMARY KEY,
+    service VARCHAR(100) NOT NULL,
+    error_type TEXT,
+    signature BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_error_clusters_created_at ON error_clusters(created_at);
+
+GRANT ALL PRIVILEGES ON TABLE error_clusters TO ai_issue_genius;
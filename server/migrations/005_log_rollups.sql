@@ -0,0 +1,27 @@
+-- Счетчики логов по корзинам minute/hour/day (GET /api/logs/stats, utils/rollups.py).
+--   psql -d ai_issue_genius -f migrations/005_log_rollups.sql
+-- Счетчики заполняются из уже накопленных логов; запускать до старта новой версии сервера,
+-- иначе логи, вставленные между миграцией и стартом, не попадут в счетчики.
+
+CREATE TABLE IF NOT EXISTS log_rollups (
+    bucket VARCHAR(10) NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    service VARCHAR(100) NOT NULL,
+    level TEXT NOT NULL DEFAULT '',
+    fingerprint VARCHAR(40) NOT NULL DEFAULT '',
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, service, bucket_start, level, fingerprint)
+);
+
+CREATE INDEX IF NOT EXISTS idx_log_rollups_bucket_start ON log_rollups(bucket, bucket_start);
+
+INSERT INTO log_rollups (bucket, bucket_start, service, level, fingerprint, count)
+SELECT b.bucket, date_trunc(b.bucket, l.timestamp, 'UTC'), l.service,
+       COALESCE(l.log->>'level', ''), COALESCE(l.fingerprint, ''), COUNT(*)
+FROM logs l
+CROSS JOIN (VALUES ('minute'), ('hour'), ('day')) AS b(bucket)
+WHERE b.bucket <> 'minute' OR l.timestamp >= NOW() - INTERVAL '8 days'
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (bucket, service, bucket_start, level, fingerprint) DO NOTHING;
+
+GRANT ALL PRIVILEGES ON TABLE log_rollups TO ai_issue_genius;
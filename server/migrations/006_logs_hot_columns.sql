@@ -0,0 +1,58 @@
+-- Колонки для фильтров GET /api/logs и GIN-индекс по исходному JSON.
+--   psql -d ai_issue_genius -f migrations/006_logs_hot_columns.sql
+-- Новые логи получают значения колонок от сервера при вставке; уже накопленные
+-- заполняются здесь по партициям, чтобы не держать одну длинную транзакцию.
+-- На больших таблицах индексы лучше строить по партициям с CONCURRENTLY и затем
+-- подключать через ALTER INDEX ... ATTACH PARTITION.
+
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS level TEXT;
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS error_type TEXT;
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS request_path TEXT;
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS request_id TEXT;
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS environment TEXT;
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS event_time TIMESTAMP WITH TIME ZONE;
+
+-- Неразборчивое значение timestamp даёт NULL, а не ошибку всей миграции
+CREATE OR REPLACE FUNCTION log_event_time(value TEXT) RETURNS TIMESTAMP WITH TIME ZONE AS $$
+BEGIN
+    IF value ~ '^\d+(\.\d+)?$' THEN
+        RETURN to_timestamp(value::double precision);
+    ELSIF value ~ '^\d{4}-\d{2}-\d{2}' THEN
+        RETURN value::timestamptz;
+    END IF;
+    RETURN NULL;
+EXCEPTION WHEN invalid_datetime_format OR datetime_field_overflow
+        OR invalid_parameter_value OR numeric_value_out_of_range THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+DO $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'logs'::regclass
+    LOOP
+        EXECUTE format($sql$
+            UPDATE %I SET
+                level = left(log->>'level', 500),
+                error_type = left(log->'error'->>'type', 500),
+                request_path = left(COALESCE(log->'request'->>'path', log->>'path'), 500),
+                request_id = left(log->>'request_id', 500),
+                environment = left(log->>'environment', 500),
+                event_time = log_event_time(log->>'timestamp')
+            WHERE level IS NULL AND error_type IS NULL AND request_path IS NULL
+        $sql$, partition_name);
+        COMMIT;
+    END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_logs_level ON logs(level);
+CREATE INDEX IF NOT EXISTS idx_logs_error_type ON logs(error_type);
+CREATE INDEX IF NOT EXISTS idx_logs_request_path ON logs(request_path text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_logs_request_id ON logs(request_id);
+CREATE INDEX IF NOT EXISTS idx_logs_environment ON logs(environment);
+CREATE INDEX IF NOT EXISTS idx_logs_event_time ON logs USING BRIN (event_time);
+CREATE INDEX IF NOT EXISTS idx_logs_log ON logs USING GIN (log jsonb_path_ops);
@@ -0,0 +1,63 @@
+-- Полнотекстовый поиск по логам (GET /api/logs/search).
+--   psql -d ai_issue_genius -f migrations/007_logs_search.sql
+-- Новые логи получают search_vector от триггера, накопленные заполняются по партициям.
+
+ALTER TABLE logs ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE OR REPLACE FUNCTION log_search_vector(log JSONB) RETURNS tsvector AS $$
+DECLARE
+    traceback JSONB := log->'error'->'traceback';
+    body TEXT;
+    paths TEXT;
+BEGIN
+    body := left(concat_ws(' ',
+        log->'error'->>'type',
+        log->'error'->>'message',
+        log->>'message',
+        COALESCE(log->'request'->>'path', log->>'path'),
+        CASE jsonb_typeof(traceback)
+            WHEN 'array' THEN (SELECT string_agg(frame, ' ') FROM jsonb_array_elements_text(traceback) AS frame)
+            WHEN 'string' THEN traceback #>> '{}'
+        END
+    ), 100000);
+
+    -- Пути индексируются еще и по частям и суффиксам:
+    -- запросы payments и payments/services.py находят /opt/app/payments/services.py
+    SELECT string_agg(
+        CASE WHEN i > 1 THEN array_to_string(found.parts[i:], '/') || ' ' ELSE '' END || found.parts[i], ' '
+    )
+    INTO paths
+    FROM (
+        SELECT string_to_array(trim(BOTH '/' FROM m[1]), '/') AS parts
+        FROM regexp_matches(body, '((?:/[\w.\-]+)+)', 'g') AS m
+    ) AS found, generate_subscripts(found.parts, 1) AS i;
+
+    RETURN to_tsvector('simple', concat_ws(' ', body, paths));
+END;
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION logs_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := log_search_vector(NEW.log);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS logs_search_vector ON logs;
+CREATE TRIGGER logs_search_vector BEFORE INSERT ON logs
+    FOR EACH ROW EXECUTE FUNCTION logs_search_vector_trigger();
+
+DO $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'logs'::regclass
+    LOOP
+        EXECUTE format('UPDATE %I SET search_vector = log_search_vector(log) WHERE search_vector IS NULL', partition_name);
+        COMMIT;
+    END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_logs_search_vector ON logs USING GIN (search_vector);
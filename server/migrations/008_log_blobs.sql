@@ -0,0 +1,58 @@
+-- Хранение крупных повторяющихся частей логов по хешу содержимого (utils/blobs.py).
+--   psql -d ai_issue_genius -f migrations/008_log_blobs.sql
+-- Выносятся только части новых логов: переписывание накопленных дало бы тот же
+-- объем WAL, который вынос должен экономить. Старые логи читаются как раньше.
+
+CREATE TABLE IF NOT EXISTS log_blobs (
+    hash VARCHAR(64) PRIMARY KEY,
+    value JSONB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_log_blobs_last_seen ON log_blobs(last_seen);
+
+-- Содержимое части лога, вынесенной в log_blobs, или сама часть
+CREATE OR REPLACE FUNCTION log_blob_value(part JSONB) RETURNS JSONB AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(part) = 'object' AND part ? '$blob'
+        THEN COALESCE((SELECT value FROM log_blobs WHERE hash = part->>'$blob'), part)
+        ELSE part
+    END
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Поисковый индекс берет traceback из log_blobs, поэтому функция больше не IMMUTABLE
+CREATE OR REPLACE FUNCTION log_search_vector(log JSONB) RETURNS tsvector AS $$
+DECLARE
+    traceback JSONB := log_blob_value(log->'error'->'traceback');
+    body TEXT;
+    paths TEXT;
+BEGIN
+    body := left(concat_ws(' ',
+        log->'error'->>'type',
+        log->'error'->>'message',
+        log->>'message',
+        COALESCE(log->'request'->>'path', log->>'path'),
+        CASE jsonb_typeof(traceback)
+            WHEN 'array' THEN (SELECT string_agg(frame, ' ') FROM jsonb_array_elements_text(traceback) AS frame)
+            WHEN 'string' THEN traceback #>> '{}'
+        END
+    ), 100000);
+
+    -- Пути индексируются еще и по частям и суффиксам:
+    -- запросы payments и payments/services.py находят /opt/app/payments/services.py
+    SELECT string_agg(
+        CASE WHEN i > 1 THEN array_to_string(found.parts[i:], '/') || ' ' ELSE '' END || found.parts[i], ' '
+    )
+    INTO paths
+    FROM (
+        SELECT string_to_array(trim(BOTH '/' FROM m[1]), '/') AS parts
+        FROM regexp_matches(body, '((?:/[\w.\-]+)+)', 'g') AS m
+    ) AS found, generate_subscripts(found.parts, 1) AS i;
+
+    RETURN to_tsvector('simple', concat_ws(' ', body, paths));
+END;
+$$ LANGUAGE plpgsql STABLE PARALLEL SAFE;
+
+GRANT ALL PRIVILEGES ON TABLE log_blobs TO ai_issue_genius;
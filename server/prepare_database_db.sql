@@ -4,24 +4,162 @@ ALTER USER ai_issue_genius WITH SUPERUSER;
 
 \c ai_issue_genius
 
--- Сначала создаем таблицу от имени postgres пользователя
+-- Сначала создаем таблицу от имени postgres пользователя.
+-- Таблица партиционирована по времени: партиции (день или неделя) создает
+-- и удаляет по сроку хранения сервер, см. utils/partitions.py
 CREATE TABLE logs (
-    id BIGSERIAL PRIMARY KEY,
-    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    id BIGSERIAL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     service VARCHAR(100) NOT NULL,
     log JSONB,
     ai_analysis JSONB,
+    analysis_time TIMESTAMP WITH TIME ZONE,
+    lease_owner VARCHAR(100),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    fingerprint VARCHAR(40),
+    -- Поля лога для фильтров GET /api/logs, заполняются сервером при вставке (utils/log_fields.py)
+    level TEXT,
+    error_type TEXT,
+    request_path TEXT,
+    request_id TEXT,
+    environment TEXT,
+    event_time TIMESTAMP WITH TIME ZONE,
+    -- Полнотекстовый поиск (GET /api/logs/search): тип, сообщение, traceback и путь запроса
+    search_vector TSVECTOR,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Создаем индексы: для временных колонок BRIN, строки пишутся почти по порядку времени
+CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs USING BRIN (timestamp);
+CREATE INDEX IF NOT EXISTS idx_logs_service ON logs(service);
+CREATE INDEX IF NOT EXISTS idx_logs_analysis_time ON logs USING BRIN (analysis_time);
+-- Очередь на анализ: выборка и захват логов остаются O(размер пачки) при росте таблицы
+CREATE INDEX IF NOT EXISTS idx_logs_unanalyzed ON logs(service, id) WHERE analysis_time IS NULL;
+CREATE INDEX IF NOT EXISTS idx_logs_fingerprint ON logs(fingerprint);
+CREATE INDEX IF NOT EXISTS idx_logs_level ON logs(level);
+CREATE INDEX IF NOT EXISTS idx_logs_error_type ON logs(error_type);
+-- text_pattern_ops: и точное совпадение, и поиск по префиксу пути (LIKE '/api/orders/%')
+CREATE INDEX IF NOT EXISTS idx_logs_request_path ON logs(request_path text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_logs_request_id ON logs(request_id);
+CREATE INDEX IF NOT EXISTS idx_logs_environment ON logs(environment);
+CREATE INDEX IF NOT EXISTS idx_logs_event_time ON logs USING BRIN (event_time);
+-- Произвольные условия на исходный JSON: log @> '{"user": {"id": 5}}'
+CREATE INDEX IF NOT EXISTS idx_logs_log ON logs USING GIN (log jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_logs_search_vector ON logs USING GIN (search_vector);
+
+-- Крупные повторяющиеся части логов (traceback, versions, settings) хранятся один раз
+-- по sha256 содержимого, в logs остается ссылка {"$blob": hash}; см. utils/blobs.py.
+-- last_seen обновляется не чаще раза в сутки и нужен для удаления блобов вслед за партициями
+CREATE TABLE log_blobs (
+    hash VARCHAR(64) PRIMARY KEY,
+    value JSONB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_log_blobs_last_seen ON log_blobs(last_seen);
+
+-- Содержимое части лога, вынесенной в log_blobs, или сама часть
+CREATE OR REPLACE FUNCTION log_blob_value(part JSONB) RETURNS JSONB AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(part) = 'object' AND part ? '$blob'
+        THEN COALESCE((SELECT value FROM log_blobs WHERE hash = part->>'$blob'), part)
+        ELSE part
+    END
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- search_vector заполняет триггер: так он работает и для INSERT, и для COPY пакетной вставки.
+-- Словарь simple: без стемминга, подходит для имен классов, путей и смеси языков
+CREATE OR REPLACE FUNCTION log_search_vector(log JSONB) RETURNS tsvector AS $$
+DECLARE
+    traceback JSONB := log_blob_value(log->'error'->'traceback');
+    body TEXT;
+    paths TEXT;
+BEGIN
+    body := left(concat_ws(' ',
+        log->'error'->>'type',
+        log->'error'->>'message',
+        log->>'message',
+        COALESCE(log->'request'->>'path', log->>'path'),
+        CASE jsonb_typeof(traceback)
+            WHEN 'array' THEN (SELECT string_agg(frame, ' ') FROM jsonb_array_elements_text(traceback) AS frame)
+            WHEN 'string' THEN traceback #>> '{}'
+        END
+    ), 100000);
+
+    -- Пути индексируются еще и по частям и суффиксам:
+    -- запросы payments и payments/services.py находят /opt/app/payments/services.py
+    SELECT string_agg(
+        CASE WHEN i > 1 THEN array_to_string(found.parts[i:], '/') || ' ' ELSE '' END || found.parts[i], ' '
+    )
+    INTO paths
+    FROM (
+        SELECT string_to_array(trim(BOTH '/' FROM m[1]), '/') AS parts
+        FROM regexp_matches(body, '((?:/[\w.\-]+)+)', 'g') AS m
+    ) AS found, generate_subscripts(found.parts, 1) AS i;
+
+    RETURN to_tsvector('simple', concat_ws(' ', body, paths));
+END;
+$$ LANGUAGE plpgsql STABLE PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION logs_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := log_search_vector(NEW.log);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER logs_search_vector BEFORE INSERT ON logs
+    FOR EACH ROW EXECUTE FUNCTION logs_search_vector_trigger();
+
+-- Группы повторяющихся ошибок: один анализ на отпечаток, а не на каждое появление
+CREATE TABLE error_groups (
+    fingerprint VARCHAR(40) PRIMARY KEY,
+    service VARCHAR(100) NOT NULL,
+    error_type TEXT,
+    message TEXT,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    count BIGINT NOT NULL DEFAULT 0,
+    last_log_id BIGINT,
+    ai_analysis JSONB,
     analysis_time TIMESTAMP WITH TIME ZONE
 );
 
--- Создаем индексы
-CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp);
-CREATE INDEX IF NOT EXISTS idx_logs_service ON logs(service);
-CREATE INDEX IF NOT EXISTS idx_logs_analysis_time ON logs(analysis_time);
+CREATE INDEX IF NOT EXISTS idx_error_groups_pending ON error_groups(service, last_seen) WHERE analysis_time IS NULL;
+
+-- Кластеры похожих ошибок: MinHash-сигнатуры для LSH-индекса сервера, см. utils/clustering.py
+CREATE TABLE error_clusters (
+    fingerprint VARCHAR(40) PRIMARY KEY,
+    service VARCHAR(100) NOT NULL,
+    error_type TEXT,
+    signature BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_error_clusters_created_at ON error_clusters(created_at);
+
+-- Счетчики логов по корзинам minute/hour/day для GET /api/logs/stats, см. utils/rollups.py
+CREATE TABLE log_rollups (
+    bucket VARCHAR(10) NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    service VARCHAR(100) NOT NULL,
+    level TEXT NOT NULL DEFAULT '',
+    fingerprint VARCHAR(40) NOT NULL DEFAULT '',
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, service, bucket_start, level, fingerprint)
+);
+
+CREATE INDEX IF NOT EXISTS idx_log_rollups_bucket_start ON log_rollups(bucket, bucket_start);
 
 -- Предоставляем права пользователю ai_issue_genius
 GRANT ALL PRIVILEGES ON TABLE logs TO ai_issue_genius;
 GRANT ALL PRIVILEGES ON SEQUENCE logs_id_seq TO ai_issue_genius;
+GRANT ALL PRIVILEGES ON TABLE error_groups TO ai_issue_genius;
+GRANT ALL PRIVILEGES ON TABLE error_clusters TO ai_issue_genius;
+GRANT ALL PRIVILEGES ON TABLE log_rollups TO ai_issue_genius;
+GRANT ALL PRIVILEGES ON TABLE log_blobs TO ai_issue_genius;
 GRANT USAGE ON SCHEMA public TO ai_issue_genius;
 
 
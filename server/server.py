@@ -1,19 +1,40 @@
 import os
 import sys
+import asyncio
 import json
+import time
+import random
 import uvicorn
 import logging
 import traceback
 import jwt
+import orjson
+from collections import Counter
 from jwt.exceptions import InvalidTokenError
-from pydantic import BaseModel
+from pydantic import BaseModel, Field as ModelField
 from datetime import datetime, timezone, timedelta
 from fastapi import FastAPI, Query, Body, HTTPException, Request, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 
-from database import db
+from database import db, INSERT_DATA_ERRORS
+from utils.batch import parse_batch_body, validate_log
+from utils.ingest_buffer import IngestBuffer
+from utils.metrics import metrics
+from utils.partitions import PartitionManager
+from utils.archive import LogArchiver
+from utils.pagination import encode_cursor, decode_cursor
+from utils.events import LogEventBroker
+from utils.clustering import ErrorClusterIndex
+from utils.rate_limit import KeyedRateLimiter, retry_after_header
+from utils.password_hasher import PasswordHasherBusy
+from utils.rollups import RollupAggregator, BUCKETS, bucket_start
+from utils.admission import AdmissionController, AdmissionRejected, parse_service_limits
+from utils.projection import Field, parse_fields, project_row
+from utils.blobs import blob_path_in
+from utils.compression import CompressionMiddleware
 
 app = FastAPI(title="AI Issue Genius API", version="1.0.0")
 
@@ -36,6 +57,14 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешаем все заголовки
 )
 
+# Сжатие ответов по Accept-Encoding (zstd, gzip): ответы меньше порога в байтах не сжимаются
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "1024")),
+    gzip_level=int(os.getenv("COMPRESS_GZIP_LEVEL", "5")),
+    zstd_level=int(os.getenv("COMPRESS_ZSTD_LEVEL", "3")),
+)
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -50,6 +79,107 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Ограничение попыток входа до проверки пароля: попыток в минуту и запас на всплеск, по email и по IP
+login_limit_by_email = KeyedRateLimiter(
+    rate=float(os.getenv("LOGIN_RATE_PER_EMAIL", "5")) / 60,
+    burst=float(os.getenv("LOGIN_BURST_PER_EMAIL", "5")),
+)
+login_limit_by_ip = KeyedRateLimiter(
+    rate=float(os.getenv("LOGIN_RATE_PER_IP", "30")) / 60,
+    burst=float(os.getenv("LOGIN_BURST_PER_IP", "20")),
+)
+# X-Forwarded-For учитывается только по явной настройке: без прокси заголовок задает сам клиент.
+# 0 (по умолчанию) - IP соединения; N - за сервером N доверенных прокси (ingress), каждый дописывает
+# адрес клиента в заголовок, IP клиента берется на N позиций справа. В k8s за ingress - 1
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+
+# Максимальное количество записей в пакетном запросе
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+
+# Допуск на прием логов: логов в секунду и запас на всплеск для каждого сервиса (0 - без лимита),
+# отдельные лимиты сервисов ("nginx=200/400,django=1000"), одновременные записи в БД
+# (по умолчанию пул без двух соединений для чтения), доля одного сервиса и ожидание слота
+admission = AdmissionController(
+    rate=float(os.getenv("INGEST_RATE_PER_SERVICE", "0")),
+    burst=float(os.getenv("INGEST_BURST_PER_SERVICE", "0")),
+    service_limits=parse_service_limits(os.getenv("INGEST_SERVICE_LIMITS", "")),
+    max_in_flight=int(os.getenv("INGEST_MAX_IN_FLIGHT", str(max(1, db.pool_max_size - 2)))),
+    max_service_share=float(os.getenv("INGEST_MAX_SERVICE_SHARE", "0.5")),
+    queue_timeout=float(os.getenv("INGEST_QUEUE_TIMEOUT", "0.5")),
+)
+
+# Режим приема логов: sync - запись в БД до ответа, buffered - отложенная запись пачками
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+
+ingest_buffer: Optional[IngestBuffer] = None
+if INGEST_MODE == "buffered":
+    ingest_buffer = IngestBuffer(
+        db.insert_logs_batch,
+        max_queue_size=int(os.getenv("INGEST_QUEUE_SIZE", "10000")),
+        batch_size=int(os.getenv("INGEST_BATCH_SIZE", "500")),
+        flush_interval_ms=int(os.getenv("INGEST_FLUSH_MS", "200")),
+        data_errors=INSERT_DATA_ERRORS,
+    )
+
+# Партиционирование logs: интервал партиций (day/week), сколько периодов создавать заранее,
+# срок хранения в днях (0 - хранить бессрочно)
+partition_manager = PartitionManager(
+    db,
+    interval=os.getenv("PARTITION_INTERVAL", "day"),
+    premake=int(os.getenv("PARTITION_PREMAKE", "7")),
+    retention_days=int(os.getenv("LOG_RETENTION_DAYS", "0")),
+    check_interval_minutes=int(os.getenv("PARTITION_CHECK_MINUTES", "60")),
+)
+
+# Холодный архив: партиции старше ARCHIVE_AFTER_DAYS выгружаются в ARCHIVE_DIR
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+
+archiver: Optional[LogArchiver] = None
+if ARCHIVE_DIR:
+    archiver = LogArchiver(
+        db,
+        ARCHIVE_DIR,
+        archive_after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "7")),
+        check_interval_minutes=int(os.getenv("ARCHIVE_CHECK_MINUTES", "60")),
+    )
+    # Партиции удаляются по сроку хранения без выгрузки: срок должен быть больше порога архива
+    if 0 < partition_manager.retention_days <= archiver.archive_after_days:
+        raise ValueError(
+            f"LOG_RETENTION_DAYS ({partition_manager.retention_days}) должен быть больше "
+            f"ARCHIVE_AFTER_DAYS ({archiver.archive_after_days}), иначе логи удаляются до выгрузки в архив"
+        )
+
+# Отпечатки ошибок: cluster - похожие ошибки сводятся в один кластер (MinHash/LSH), exact - точный хеш
+FINGERPRINT_MODE = os.getenv("FINGERPRINT_MODE", "cluster")
+
+error_clusters: Optional[ErrorClusterIndex] = None
+if FINGERPRINT_MODE == "cluster":
+    error_clusters = ErrorClusterIndex(
+        db,
+        threshold=float(os.getenv("CLUSTER_THRESHOLD", "0.6")),
+        sync_interval_seconds=float(os.getenv("CLUSTER_SYNC_SECONDS", "5")),
+    )
+
+# Счетчики логов для GET /api/logs/stats: период записи в БД и срок хранения корзин в днях
+rollups = RollupAggregator(
+    db,
+    flush_interval_seconds=float(os.getenv("ROLLUP_FLUSH_SECONDS", "10")),
+    retention_days={
+        "minute": int(os.getenv("ROLLUP_MINUTE_RETENTION_DAYS", "8")),
+        "hour": int(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", "90")),
+        "day": int(os.getenv("ROLLUP_DAY_RETENTION_DAYS", "0")),
+    },
+)
+db.on_insert = rollups.record
+
+# Рассылка событий о новых логах (LISTEN/NOTIFY) подписчикам /api/logs/stream
+log_events = LogEventBroker(db, max_queue_size=int(os.getenv("STREAM_QUEUE_SIZE", "1000")))
+SSE_HEARTBEAT_SECONDS = 15
+
+# Выборочное логирование тел запросов (уровень DEBUG): доля запросов и лимит в байтах
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0"))
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", "2048"))
+
 # Схемы безопасности
 security = HTTPBearer()
 
@@ -77,6 +207,64 @@ class UserResponse(BaseModel):
 
 
 # Вспомогательные функции
+def admission_error(error: AdmissionRejected) -> HTTPException:
+    """Быстрый отказ в приеме логов с подсказкой, когда повторить"""
+    return HTTPException(
+        status_code=error.status_code,
+        detail=error.detail,
+        headers={"Retry-After": retry_after_header(error.retry_after)},
+    )
+
+
+def admit_batch(records: List[Tuple[int, Dict]], errors: List[Dict], counts: Counter):
+    """
+    Пропускает часть пачки, на которую хватает маркеров каждого сервиса; остальные
+    записи уходят в errors. Записи сверх burst сервиса отклоняются без повтора:
+    ведро столько не вмещает. Если не прошло ничего - 429 (повторяемый) или 413.
+    """
+    admitted = {}
+    limited = {}
+    over_burst = {}
+    for service, count in counts.items():
+        granted, over, retry_after = admission.take_batch(service, count)
+        admitted[service] = granted
+        if granted + over < count:
+            limited[service] = retry_after
+        if over:
+            over_burst[service] = over
+
+    if not limited and not over_burst:
+        return records, errors
+
+    kept = []
+    seen = Counter()
+    for index, log in records:
+        service = log.get('service', 'unknown')
+        seen[service] += 1
+        burst = counts[service] - over_burst.get(service, 0)
+        if seen[service] <= admitted[service]:
+            kept.append((index, log))
+        elif seen[service] <= burst:
+            errors.append({'index': index, 'error': f"Превышен лимит приема логов сервиса {service}"})
+        else:
+            errors.append({
+                'index': index,
+                'error': f"Пачка сервиса {service} больше запаса лимита ({burst} логов), разбейте ее на части"
+            })
+    errors.sort(key=lambda item: item['index'])
+
+    if not kept:
+        if limited:
+            raise AdmissionRejected(
+                429, "Превышен лимит приема логов: " + ", ".join(sorted(limited)), max(limited.values())
+            )
+        raise HTTPException(
+            status_code=413,
+            detail="Пачка больше запаса лимита сервисов " + ", ".join(sorted(over_burst)) + ", разбейте ее на части"
+        )
+    return kept, errors
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Создает JWT токен"""
     to_encode = data.copy()
@@ -107,7 +295,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except InvalidTokenError:
         raise credentials_exception
 
-    user = await db.get_user_by_email(token_data.email)
+    user = await db.get_user_by_email_cached(token_data.email)
     if user is None:
         raise credentials_exception
 
@@ -120,38 +308,112 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 async def startup_event():
     """Инициализация при запуске"""
     await db.connect()
+    await partition_manager.start()
+    await log_events.start()
+    if archiver:
+        await archiver.start()
+    if error_clusters:
+        await error_clusters.start()
+        db.fingerprinter = error_clusters.assign
+    await rollups.start()
+    if ingest_buffer:
+        await ingest_buffer.start()
     print("Приложение запущено")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Очистка при остановке"""
+    # Буфер должен дописать очередь до закрытия пула
+    if ingest_buffer:
+        await ingest_buffer.stop()
+    await partition_manager.stop()
+    await log_events.stop()
+    if archiver:
+        await archiver.stop()
+    if error_clusters:
+        await error_clusters.stop()
+    await rollups.stop()
     await db.disconnect()
+    db.password_hasher.shutdown()
     print("Приложение остановлено")
 
 
+def collect_runtime_metrics():
+    """Мгновенные значения пула подключений и буфера приема логов"""
+    pool = db.pool_stats()
+    yield "db_pool_size", "gauge", (), pool["size"]
+    yield "db_pool_idle", "gauge", (), pool["idle"]
+    yield "db_pool_in_use", "gauge", (), pool["in_use"]
+    yield "db_pool_max_size", "gauge", (), pool["max_size"]
+
+    yield "bcrypt_in_flight", "gauge", (), db.password_hasher.in_flight
+    yield "bcrypt_rejected_total", "counter", (), db.password_hasher.rejected
+    yield "login_throttled_total", "counter", (("key", "ip"),), login_limit_by_ip.rejected
+    yield "login_throttled_total", "counter", (("key", "email"),), login_limit_by_email.rejected
+
+    yield "user_cache_entries", "gauge", (), len(db.user_cache)
+    yield "user_cache_hits_total", "counter", (), db.user_cache.hits
+    yield "user_cache_misses_total", "counter", (), db.user_cache.misses
+
+    yield "log_blob_split_bytes_total", "counter", (), db.blob_stats["split_bytes"]
+    yield "log_blob_stored_bytes_total", "counter", (), db.blob_stats["stored_bytes"]
+    yield "log_blob_writes_skipped_total", "counter", (), db.blob_stats["skipped"]
+    yield "log_blob_cache_entries", "gauge", (), len(db.blob_cache)
+    yield "log_blob_cache_hits_total", "counter", (), db.blob_cache.hits
+    yield "log_blob_cache_misses_total", "counter", (), db.blob_cache.misses
+
+    yield "ingest_in_flight", "gauge", (), sum(admission.in_flight.values())
+    for (service, reason), count in admission.shed.items():
+        yield "ingest_shed_total", "counter", (("service", service), ("reason", reason)), count
+
+    yield "stream_subscribers", "gauge", (), len(log_events.subscriptions)
+    yield "stream_events_delivered_total", "counter", (), log_events.delivered
+
+    if ingest_buffer:
+        stats = ingest_buffer.stats()
+        yield "ingest_queue_depth", "gauge", (), stats["queue_depth"]
+        yield "ingest_accepted_total", "counter", (), stats["accepted"]
+        yield "ingest_rejected_total", "counter", (), stats["rejected"]
+        yield "ingest_flushed_total", "counter", (), stats["flushed"]
+        yield "ingest_failed_flushes_total", "counter", (), stats["failed_flushes"]
+        yield "ingest_last_flush_seconds", "gauge", (), stats["last_flush_ms"] / 1000
+
+    yield "rollup_pending_keys", "gauge", (), len(rollups.counts)
+    yield "rollup_flushed_logs_total", "counter", (), rollups.flushed
+    yield "rollup_failed_flushes_total", "counter", (), rollups.failed_flushes
+
+    if error_clusters:
+        yield "error_clusters", "gauge", (), len(error_clusters.signatures)
+        for outcome, count in error_clusters.stats.items():
+            yield "error_cluster_assignments_total", "counter", (("outcome", outcome),), count
+
+
+metrics.add_collector(collect_runtime_metrics)
+
+
 @app.middleware("http")
-async def log_request_body(request: Request, call_next):
-    # Логируем входящий запрос
-    client_host = request.client.host if request.client else "unknown"
-    logger.info(f"Входящий запрос: {request.method} {request.url} от {client_host}")
+async def collect_request_metrics(request: Request, call_next):
+    """Собирает метрики по запросам; тело запроса логируется только по выборке"""
+    started = time.perf_counter()
 
-    try:
-        # Пытаемся прочитать тело запроса для логирования
+    if LOG_BODY_SAMPLE_RATE > 0 and logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_BODY_SAMPLE_RATE:
         body = await request.body()
         if body:
-            try:
-                body_json = json.loads(body.decode())
-                logger.debug(f"Тело запроса: {json.dumps(body_json, indent=2)}")
-            except json.JSONDecodeError:
-                logger.debug(f"Тело запроса (не JSON): {body.decode()[:500]}...")  # Ограничиваем длину
-    except Exception as e:
-        logger.warning(f"Не удалось прочитать тело запроса: {str(e)}")
+            logger.debug(f"Тело запроса {request.method} {request.url.path}: "
+                         f"{body[:LOG_BODY_MAX_BYTES].decode(errors='replace')}")
 
-    # Продолжаем обработку
     response = await call_next(request)
 
-    # Логируем ответ
-    logger.info(f"Ответ: {request.method} {request.url} - Status: {response.status_code}")
+    # Шаблон маршрута вместо фактического пути, чтобы не плодить серии
+    route = request.scope.get("route")
+    metrics.observe_request(
+        request.method,
+        route.path if route else "unmatched",
+        response.status_code,
+        time.perf_counter() - started,
+        int(request.headers.get("content-length", -1)),
+        int(response.headers.get("content-length", -1)),
+    )
 
     return response
 
@@ -187,6 +449,14 @@ async def register_user(user: UserCreate):
 
         return new_user
 
+    except HTTPException:
+        raise
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис перегружен, повторите регистрацию позже",
+            headers={"Retry-After": "1"},
+        )
     except Exception as e:
         logger.error(f"Ошибка при регистрации пользователя: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -199,11 +469,49 @@ async def options_login():
     """Обработка OPTIONS запроса для CORS"""
     return {"message": "OK"}
 
+def client_address(request: Request) -> str:
+    """
+    IP клиента для ограничения попыток входа. Адреса левее доверенных прокси
+    клиент может подставить сам, поэтому берется адрес, записанный ближайшим к клиенту прокси
+    """
+    peer = request.client.host if request.client else "unknown"
+    if TRUSTED_PROXY_COUNT <= 0:
+        return peer
+
+    forwarded = [
+        address.strip()
+        for header in request.headers.getlist("x-forwarded-for")
+        for address in header.split(",")
+        if address.strip()
+    ]
+    if len(forwarded) < TRUSTED_PROXY_COUNT:
+        # Запрос пришел не через все прокси
+        return peer
+    return forwarded[-TRUSTED_PROXY_COUNT]
+
+
 @app.post("/api/auth/login", response_model=Token)
-async def login_user(user: UserLogin):
+async def login_user(user: UserLogin, request: Request):
     """Аутентификация пользователя и получение JWT токена"""
+    client_ip = client_address(request)
+    for limiter, key in ((login_limit_by_ip, client_ip), (login_limit_by_email, user.email.lower())):
+        allowed, retry_after = limiter.take(key)
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Слишком много попыток входа, повторите позже",
+                headers={"Retry-After": retry_after_header(retry_after)},
+            )
+
     # Аутентифицируем пользователя
-    authenticated_user = await db.authenticate_user(user.email, user.password)
+    try:
+        authenticated_user = await db.authenticate_user(user.email, user.password)
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис перегружен, повторите вход позже",
+            headers={"Retry-After": "1"},
+        )
     if not authenticated_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -230,21 +538,57 @@ async def get_current_user_info(current_user: Dict[str, Any] = Depends(get_curre
     return current_user
 
 
-@app.post("/api/logs")
+@app.post("/api/logs", response_class=ORJSONResponse)
 async def receive_log(log: Dict[Any, Any] = Body(...)):
     """Принимает лог и сохраняет его в PostgreSQL"""
     try:
+        # Та же проверка, что у /api/logs/batch: запись, которую БД не примет, не должна попасть в буфер
+        error = validate_log(log)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+
         # Извлекаем service из лога или используем значение по умолчанию
         service = log.get('service', 'unknown')
 
-        # Сохраняем в базу данных
-        log_id = await db.insert_log(service, log)
+        if ingest_buffer:
+            admission.check_rate(service)
+            # Отложенная запись: отвечаем сразу, в БД лог попадет со следующей пачкой
+            if not ingest_buffer.put(service, log):
+                admission.refund(service)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Очередь приема логов переполнена",
+                    headers={"Retry-After": "1"}
+                )
+
+            return ORJSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    "status": "accepted",
+                    "log_id": None,
+                    "message": "Лог принят в очередь на сохранение"
+                }
+            )
+
+        # Сохраняем в базу данных; маркер списывается только после получения слота
+        # и возвращается, если запись не удалась
+        async with admission.slot(service):
+            admission.check_rate(service)
+            try:
+                log_id = await db.insert_log(service, log)
+            except Exception:
+                admission.refund(service)
+                raise
 
         return {
             "status": "success",
             "log_id": log_id,
             "message": "Лог успешно сохранен в БД"
         }
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
     except Exception as e:
         traceback.print_exception(*sys.exc_info())
 
@@ -253,11 +597,96 @@ async def receive_log(log: Dict[Any, Any] = Body(...)):
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения лога: {str(e)}")
 
 
+@app.post("/api/logs/batch", response_class=ORJSONResponse)
+async def receive_logs_batch(request: Request):
+    """Принимает пачку логов (JSON-массив или NDJSON) и сохраняет их одной транзакцией"""
+    body = await request.body()
+    if not body.strip():
+        raise HTTPException(status_code=400, detail="Пустое тело запроса")
+
+    try:
+        records, errors = parse_batch_body(body)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректное тело запроса: {str(e)}")
+
+    if len(records) + len(errors) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Слишком много записей, максимум {MAX_BATCH_SIZE}")
+
+    counts = Counter(log.get('service', 'unknown') for _, log in records)
+    admitted = Counter()
+
+    try:
+        # Слот учитывается за сервисом, которому принадлежит большая часть пачки;
+        # маркеры списываются только после получения слота, при отказе в слоте они не теряются
+        async with admission.slot(counts.most_common(1)[0][0] if counts else 'unknown', len(records)):
+            records, errors = admit_batch(records, errors, counts)
+            admitted = Counter(log.get('service', 'unknown') for _, log in records)
+            inserted_ids = await db.insert_logs_batch(
+                [(log.get('service', 'unknown'), log) for _, log in records]
+            )
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except Exception as e:
+        traceback.print_exception(*sys.exc_info())
+        # Пачка не записана: маркеры возвращаются, чтобы повтор клиента не получил 429
+        for service, count in admitted.items():
+            admission.refund(service, count)
+
+        if "Database connection not established" in str(e):
+            raise HTTPException(status_code=503, detail="Сервис временно недоступен: нет подключения к БД")
+        raise HTTPException(status_code=500, detail=f"Ошибка сохранения логов: {str(e)}")
+
+    # ID выравниваются по позициям входных записей, у невалидных записей - None
+    log_ids = [None] * (len(records) + len(errors))
+    for (index, _), log_id in zip(records, inserted_ids):
+        log_ids[index] = log_id
+
+    return {
+        "status": "success" if not errors else "partial",
+        "log_ids": log_ids,
+        "saved": len(inserted_ids),
+        "errors": errors,
+        "message": f"Сохранено логов: {len(inserted_ids)}"
+    }
+
+
+class ClaimLogsRequest(BaseModel):
+    # Длины по колонкам logs.lease_owner и logs.service (VARCHAR(100))
+    worker_id: str = ModelField(min_length=1, max_length=100)
+    service: str = ModelField("django", min_length=1, max_length=100)
+    limit: int = 10
+    lease_seconds: int = 600
+
+@app.post("/api/logs/claim", response_class=ORJSONResponse)
+async def claim_logs(request: ClaimLogsRequest):
+    """Выдает агенту в аренду пачку непроанализированных логов"""
+    if not 0 < request.limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit должен быть от 1 до 1000")
+    if request.lease_seconds <= 0:
+        raise HTTPException(status_code=400, detail="lease_seconds должен быть больше 0")
+
+    try:
+        logs = await db.claim_logs(request.service, request.worker_id, request.limit, request.lease_seconds)
+
+        return ORJSONResponse({
+            "count": len(logs),
+            "logs": logs
+        })
+    except Exception as e:
+        traceback.print_exception(*sys.exc_info())
+
+        if "Database connection not established" in str(e):
+            raise HTTPException(status_code=503, detail="Сервис временно недоступен: нет подключения к БД")
+        raise HTTPException(status_code=500, detail=f"Ошибка захвата логов: {str(e)}")
+
+
 class UpdateLogRequest(BaseModel):
     log_id: int
     analysis: Dict[Any, Any]
 
-@app.put("/api/logs")
+@app.put("/api/logs", response_class=ORJSONResponse)
 async def update_log(request: UpdateLogRequest):
     """Добавляет AI-анализ лога"""
 
@@ -278,27 +707,122 @@ async def update_log(request: UpdateLogRequest):
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения лога: {str(e)}")
 
 
-@app.get("/api/logs")
+async def stream_logs_ndjson(service: Optional[str], start_time: datetime, end_time: datetime,
+                             filters: Optional[Dict[str, Any]] = None, fields: Optional[List[Field]] = None):
+    """Потоковая выгрузка логов в NDJSON: память не зависит от размера выборки"""
+    if service:
+        source = db.iter_logs_by_service(service, filters=filters, fields=fields)
+    else:
+        source = db.iter_logs_by_time_range(start_time, end_time, filters=filters, fields=fields)
+
+    async for rows in source:
+        yield b"".join(orjson.dumps(row) + b"\n" for row in rows)
+
+    if not service and archiver and archiver.covers(start_time):
+        files = archiver.iter_logs(start_time, end_time, filters=filters)
+        while True:
+            rows = await asyncio.to_thread(next, files, None)
+            if rows is None:
+                break
+            yield b"".join(orjson.dumps(project_row(row, fields)) + b"\n" for row in rows)
+
+
+@app.get("/api/logs", response_class=ORJSONResponse)
 async def get_logs(
         service: Optional[str] = Query(None, description="Фильтр по сервису"),
         hours: Optional[int] = Query(24, description="Количество часов для выборки"),
-        limit: Optional[int] = Query(100, description="Лимит записей")
+        limit: Optional[int] = Query(100, description="Лимит записей"),
+        cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+        output: str = Query("json", alias="format", description="json - страница, ndjson - потоковая выгрузка"),
+        level: Optional[str] = Query(None, description="Уровень лога"),
+        error_type: Optional[str] = Query(None, description="Тип ошибки (error.type)"),
+        request_path: Optional[str] = Query(None, description="Путь запроса, * на конце - поиск по префиксу"),
+        request_id: Optional[str] = Query(None, description="ID запроса"),
+        environment: Optional[str] = Query(None, description="Окружение"),
+        event_from: Optional[datetime] = Query(None, description="Время события в логе, не раньше"),
+        event_to: Optional[datetime] = Query(None, description="Время события в логе, не позже"),
+        contains: Optional[str] = Query(None, description='JSON, который должен входить в лог, например {"user": {"id": 5}}'),
+        fields: Optional[str] = Query(None, description="Поля ответа через запятую, например id,timestamp,service,log.error.type")
 ):
     """Получает логи с фильтрацией"""
+    try:
+        position = decode_cursor(cursor) if cursor else {}
+        projection = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Фильтры выполняются в SQL по колонкам logs; на следующих страницах их нужно передавать снова
+    filters = {
+        "level": level,
+        "error_type": error_type,
+        "request_path": request_path,
+        "request_id": request_id,
+        "environment": environment,
+        "event_from": event_from.replace(tzinfo=event_from.tzinfo or timezone.utc) if event_from else None,
+        "event_to": event_to.replace(tzinfo=event_to.tzinfo or timezone.utc) if event_to else None,
+    }
+    if contains:
+        try:
+            filters["contains"] = orjson.loads(contains)
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="contains должен быть корректным JSON")
+        if not isinstance(filters["contains"], (dict, list)):
+            raise HTTPException(status_code=400, detail="contains должен быть JSON-объектом или массивом")
+        blob_path = blob_path_in(filters["contains"])
+        if blob_path:
+            raise HTTPException(
+                status_code=400,
+                detail=f"contains не поддерживает поле {blob_path}: оно хранится отдельно от лога"
+            )
+    filters = {key: value for key, value in filters.items() if value is not None}
+
+    # Окно времени фиксируется в курсоре, чтобы страницы не съезжали
+    if "start" in position:
+        start_time = position["start"]
+        end_time = position["end"]
+    else:
+        end_time = datetime.now(tz=timezone.utc)
+        start_time = end_time - timedelta(hours=hours)
+
+    if output == "ndjson":
+        return StreamingResponse(
+            stream_logs_ndjson(service, start_time, end_time, filters, projection),
+            media_type="application/x-ndjson"
+        )
+
     try:
         if service:
             # Фильтр по сервису
-            logs = await db.get_logs_by_service(service, limit)
+            logs = await db.get_logs_by_service(
+                service, limit, after_id=position.get("id"), filters=filters, fields=projection
+            )
+            next_position = {}
         else:
             # Фильтр по времени
-            end_time = datetime.now(tz=timezone.utc)
-            start_time = end_time - timedelta(hours=hours)
-            logs = await db.get_logs_by_time_range(start_time, end_time, limit)
+            before_id = position.get("id")
+            logs = await db.get_logs_by_time_range(
+                start_time, end_time, limit, before_id=before_id, filters=filters, fields=projection
+            )
 
-        return {
+            # Недостающее до limit дочитываем из архива, там только более старые логи
+            if archiver and archiver.covers(start_time) and len(logs) < limit:
+                archived = await asyncio.to_thread(
+                    archiver.read_logs, start_time, end_time, limit - len(logs),
+                    before_id=logs[-1]["id"] if logs else before_id, filters=filters
+                )
+                logs += [project_row(row, projection) for row in archived]
+            next_position = {"start": start_time.isoformat(), "end": end_time.isoformat()}
+
+        next_cursor = None
+        if logs and len(logs) >= limit:
+            next_cursor = encode_cursor({**next_position, "id": logs[-1]["id"]})
+
+        # Строки уже содержат разобранный jsonb, orjson сериализует их без jsonable_encoder
+        return ORJSONResponse({
             "count": len(logs),
-            "logs": logs
-        }
+            "logs": logs,
+            "next_cursor": next_cursor
+        })
 
     except Exception as e:
         traceback.print_exception(*sys.exc_info())
@@ -308,6 +832,240 @@ async def get_logs(
         raise HTTPException(status_code=500, detail=f"Ошибка получения лога: {str(e)}")
 
 
+@app.get("/api/logs/search", response_class=ORJSONResponse)
+async def search_logs(
+        q: str = Query(..., description='Поисковый запрос: слова, "фраза", -исключение, or'),
+        service: Optional[str] = Query(None, description="Фильтр по сервису"),
+        hours: int = Query(24, description="Количество часов для поиска"),
+        order: str = Query("recent", description="recent - от новых к старым, rank - по релевантности"),
+        limit: int = Query(50, description="Лимит записей"),
+        cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+        level: Optional[str] = Query(None, description="Уровень лога"),
+        error_type: Optional[str] = Query(None, description="Тип ошибки (error.type)"),
+        environment: Optional[str] = Query(None, description="Окружение")
+):
+    """Полнотекстовый поиск по сообщениям, traceback и путям запросов"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Пустой поисковый запрос")
+    if order not in ("recent", "rank"):
+        raise HTTPException(status_code=400, detail="order должен быть recent или rank")
+    if not 0 < limit <= 500:
+        raise HTTPException(status_code=400, detail="limit должен быть от 1 до 500")
+
+    try:
+        position = decode_cursor(cursor) if cursor else {}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Окно времени фиксируется в курсоре, чтобы страницы не съезжали
+    if "start" in position:
+        start_time = position["start"]
+        end_time = position["end"]
+        order = position.get("order", order)
+    else:
+        end_time = datetime.now(tz=timezone.utc)
+        start_time = end_time - timedelta(hours=hours)
+
+    filters = {"level": level, "error_type": error_type, "environment": environment}
+    filters = {key: value for key, value in filters.items() if value is not None}
+
+    try:
+        logs = await db.search_logs(
+            q, start_time, end_time, limit, order=order, service=service,
+            after=(position.get("rank"), position["id"]) if "id" in position else None,
+            filters=filters
+        )
+
+        next_cursor = None
+        if len(logs) >= limit:
+            next_cursor = encode_cursor({
+                "start": start_time.isoformat(),
+                "end": end_time.isoformat(),
+                "order": order,
+                "id": logs[-1]["id"],
+                "rank": logs[-1]["rank"],
+            })
+
+        return ORJSONResponse({
+            "count": len(logs),
+            "logs": logs,
+            "next_cursor": next_cursor
+        })
+    except Exception as e:
+        traceback.print_exception(*sys.exc_info())
+        if "Database connection not established" in str(e):
+            raise HTTPException(status_code=503, detail="Сервис временно недоступен: нет подключения к БД")
+
+        raise HTTPException(status_code=500, detail=f"Ошибка поиска логов: {str(e)}")
+
+
+# Длина корзины и предельное число корзин в одном ответе статистики
+STATS_BUCKET_LENGTH = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+STATS_MAX_BUCKETS = 10080
+
+
+@app.get("/api/logs/stats", response_class=ORJSONResponse)
+async def get_logs_stats(
+        service: Optional[str] = Query(None, description="Фильтр по сервису"),
+        bucket: str = Query("hour", description="Размер корзины: minute, hour, day"),
+        start: Optional[datetime] = Query(None, alias="from", description="Начало промежутка, по умолчанию сутки назад"),
+        end: Optional[datetime] = Query(None, alias="to", description="Конец промежутка, по умолчанию сейчас"),
+        level: Optional[str] = Query(None, description="Фильтр по уровню"),
+        fingerprint: Optional[str] = Query(None, description="Фильтр по отпечатку ошибки"),
+        group_by: str = Query("service,level", description="Разрез: service, level, fingerprint через запятую")
+):
+    """Количество логов по корзинам времени из счетчиков log_rollups"""
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket должен быть одним из: {', '.join(BUCKETS)}")
+
+    columns = tuple(column.strip() for column in group_by.split(",") if column.strip())
+    unknown = set(columns) - {"service", "level", "fingerprint"}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля group_by: {', '.join(sorted(unknown))}")
+
+    end_time = end or datetime.now(tz=timezone.utc)
+    start_time = start or end_time - timedelta(days=1)
+    # Время без зоны считается UTC
+    if end_time.tzinfo is None:
+        end_time = end_time.replace(tzinfo=timezone.utc)
+    if start_time.tzinfo is None:
+        start_time = start_time.replace(tzinfo=timezone.utc)
+
+    if start_time > end_time:
+        raise HTTPException(status_code=400, detail="from должен быть раньше to")
+    if (end_time - start_time) / STATS_BUCKET_LENGTH[bucket] > STATS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Слишком большой промежуток для bucket={bucket}, возьмите корзину крупнее")
+
+    try:
+        # Корзина, в которую попадает from, тоже входит в ответ
+        rows = await db.get_log_rollups(
+            bucket, bucket_start(start_time, bucket), end_time,
+            service=service, level=level, fingerprint=fingerprint, group_by=columns
+        )
+
+        return ORJSONResponse({
+            "bucket": bucket,
+            "from": start_time,
+            "to": end_time,
+            "count": len(rows),
+            "total": sum(row["count"] for row in rows),
+            "series": rows
+        })
+    except Exception as e:
+        traceback.print_exception(*sys.exc_info())
+        if "Database connection not established" in str(e):
+            raise HTTPException(status_code=503, detail="Сервис временно недоступен: нет подключения к БД")
+
+        raise HTTPException(status_code=500, detail=f"Ошибка получения статистики логов: {str(e)}")
+
+
+async def stream_log_events(request: Request, subscription):
+    """Server-Sent Events по новым логам, с heartbeat-комментариями для прокси"""
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield b": ping\n\n"
+                continue
+
+            # Забираем все накопившееся одной записью в сокет
+            events = [event]
+            while not subscription.queue.empty():
+                events.append(subscription.queue.get_nowait())
+
+            yield b"".join(
+                b"id: %d\nevent: log\ndata: %s\n\n" % (item["id"], orjson.dumps(item))
+                for item in events
+            )
+    finally:
+        log_events.unsubscribe(subscription)
+
+
+@app.get("/api/logs/storage", response_class=ORJSONResponse)
+async def get_logs_storage():
+    """Отчет об экономии места от хранения повторяющихся частей логов в log_blobs"""
+    try:
+        storage = await db.get_blob_storage_stats()
+    except Exception as e:
+        traceback.print_exception(*sys.exc_info())
+        if "Database connection not established" in str(e):
+            raise HTTPException(status_code=503, detail="Сервис временно недоступен: нет подключения к БД")
+
+        raise HTTPException(status_code=500, detail=f"Ошибка получения отчета о хранении: {str(e)}")
+
+    # С момента запуска процесса: сколько байт вынесено из логов и сколько из них записано впервые
+    split_bytes = db.blob_stats["split_bytes"]
+    stored_bytes = db.blob_stats["stored_bytes"]
+    return ORJSONResponse({
+        **storage,
+        "since_start": {
+            "split_bytes": split_bytes,
+            "stored_bytes": stored_bytes,
+            "saved_bytes": split_bytes - stored_bytes,
+            "dedup_ratio": round(split_bytes / stored_bytes, 2) if stored_bytes else None,
+            "writes_skipped": db.blob_stats["skipped"],
+        }
+    })
+
+
+@app.get("/api/logs/stream")
+async def stream_logs(
+        request: Request,
+        service: Optional[str] = Query(None, description="Фильтр по сервису"),
+        level: Optional[str] = Query(None, description="Фильтр по уровню")
+):
+    """Живой поток новых логов: id, service, level"""
+    subscription = log_events.subscribe(service, level)
+
+    return StreamingResponse(
+        stream_log_events(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/groups", response_class=ORJSONResponse)
+async def get_pending_groups(
+        service: str = Query("django", description="Сервис"),
+        limit: int = Query(20, description="Количество групп")
+):
+    """Группы повторяющихся ошибок, которые еще ждут анализа"""
+    if not 0 < limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit должен быть от 1 до 1000")
+
+    try:
+        groups = await db.get_pending_groups(service, limit)
+
+        return ORJSONResponse({
+            "count": len(groups),
+            "groups": groups
+        })
+    except Exception as e:
+        traceback.print_exception(*sys.exc_info())
+
+        if "Database connection not established" in str(e):
+            raise HTTPException(status_code=503, detail="Сервис временно недоступен: нет подключения к БД")
+        raise HTTPException(status_code=500, detail=f"Ошибка получения групп ошибок: {str(e)}")
+
+
+@app.get("/api/ingest/stats")
+async def get_ingest_stats():
+    """Состояние буфера приема логов"""
+    if not ingest_buffer:
+        return {"mode": INGEST_MODE, "admission": admission.stats()}
+
+    return {"mode": INGEST_MODE, **ingest_buffer.stats(), "admission": admission.stats()}
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Метрики сервиса в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/health")
 async def get_health():
     """Статус сервиса"""
@@ -0,0 +1,145 @@
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+from utils.rate_limit import KeyedRateLimiter, TokenBucket
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен к записи: status_code 429 (лимит сервиса) или 503 (нет свободных слотов)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def parse_service_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Лимиты отдельных сервисов из строки вида "nginx=200/400,django=1000/2000":
+    логов в секунду и запас на всплеск; "nginx=0" - сервис без ограничения
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        service, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        limits[service.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class AdmissionController:
+    """
+    Допуск запросов на прием логов.
+
+    Каждый сервис ограничен своим маркерным ведром (логов в секунду), поэтому
+    шумный nginx не расходует лимит Django. Одновременно в БД пишут не больше
+    max_in_flight запросов, и один сервис занимает не больше max_service_share
+    из них. Запрос, который не дождался слота за queue_timeout секунд, получает
+    быстрый отказ вместо ожидания pool.acquire() до command_timeout.
+    """
+
+    def __init__(self, rate: float = 0.0, burst: float = 0.0,
+                 service_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_in_flight: int = 10, max_service_share: float = 0.5, queue_timeout: float = 0.5):
+        # rate <= 0 - без ограничения (по умолчанию или для сервиса, тогда ведра нет - None);
+        # без burst запас равен секундному лимиту
+        self.limiter = KeyedRateLimiter(rate, burst or rate) if rate > 0 else None
+        self.service_buckets: Dict[str, Optional[TokenBucket]] = {
+            service: TokenBucket(service_rate, service_burst or service_rate) if service_rate > 0 else None
+            for service, (service_rate, service_burst) in (service_limits or {}).items()
+        }
+        self.max_in_flight = max_in_flight
+        self.max_per_service = max(1, int(max_in_flight * max_service_share))
+        self.queue_timeout = queue_timeout
+
+        self.in_flight: Counter = Counter()
+        # Отказы по (service, reason): rate - лимит сервиса, capacity - нет слотов
+        self.shed: Counter = Counter()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _bucket(self, service: str) -> Optional[TokenBucket]:
+        if service in self.service_buckets:
+            return self.service_buckets[service]
+        return self.limiter.bucket(service) if self.limiter is not None else None
+
+    def take(self, service: str, count: int = 1) -> Tuple[bool, float]:
+        """Забирает count маркеров из ведра сервиса; при отказе - через сколько секунд повторить"""
+        bucket = self._bucket(service)
+        if bucket is None:
+            return True, 0.0
+
+        allowed, retry_after = bucket.take(count)
+        if not allowed:
+            self.shed[(service, "rate")] += count
+        return allowed, retry_after
+
+    def take_batch(self, service: str, count: int) -> Tuple[int, int, float]:
+        """
+        Маркеры на пачку из count логов сервиса: пропускается та часть, на которую хватает маркеров.
+        Ведро не вмещает больше burst, поэтому записи сверх burst не пройдут никогда и не
+        считаются повторяемыми.
+        :return: сколько логов допущено, сколько сверх burst, через сколько секунд хватит на остаток
+        """
+        bucket = self._bucket(service)
+        if bucket is None:
+            return count, 0, 0.0
+
+        over_burst = max(0, count - int(bucket.burst))
+        granted, retry_after = bucket.take_up_to(count - over_burst)
+        if granted < count:
+            self.shed[(service, "rate")] += count - granted
+        return granted, over_burst, retry_after
+
+    def refund(self, service: str, count: int = 1):
+        """Возвращает маркеры логов, которые не были записаны из-за отказа в слоте"""
+        bucket = self._bucket(service)
+        if bucket is not None:
+            bucket.refund(count)
+
+    def check_rate(self, service: str, count: int = 1):
+        allowed, retry_after = self.take(service, count)
+        if not allowed:
+            raise AdmissionRejected(429, f"Превышен лимит приема логов сервиса {service}", retry_after)
+
+    @asynccontextmanager
+    async def slot(self, service: str, count: int = 1):
+        """Слот записи в БД; count - число логов запроса для учета отказов"""
+        # Семафор создается в работающем цикле событий
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if self.in_flight[service] >= self.max_per_service:
+            self.shed[(service, "capacity")] += count
+            raise AdmissionRejected(503, f"Сервис {service} занял свою долю слотов записи", self.queue_timeout)
+
+        # Ожидающий слота запрос уже учитывается в доле сервиса
+        self.in_flight[service] += 1
+        try:
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed[(service, "capacity")] += count
+                raise AdmissionRejected(503, "Сервер перегружен, повторите запись позже", self.queue_timeout)
+
+            try:
+                yield
+            finally:
+                self._semaphore.release()
+        finally:
+            self.in_flight[service] -= 1
+            if not self.in_flight[service]:
+                del self.in_flight[service]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "in_flight": sum(self.in_flight.values()),
+            "max_in_flight": self.max_in_flight,
+            "max_per_service": self.max_per_service,
+            "in_flight_by_service": dict(self.in_flight),
+            "shed": [
+                {"service": service, "reason": reason, "count": count}
+                for (service, reason), count in sorted(self.shed.items())
+            ],
+        }
@@ -0,0 +1,259 @@
+import os
+import gzip
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import orjson
+
+from utils.log_fields import match_log_filters
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveBucketWriter:
+    """
+    Пишет строки партиции в почасовые файлы NDJSON.gz.
+
+    Файл и его индекс сначала пишутся во временные пути и переименовываются
+    только в finish(), поэтому при сбое в архиве не остается неполных файлов.
+    """
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        self.files: Dict[datetime, Any] = {}
+        self.indexes: Dict[datetime, Dict[str, Any]] = {}
+
+    def bucket_path(self, bucket: datetime) -> str:
+        return os.path.join(self.archive_dir, f"{bucket:%Y/%m/%d}", f"logs_{bucket:%Y%m%d%H}.ndjson.gz")
+
+    def write_rows(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            timestamp = row["timestamp"]
+            bucket = timestamp.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+            if bucket not in self.files:
+                path = self.bucket_path(bucket)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.files[bucket] = gzip.open(path + ".tmp", "wb", compresslevel=6)
+                self.indexes[bucket] = {
+                    "file": os.path.relpath(path, self.archive_dir),
+                    "start": bucket.isoformat(),
+                    "end": (bucket + timedelta(hours=1)).isoformat(),
+                    "count": 0,
+                    "min_id": row["id"],
+                    "max_id": row["id"],
+                    "services": {},
+                }
+
+            self.files[bucket].write(orjson.dumps(row) + b"\n")
+
+            index = self.indexes[bucket]
+            index["count"] += 1
+            index["min_id"] = min(index["min_id"], row["id"])
+            index["max_id"] = max(index["max_id"], row["id"])
+
+            iso = timestamp.isoformat()
+            service = index["services"].setdefault(row["service"], {"count": 0, "min_ts": iso, "max_ts": iso})
+            service["count"] += 1
+            service["min_ts"] = min(service["min_ts"], iso)
+            service["max_ts"] = max(service["max_ts"], iso)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Закрывает файлы, пишет индексы и публикует файлы в архиве"""
+        for bucket, file in self.files.items():
+            file.close()
+            path = self.bucket_path(bucket)
+            with open(path + ".index.json.tmp", "wb") as index_file:
+                index_file.write(orjson.dumps(self.indexes[bucket]))
+                index_file.flush()
+                os.fsync(index_file.fileno())
+
+        for bucket in self.files:
+            path = self.bucket_path(bucket)
+            os.replace(path + ".tmp", path)
+            os.replace(path + ".index.json.tmp", path + ".index.json")
+
+        return list(self.indexes.values())
+
+    def abort(self):
+        """Удаляет временные файлы после ошибки"""
+        for bucket, file in self.files.items():
+            file.close()
+            path = self.bucket_path(bucket)
+            for tmp in (path + ".tmp", path + ".index.json.tmp"):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+
+class LogArchiver:
+    """
+    Холодный архив логов на локальном диске.
+
+    Партиции logs старше archive_after_days выгружаются в почасовые файлы
+    NDJSON.gz с индексом по сервисам и времени, после чего партиция удаляется.
+    Чтение по диапазону времени, уходящему в архивный период, идет по индексам.
+    """
+
+    def __init__(self, db, archive_dir: str, archive_after_days: int = 7,
+                 check_interval_minutes: int = 60, chunk_size: int = 5000):
+        self.db = db
+        self.archive_dir = archive_dir
+        self.archive_after_days = archive_after_days
+        self.check_interval = check_interval_minutes * 60
+        self.chunk_size = chunk_size
+
+        # Индексы всех файлов архива и граница, до которой данные уже в архиве
+        self.catalog: List[Dict[str, Any]] = []
+        self.archived_until: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def load_catalog(self):
+        """Загружает индексы файлов архива с диска"""
+        catalog = []
+        for root, _, files in os.walk(self.archive_dir):
+            for name in files:
+                if name.endswith(".index.json"):
+                    with open(os.path.join(root, name), "rb") as index_file:
+                        catalog.append(self._parse_index(orjson.loads(index_file.read())))
+
+        catalog.sort(key=lambda index: index["start"])
+        self.catalog = catalog
+        self.archived_until = max((index["end"] for index in catalog), default=None)
+
+    @staticmethod
+    def _parse_index(index: Dict[str, Any]) -> Dict[str, Any]:
+        index["start"] = datetime.fromisoformat(index["start"])
+        index["end"] = datetime.fromisoformat(index["end"])
+        return index
+
+    def archived_count(self, range_start: datetime, range_end: datetime) -> int:
+        """Строк в файлах архива внутри диапазона партиции"""
+        return sum(
+            index["count"] for index in self.catalog
+            if range_start <= index["start"] and index["end"] <= range_end
+        )
+
+    async def archive_partition(self, name: str, range_start: Optional[datetime] = None,
+                                range_end: Optional[datetime] = None) -> int:
+        """
+        Выгружает партицию в архив и удаляет ее, возвращает количество строк.
+        Если по каталогу партиция уже выгружена целиком (сбой между публикацией файлов
+        и удалением партиции), файлы не пишутся заново, партиция только удаляется
+        """
+        if range_start is not None and range_end is not None:
+            archived = self.archived_count(range_start, range_end)
+            if archived and archived == await self.db.count_log_partition(name):
+                await self.db.drop_log_partition(name)
+                logger.info(f"Партиция {name} уже была в архиве ({archived} логов), удалена")
+                return archived
+
+        writer = ArchiveBucketWriter(self.archive_dir)
+        count = 0
+        try:
+            async for rows in self.db.iter_log_partition(name, self.chunk_size):
+                await asyncio.to_thread(writer.write_rows, rows)
+                count += len(rows)
+            indexes = await asyncio.to_thread(writer.finish)
+        except Exception:
+            await asyncio.to_thread(writer.abort)
+            raise
+
+        # Выгрузка после сбоя посреди публикации перезаписывает те же файлы
+        written = {index["file"] for index in indexes}
+        self.catalog = [index for index in self.catalog if index["file"] not in written]
+        self.catalog.extend(self._parse_index(index) for index in indexes)
+        self.catalog.sort(key=lambda index: index["start"])
+
+        # Строки удаляются вместе с партицией только после публикации файлов
+        await self.db.drop_log_partition(name)
+        logger.info(f"Партиция {name} выгружена в архив: {count} логов, файлов {len(indexes)}")
+        return count
+
+    async def run_archive(self, now: Optional[datetime] = None) -> List[str]:
+        """Выгружает все партиции, целиком вышедшие за порог"""
+        now = now or datetime.now(tz=timezone.utc)
+        cutoff = now - timedelta(days=self.archive_after_days)
+
+        archived = []
+        async with self._lock:
+            for partition in await self.db.get_log_partitions():
+                # DEFAULT и MAXVALUE-партиции не архивируются: у них нет верхней границы
+                if partition["range_end"] is not None and partition["range_end"] <= cutoff:
+                    await self.archive_partition(partition["name"], partition["range_start"], partition["range_end"])
+                    archived.append(partition["name"])
+                    if self.archived_until is None or partition["range_end"] > self.archived_until:
+                        self.archived_until = partition["range_end"]
+        return archived
+
+    def covers(self, start_time: datetime) -> bool:
+        """Попадает ли начало диапазона в архивный период"""
+        return self.archived_until is not None and start_time < self.archived_until
+
+    def iter_logs(self, start_time: datetime, end_time: datetime, service: Optional[str] = None,
+                  before_id: Optional[int] = None,
+                  filters: Optional[Dict[str, Any]] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Читает логи из архива за промежуток пофайлово, от новых к старым"""
+        for index in reversed(self.catalog):
+            if index["start"] > end_time or index["end"] <= start_time:
+                continue
+            if service is not None and service not in index["services"]:
+                continue
+            if before_id is not None and index["min_id"] >= before_id:
+                continue
+
+            rows = []
+            with gzip.open(os.path.join(self.archive_dir, index["file"]), "rb") as file:
+                for line in file:
+                    row = orjson.loads(line)
+                    if service is not None and row["service"] != service:
+                        continue
+                    if before_id is not None and row["id"] >= before_id:
+                        continue
+                    if not start_time <= datetime.fromisoformat(row["timestamp"]) <= end_time:
+                        continue
+                    # В архиве нет колонок фильтров, они вычисляются из исходного лога
+                    if filters and not match_log_filters(row["log"] or {}, filters):
+                        continue
+                    rows.append(row)
+
+            # Порядок как у горячей таблицы: по id от новых к старым
+            rows.sort(key=lambda row: row["id"], reverse=True)
+            if rows:
+                yield rows
+
+    def read_logs(self, start_time: datetime, end_time: datetime, limit: int,
+                  service: Optional[str] = None, before_id: Optional[int] = None,
+                  filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Читает до limit логов из архива за промежуток, от новых к старым"""
+        result = []
+        for rows in self.iter_logs(start_time, end_time, service, before_id, filters):
+            result.extend(rows)
+            if len(result) >= limit:
+                break
+
+        return result[:limit]
+
+    async def start(self):
+        await asyncio.to_thread(self.load_catalog)
+        logger.info(f"Архив логов: {len(self.catalog)} файлов, данные до {self.archived_until}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_archive()
+            except Exception as e:
+                logger.error(f"Ошибка выгрузки логов в архив: {e}")
+            await asyncio.sleep(self.check_interval)
@@ -0,0 +1,52 @@
+import orjson
+from typing import Any, Dict, List, Tuple
+
+
+def parse_batch_body(body: bytes) -> Tuple[List[Tuple[int, Dict[Any, Any]]], List[Dict[str, Any]]]:
+    """
+    Разбирает тело пакетного запроса (JSON-массив или NDJSON)
+    :param body: сырое тело запроса
+    :return: (список (индекс, лог), список ошибок по записям)
+    """
+    data = body.strip()
+
+    if data.startswith(b'['):
+        # JSON-массив: ошибка синтаксиса ломает весь документ
+        items = orjson.loads(data)
+        raw_records = list(enumerate(items))
+        parse_errors = []
+    else:
+        # NDJSON: каждая строка разбирается отдельно
+        raw_records = []
+        parse_errors = []
+        for index, line in enumerate(line for line in data.splitlines() if line.strip()):
+            try:
+                raw_records.append((index, orjson.loads(line)))
+            except orjson.JSONDecodeError as e:
+                parse_errors.append({'index': index, 'error': f"Некорректный JSON: {e.msg}"})
+
+    records = []
+    errors = parse_errors
+    for index, log in raw_records:
+        error = validate_log(log)
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            records.append((index, log))
+
+    errors.sort(key=lambda item: item['index'])
+    return records, errors
+
+
+def validate_log(log: Any) -> str:
+    """Проверяет запись лога, возвращает текст ошибки или пустую строку"""
+    if not isinstance(log, dict):
+        return "Запись должна быть JSON-объектом"
+
+    service = log.get('service', 'unknown')
+    if not isinstance(service, str) or not service:
+        return "Поле service должно быть непустой строкой"
+    if len(service) > 100:
+        return "Поле service длиннее 100 символов"
+
+    return ''
@@ -0,0 +1,151 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+
+# Части лога, которые выносятся в log_blobs: один и тот же traceback и блоки
+# окружения повторяются в тысячах логов. request.body не выносится - он почти
+# всегда уникален, и отдельная строка на каждый лог только добавила бы накладных расходов
+BLOB_PATHS: Tuple[Tuple[str, ...], ...] = (
+    ("error", "traceback"),
+    ("environment",),
+    ("versions",),
+    ("settings",),
+)
+
+# Ключ ссылки, которой заменяется вынесенная часть: {"$blob": "<sha256>"}
+BLOB_REF_KEY = "$blob"
+
+# Процесс помнит записанные хеши столько секунд и не отправляет их в БД повторно
+BLOB_WRITE_CACHE_SECONDS = 3600
+# last_seen блоба обновляется при записи не чаще, чем раз в столько секунд
+BLOB_TOUCH_SECONDS = 86400
+# Блоб удаляется, если last_seen старше самой старой партиции logs на этот запас:
+# он покрывает BLOB_TOUCH_SECONDS и BLOB_WRITE_CACHE_SECONDS
+BLOB_GC_MARGIN_SECONDS = 2 * 86400
+
+
+def blob_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _blob_ref(value: Any) -> Any:
+    """Хеш из ссылки или None, если value - не ссылка"""
+    if isinstance(value, dict) and len(value) == 1 and isinstance(value.get(BLOB_REF_KEY), str):
+        return value[BLOB_REF_KEY]
+    return None
+
+
+def split_log(log_data: Dict[Any, Any], min_size: int) -> Tuple[Dict[Any, Any], Dict[str, bytes]]:
+    """
+    Выносит части лога из BLOB_PATHS размером от min_size байт.
+    :return: лог со ссылками вместо вынесенных частей и {hash: JSON части};
+             исходный словарь не меняется
+    """
+    stored = log_data
+    blobs: Dict[str, bytes] = {}
+
+    for path in BLOB_PATHS:
+        parent = log_data
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict):
+            continue
+
+        value = parent.get(path[-1])
+        if value is None or isinstance(value, (bool, int, float)) or _blob_ref(value) is not None:
+            continue
+
+        # Ключи сортируются, чтобы одинаковые блоки в разном порядке давали один хеш
+        data = orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+        if len(data) < min_size:
+            continue
+
+        digest = blob_hash(data)
+        blobs[digest] = data
+
+        # Копируются только словари на пути к вынесенной части
+        if stored is log_data:
+            stored = dict(log_data)
+        container = stored
+        for key in path[:-1]:
+            container[key] = dict(container[key])
+            container = container[key]
+        container[path[-1]] = {BLOB_REF_KEY: digest}
+
+    return stored, blobs
+
+
+def blob_path_in(expected: Any) -> Optional[str]:
+    """
+    Путь из BLOB_PATHS, в который заходит фильтр contains, или None.
+    Вынесенные части лежат в логе ссылками, jsonb @> по ним ничего не находит
+    """
+    if not isinstance(expected, dict):
+        return None
+    for path in BLOB_PATHS:
+        value = expected
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+            if value is None:
+                break
+        else:
+            return ".".join(path)
+    return None
+
+
+def blob_refs(logs: Iterable[Any]) -> Set[str]:
+    """Хеши, на которые ссылаются логи"""
+    refs = set()
+    for log_data in logs:
+        if not isinstance(log_data, dict):
+            continue
+        for path in BLOB_PATHS:
+            value = log_data
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            digest = _blob_ref(value)
+            if digest is not None:
+                refs.add(digest)
+    return refs
+
+
+def join_log(log_data: Any, blobs: Dict[str, Any]) -> Any:
+    """Подставляет содержимое вместо ссылок; ссылка без содержимого остается как есть"""
+    if not isinstance(log_data, dict):
+        return log_data
+
+    joined = log_data
+    for path in BLOB_PATHS:
+        parent = joined
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict):
+            continue
+
+        digest = _blob_ref(parent.get(path[-1]))
+        if digest is None or digest not in blobs:
+            continue
+
+        if joined is log_data:
+            joined = dict(log_data)
+        container = joined
+        for key in path[:-1]:
+            container[key] = dict(container[key])
+            container = container[key]
+        container[path[-1]] = blobs[digest]
+
+    return joined
+
+
+def blob_rows(blobs: Dict[str, bytes]) -> List[List[Any]]:
+    """
+    Колонки hash, value, size для unnest, по порядку хешей.
+    value передается текстом: список внутри jsonb[] asyncpg принял бы за вложенный массив
+    """
+    ordered = sorted(blobs.items())
+    return [
+        [digest for digest, _ in ordered],
+        [data.decode() for _, data in ordered],
+        [len(data) for _, data in ordered],
+    ]
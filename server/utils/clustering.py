@@ -0,0 +1,241 @@
+import re
+import struct
+import heapq
+import asyncio
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from utils.fingerprint import compute_fingerprint, error_summary, normalize_message
+
+logger = logging.getLogger(__name__)
+
+# Кадры traceback Django: файл и функция, номер строки в признаки не входит
+_FRAME_PATTERN = re.compile(r'File "([^"]+)", line \d+, in (\S+)')
+
+# Значения в кавычках: параметры SQL, имена объектов, ключи
+_QUOTED_PATTERN = re.compile(r'(["\'])(?:(?!\1).){0,200}\1')
+
+_WORD_PATTERN = re.compile(r'<\w+>|\w+')
+
+# Простое число Мерсенна 2^61 - 1 для универсального хеширования
+_PRIME = (1 << 61) - 1
+
+
+def error_features(log_data: Dict[Any, Any]) -> Set[str]:
+    """
+    Признаки ошибки для MinHash: биграммы слов нормализованного сообщения
+    и кадры traceback без номеров строк
+    """
+    error = log_data.get('error') if isinstance(log_data.get('error'), dict) else {}
+    _, message = error_summary(log_data)
+
+    words = _WORD_PATTERN.findall(normalize_message(_QUOTED_PATTERN.sub('<str>', message)).lower())
+    features = {f"m:{word}" for word in words}
+    features.update(f"m:{first} {second}" for first, second in zip(words, words[1:]))
+
+    traceback = error.get('traceback')
+    lines = traceback if isinstance(traceback, list) else str(traceback or '').splitlines()
+    for line in lines:
+        for path, func in _FRAME_PATTERN.findall(str(line)):
+            features.add(f"f:{path}:{func}")
+
+    return features
+
+
+class MinHasher:
+    """MinHash-сигнатуры: num_perm хеш-функций вида (a * x + b) mod p"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        self.num_perm = num_perm
+        # Коэффициенты детерминированы: сигнатуры сохраняются в БД и переживают рестарт
+        self.coefficients = []
+        for i in range(num_perm):
+            digest = hashlib.blake2b(f"{seed}:{i}".encode(), digest_size=16).digest()
+            a = int.from_bytes(digest[:8], 'little') % (_PRIME - 1) + 1
+            b = int.from_bytes(digest[8:], 'little') % _PRIME
+            self.coefficients.append((a, b))
+
+    def signature(self, features: Set[str]) -> Tuple[int, ...]:
+        if not features:
+            return tuple([_PRIME] * self.num_perm)
+
+        values = [
+            int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            for feature in features
+        ]
+        return tuple(min((a * x + b) % _PRIME for x in values) for a, b in self.coefficients)
+
+    def pack(self, signature: Tuple[int, ...]) -> bytes:
+        return struct.pack(f'<{self.num_perm}Q', *signature)
+
+    def unpack(self, data: bytes) -> Tuple[int, ...]:
+        return struct.unpack(f'<{self.num_perm}Q', data)
+
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+class ErrorClusterIndex:
+    """
+    Кластеризация похожих ошибок: MinHash + LSH в памяти, кластеры хранятся в error_clusters.
+
+    Лог попадает в существующий кластер того же сервиса и типа ошибки, если оценка
+    сходства признаков не ниже threshold; иначе открывает новый кластер. Отпечаток
+    кластера (отпечаток первого лога) становится отпечатком лога и ключом error_groups,
+    поэтому на кластер приходится один анализ и одно issue.
+
+    Новые кластеры сохраняются в БД периодически; тем же проходом подгружаются
+    кластеры, созданные другими процессами сервера.
+
+    assign можно вызывать из потоков: MinHash считается без блокировки,
+    индекс меняется под ней.
+    """
+
+    def __init__(self, db, num_perm: int = 64, bands: int = 16, threshold: float = 0.6,
+                 sync_interval_seconds: float = 5.0, max_aliases: int = 100000,
+                 max_candidates: int = 16, max_bucket_size: int = 1000):
+        if num_perm % bands:
+            raise ValueError("num_perm должен делиться на bands")
+
+        self.db = db
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.sync_interval = sync_interval_seconds
+        self.max_aliases = max_aliases
+        self.max_candidates = max_candidates
+        self.max_bucket_size = max_bucket_size
+
+        # Сигнатуры хранятся упакованными: десятки тысяч кластеров без лишней памяти
+        self.signatures: Dict[str, bytes] = {}
+        self.buckets: Dict[int, List[str]] = {}
+        # Точный отпечаток -> отпечаток кластера: повторы не пересчитывают MinHash
+        self.aliases: Dict[str, str] = {}
+        self.pending: List[Tuple[str, str, Optional[str], bytes]] = []
+        self.stats = {"exact": 0, "merged": 0, "created": 0}
+
+        self._synced_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    def _band_keys(self, service: str, error_type: Optional[str], signature: Tuple[int, ...]) -> List[int]:
+        return [
+            hash((service, error_type, band, signature[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+    def _add(self, fingerprint: str, service: str, error_type: Optional[str], packed: bytes):
+        if fingerprint in self.signatures:
+            return
+        self.signatures[fingerprint] = packed
+        for key in self._band_keys(service, error_type, self.hasher.unpack(packed)):
+            bucket = self.buckets.setdefault(key, [])
+            # Полосы из общих для всех ошибок слов мало что различают, корзины не растут без предела
+            if len(bucket) < self.max_bucket_size:
+                bucket.append(fingerprint)
+
+    def assign(self, service: str, log_data: Dict[Any, Any]) -> str:
+        """Возвращает отпечаток кластера для лога, при необходимости создает кластер"""
+        fingerprint = compute_fingerprint(service, log_data)
+
+        cluster = self.aliases.get(fingerprint)
+        if cluster is not None:
+            self.stats["exact"] += 1
+            return cluster
+        if fingerprint in self.signatures:
+            self.stats["exact"] += 1
+            return fingerprint
+
+        error_type, _ = error_summary(log_data)
+        signature = self.hasher.signature(error_features(log_data))
+
+        with self._lock:
+            return self._assign_signature(fingerprint, service, error_type, signature)
+
+    def _assign_signature(self, fingerprint: str, service: str, error_type: Optional[str],
+                          signature: Tuple[int, ...]) -> str:
+        # Тот же лог мог добавить другой поток, пока считалась сигнатура
+        cluster = self.aliases.get(fingerprint)
+        if cluster is not None:
+            return cluster
+        if fingerprint in self.signatures:
+            return fingerprint
+
+        # Кандидаты с наибольшим числом совпавших полос проверяются по полной сигнатуре
+        hits: Dict[str, int] = {}
+        for key in self._band_keys(service, error_type, signature):
+            for candidate in self.buckets.get(key, ()):
+                hits[candidate] = hits.get(candidate, 0) + 1
+
+        best, best_score = None, self.threshold
+        for candidate in heapq.nlargest(self.max_candidates, hits, key=hits.__getitem__):
+            score = similarity(signature, self.hasher.unpack(self.signatures[candidate]))
+            if score >= best_score:
+                best, best_score = candidate, score
+
+        if best is None:
+            packed = self.hasher.pack(signature)
+            self._add(fingerprint, service, error_type, packed)
+            self.pending.append((fingerprint, service, error_type, packed))
+            self.stats["created"] += 1
+            return fingerprint
+
+        if len(self.aliases) >= self.max_aliases:
+            self.aliases.clear()
+        self.aliases[fingerprint] = best
+        self.stats["merged"] += 1
+        return best
+
+    async def sync(self):
+        """Сохраняет новые кластеры и подгружает созданные другими процессами"""
+        if self.pending:
+            with self._lock:
+                pending, self.pending = self.pending, []
+            try:
+                await self.db.save_error_clusters(pending)
+            except Exception:
+                with self._lock:
+                    self.pending = pending + self.pending
+                raise
+
+        # Нахлест по времени: кластеры из транзакций, закоммиченных с опозданием
+        since = self._synced_at - timedelta(minutes=1) if self._synced_at else None
+        rows = await self.db.get_error_clusters(since)
+        for row in rows:
+            with self._lock:
+                self._add(row["fingerprint"], row["service"], row["error_type"], row["signature"])
+            if self._synced_at is None or row["created_at"] > self._synced_at:
+                self._synced_at = row["created_at"]
+
+    async def start(self):
+        await self.sync()
+        logger.info(f"Загружено кластеров ошибок: {len(self.signatures)}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.sync()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить кластеры ошибок: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации кластеров ошибок: {e}")
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Канал LISTEN/NOTIFY, в который сервер публикует новые логи
+NEW_LOGS_CHANNEL = "new_logs"
+
+# Лимит payload у NOTIFY - 8000 байт, события пакуются в пачки с запасом
+NOTIFY_PAYLOAD_LIMIT = 7500
+
+
+def pack_log_events(events: List[List[Any]]) -> List[str]:
+    """
+    Упаковывает события [id, service, level] в payload'ы NOTIFY
+    :return: список JSON-массивов, каждый меньше лимита NOTIFY
+    """
+    payloads = []
+    chunk = []
+    size = 2
+    for event in events:
+        encoded = orjson.dumps(event)
+        if chunk and size + len(encoded) + 1 > NOTIFY_PAYLOAD_LIMIT:
+            payloads.append(b"[" + b",".join(chunk) + b"]")
+            chunk = []
+            size = 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+
+    if chunk:
+        payloads.append(b"[" + b",".join(chunk) + b"]")
+    return [payload.decode() for payload in payloads]
+
+
+class Subscription:
+    """Подписка на новые логи с фильтром по сервису и уровню"""
+
+    def __init__(self, service: Optional[str], level: Optional[str], max_queue_size: int):
+        self.service = service
+        self.level = level
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.service is not None and event["service"] != self.service:
+            return False
+        if self.level is not None and event["level"] != self.level:
+            return False
+        return True
+
+    def push(self, event: Dict[str, Any]):
+        # Медленный подписчик не должен тормозить остальных: лишнее отбрасываем
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+class LogEventBroker:
+    """
+    Раздает события о новых логах подписчикам.
+
+    Держит отдельное соединение с LISTEN на канал new_logs (вне пула),
+    переподключается при обрыве и рассылает события по подпискам.
+    """
+
+    def __init__(self, db, max_queue_size: int = 1000, reconnect_delay: float = 5.0):
+        self.db = db
+        self.max_queue_size = max_queue_size
+        self.reconnect_delay = reconnect_delay
+        self.subscriptions: Set[Subscription] = set()
+        self.delivered = 0
+        self._conn = None
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, service: Optional[str] = None, level: Optional[str] = None) -> Subscription:
+        subscription = Subscription(service, level, self.max_queue_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            events = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            logger.warning(f"Некорректное событие в канале {channel}: {payload[:200]}")
+            return
+
+        for log_id, service, level in events:
+            event = {"id": log_id, "service": service, "level": level}
+            for subscription in self.subscriptions:
+                if subscription.matches(event):
+                    subscription.push(event)
+                    self.delivered += 1
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._conn and not self._conn.is_closed():
+            await self._conn.close()
+
+    async def _run(self):
+        """Держит соединение с LISTEN и переподключается при обрыве"""
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    self._conn = await self.db.connect_listener()
+                    await self._conn.add_listener(NEW_LOGS_CHANNEL, self._on_notify)
+                    logger.info(f"Подписка на канал {NEW_LOGS_CHANNEL} установлена")
+            except Exception as e:
+                logger.error(f"Не удалось подписаться на канал {NEW_LOGS_CHANNEL}: {e}")
+
+            await asyncio.sleep(self.reconnect_delay)
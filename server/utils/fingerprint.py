@@ -0,0 +1,67 @@
+import re
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+# Переменные части сообщений об ошибках, которые не должны влиять на отпечаток
+_VARIABLE_PATTERNS = [
+    (re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'), '<uuid>'),
+    (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?'), '<ts>'),
+    (re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.-]+\b'), '<email>'),
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'), '<ip>'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<hex>'),
+    (re.compile(r'\b[0-9a-fA-F]{16,}\b'), '<hex>'),
+    (re.compile(r'\b\d+\b'), '<n>'),
+]
+
+_FRAME_PATTERN = re.compile(r'File "([^"]+)", line \d+, in (\S+)')
+
+
+def normalize_message(message: str) -> str:
+    """Заменяет идентификаторы, даты, адреса и числа в сообщении на плейсхолдеры"""
+    for pattern, placeholder in _VARIABLE_PATTERNS:
+        message = pattern.sub(placeholder, message)
+    return ' '.join(message.split())
+
+
+def top_frame(traceback: Any) -> str:
+    """Последний кадр traceback (файл и функция, без номера строки)"""
+    if isinstance(traceback, list):
+        lines = traceback
+    elif isinstance(traceback, str):
+        lines = traceback.splitlines()
+    else:
+        return ''
+
+    for line in reversed(lines):
+        match = _FRAME_PATTERN.search(str(line))
+        if match:
+            return f"{match.group(1)}:{match.group(2)}"
+    return ''
+
+
+def error_summary(log_data: Dict[Any, Any]) -> Tuple[Optional[str], str]:
+    """Тип ошибки и сообщение: из блока error у Django, из полей верхнего уровня у nginx"""
+    error = log_data.get('error')
+    if not isinstance(error, dict):
+        error = {}
+
+    error_type = error.get('type') or log_data.get('level')
+    message = error.get('message') or log_data.get('message') or ''
+    return (str(error_type) if error_type is not None else None), str(message)
+
+
+def compute_fingerprint(service: str, log_data: Dict[Any, Any]) -> str:
+    """
+    Отпечаток ошибки: сервис, тип, нормализованное сообщение и верхний кадр traceback.
+    Повторения одной и той же ошибки получают одинаковый отпечаток.
+    """
+    error_type, message = error_summary(log_data)
+    error = log_data.get('error') if isinstance(log_data.get('error'), dict) else {}
+
+    key = '|'.join((
+        service,
+        error_type or '',
+        normalize_message(message),
+        top_frame(error.get('traceback')),
+    ))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
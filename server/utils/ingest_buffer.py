@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+LogRecord = Tuple[str, Dict[Any, Any]]
+
+
+class IngestBuffer:
+    """
+    Буфер отложенной записи логов.
+
+    Принятые логи складываются в ограниченную asyncio-очередь, фоновая задача
+    пишет их в БД пачками, как только набралось batch_size записей или прошло
+    flush_interval_ms с момента появления первой записи в пачке.
+
+    Пачка, которую БД отвергла из-за данных (ошибка из data_errors), делится пополам,
+    пока не останутся отдельные записи: отвергнутые записи отбрасываются и считаются в lost.
+    Остальные ошибки (БД недоступна) повторяются для всей пачки с задержкой.
+    """
+
+    def __init__(self, insert_batch: Callable[[List[LogRecord]], Awaitable[List[int]]],
+                 max_queue_size: int = 10000, batch_size: int = 500, flush_interval_ms: int = 200,
+                 data_errors: Tuple[Type[BaseException], ...] = (TypeError, ValueError)):
+        self.insert_batch = insert_batch
+        self.data_errors = data_errors
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Счетчики для подбора batch_size и flush_interval_ms
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.lost = 0
+        self.flushes = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def start(self):
+        """Запускает фоновую запись"""
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Буфер записи логов запущен: очередь {self.max_queue_size}, "
+            f"пачка {self.batch_size}, интервал {self.flush_interval * 1000:.0f} мс"
+        )
+
+    async def stop(self):
+        """Останавливает прием и дописывает все, что осталось в очереди"""
+        if not self._task:
+            return
+
+        self._stopping = True
+        await self._task
+        self._task = None
+        logger.info(f"Буфер записи логов остановлен, записано {self.flushed}, потеряно {self.lost}")
+
+    def put(self, service: str, log_data: Dict[Any, Any]) -> bool:
+        """Кладет лог в очередь, возвращает False если очередь заполнена или буфер остановлен"""
+        if self.queue is None or self._stopping:
+            self.rejected += 1
+            return False
+
+        try:
+            self.queue.put_nowait((service, log_data))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+        self.accepted += 1
+        return True
+
+    async def _collect_batch(self) -> List[LogRecord]:
+        """Собирает пачку: ждет первую запись, затем добирает до размера или таймаута"""
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            # Сначала забираем то, что уже лежит в очереди, без ожидания
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            if self._stopping:
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _flush(self, batch: List[LogRecord]) -> Optional[Exception]:
+        """Пишет пачку в БД и обновляет статистику, возвращает ошибку записи"""
+        started = time.perf_counter()
+        try:
+            await self.insert_batch(batch)
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Ошибка записи пачки из {len(batch)} логов: {e}")
+            return e
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.flushed += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        return None
+
+    async def _run(self):
+        """Основной цикл фоновой записи"""
+        retry_delay = 0.5
+        shutdown_attempts = 3
+
+        while not (self._stopping and self.queue.empty()):
+            batch = await self._collect_batch()
+            if not batch:
+                continue
+
+            # Неудачную пачку держим у себя и повторяем: очередь при этом
+            # продолжает принимать логи, а при переполнении клиенты получат 503
+            parts = [batch]
+            while parts:
+                part = parts[0]
+                error = await self._flush(part)
+                if error is None:
+                    parts.pop(0)
+                    retry_delay = 0.5
+                    continue
+
+                if isinstance(error, self.data_errors):
+                    # Плохие записи ищутся делением пачки, повтор целиком ничего не даст
+                    parts.pop(0)
+                    if len(part) == 1:
+                        self.lost += 1
+                        logger.error(f"Лог сервиса {str(part[0][0])[:100]!r} отброшен, БД его не принимает: {error}")
+                    else:
+                        middle = len(part) // 2
+                        parts[0:0] = [part[:middle], part[middle:]]
+                    continue
+
+                if self._stopping:
+                    shutdown_attempts -= 1
+                    if shutdown_attempts <= 0:
+                        self.lost += sum(len(item) for item in parts) + self.queue.qsize()
+                        logger.error(f"БД недоступна при остановке, потеряно логов: {self.lost}")
+                        return
+
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 5.0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Текущее состояние буфера"""
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_max_size": self.max_queue_size,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "lost": self.lost,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
@@ -1,12 +1,24 @@
+import os
 import hashlib
-from functools import lru_cache
 from typing import Dict
 
+from diskcache import Cache
+
+# Кэш анализа переживает перезапуск: каталог, срок жизни записи и предельный размер
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", "analysis_cache")
+ANALYSIS_CACHE_TTL_HOURS = int(os.getenv("ANALYSIS_CACHE_TTL_HOURS", "168"))
+ANALYSIS_CACHE_SIZE_MB = int(os.getenv("ANALYSIS_CACHE_SIZE_MB", "256"))
+
 
 class LogAnalyzer:
     def __init__(self):
-        self.processed_errors = set()
-        self.error_cache = {}  # Кэш для результатов анализа
+        # Кэш для результатов анализа и отметки об отправленных ошибках
+        self.error_cache = Cache(
+            ANALYSIS_CACHE_DIR,
+            size_limit=ANALYSIS_CACHE_SIZE_MB * 1024 * 1024,
+            eviction_policy="least-recently-used",
+        )
+        self.cache_ttl = ANALYSIS_CACHE_TTL_HOURS * 3600
 
     def _get_error_hash(self, log_data: Dict) -> str:
         """Создает уникальный хеш для ошибки на основе ключевых параметров"""
@@ -15,16 +27,16 @@ class LogAnalyzer:
         hash_string = f"{error.get('type')}-{error.get('message')}-{log_data.get('service')}"
         return hashlib.md5(hash_string.encode()).hexdigest()
 
-    @lru_cache(maxsize=1000)
     def analyze_error_cached(self, error_hash: str, log_data: Dict) -> str:
         """Анализирует ошибку с использованием кэша"""
-        # Если ошибка уже анализировалась, возвращаем закэшированный результат
-        if error_hash in self.error_cache:
-            return self.error_cache[error_hash]
+        # lru_cache здесь не подходит: log_data - словарь и не хешируется
+        analysis = self.error_cache.get(f"analysis:{error_hash}")
+        if analysis is not None:
+            return analysis
 
         # Новый анализ
         analysis = self.analyze_log(log_data)
-        self.error_cache[error_hash] = analysis
+        self.error_cache.set(f"analysis:{error_hash}", analysis, expire=self.cache_ttl)
         return analysis
 
     def process_logs(self):
@@ -35,13 +47,12 @@ class LogAnalyzer:
             error_hash = self._get_error_hash(log)
 
             # Пропускаем уже обработанные ошибки
-            if error_hash in self.processed_errors:
+            if f"processed:{error_hash}" in self.error_cache:
                 continue
 
             # Анализируем с использованием кэша
             analysis = self.analyze_error_cached(error_hash, log)
 
             # Отправляем в Telegram только если это новая ошибка
-            if error_hash not in self.processed_errors:
-                self.send_to_telegram(log, analysis)
-                self.processed_errors.add(error_hash)
\ No newline at end of file
+            self.send_to_telegram(log, analysis)
+            self.error_cache.set(f"processed:{error_hash}", True, expire=self.cache_ttl)
@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+# Поля лога, вынесенные в отдельные колонки logs для фильтрации в SQL
+HOT_FIELDS = ("level", "error_type", "request_path", "request_id", "environment")
+
+# Длинные значения обрезаются: строка индекса btree ограничена ~2.7 КБ
+HOT_FIELD_MAX_LENGTH = 500
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    return str(value)[:HOT_FIELD_MAX_LENGTH]
+
+
+def _section(log_data: Dict[Any, Any], name: str) -> Dict[Any, Any]:
+    section = log_data.get(name)
+    return section if isinstance(section, dict) else {}
+
+
+def parse_event_time(value: Any) -> Optional[datetime]:
+    """Время события из лога: ISO-строка или unix-время (syslog-ng отдает его строкой)"""
+    if value is None or isinstance(value, bool):
+        return None
+
+    try:
+        if isinstance(value, (int, float)) or (isinstance(value, str) and value.replace('.', '', 1).isdigit()):
+            return datetime.fromtimestamp(float(value), tz=timezone.utc)
+        if isinstance(value, str):
+            moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return None
+
+
+def extract_log_fields(log_data: Dict[Any, Any]) -> Tuple[Optional[Any], ...]:
+    """
+    Значения колонок level, error_type, request_path, request_id, environment, event_time.
+    Django кладет тип ошибки и путь во вложенные error и request, nginx и postgres - на верхний уровень.
+    """
+    error = _section(log_data, 'error')
+    request = _section(log_data, 'request')
+
+    return (
+        _text(log_data.get('level')),
+        _text(error.get('type')),
+        _text(request.get('path') or log_data.get('path')),
+        _text(log_data.get('request_id')),
+        _text(log_data.get('environment')),
+        parse_event_time(log_data.get('timestamp')),
+    )
+
+
+def match_log_filters(log_data: Dict[Any, Any], filters: Dict[str, Any]) -> bool:
+    """Проверяет лог на фильтры GET /api/logs в Python (для холодного архива)"""
+    if not filters:
+        return True
+
+    values = dict(zip(HOT_FIELDS + ("event_time",), extract_log_fields(log_data)))
+    for field in HOT_FIELDS:
+        expected = filters.get(field)
+        if expected is None:
+            continue
+        actual = values[field]
+        if field == "request_path" and expected.endswith("*"):
+            if actual is None or not actual.startswith(expected[:-1]):
+                return False
+        elif actual != expected:
+            return False
+
+    event_time = values["event_time"]
+    if filters.get("event_from") and (event_time is None or event_time < filters["event_from"]):
+        return False
+    if filters.get("event_to") and (event_time is None or event_time > filters["event_to"]):
+        return False
+
+    contains = filters.get("contains")
+    if contains is not None and not _contains(log_data, contains):
+        return False
+    return True
+
+
+def _contains(value: Any, expected: Any) -> bool:
+    """Упрощенный аналог jsonb @>"""
+    if isinstance(expected, dict):
+        return isinstance(value, dict) and all(
+            key in value and _contains(value[key], item) for key, item in expected.items()
+        )
+    if isinstance(expected, list):
+        return isinstance(value, list) and all(
+            any(_contains(element, item) for element in value) for item in expected
+        )
+    return value == expected
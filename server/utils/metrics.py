@@ -0,0 +1,131 @@
+import bisect
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Границы бакетов гистограмм
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: счетчики по бакетам, сумма и количество"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: Labels) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", repr(float(bound))),))} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {self.count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{_format_labels(labels)} {self.count}')
+        return lines
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    Реестр метрик процесса.
+
+    Все обновления выполняются в цикле событий без блокировок, значения
+    собираются в текстовый формат Prometheus только при запросе /api/metrics.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.help: Dict[str, Tuple[str, str]] = {}
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, Labels, float]]]] = []
+
+        self.describe('http_request_duration_seconds', 'histogram', 'Длительность обработки запроса')
+        self.describe('http_request_size_bytes', 'histogram', 'Размер тела запроса')
+        self.describe('http_response_size_bytes', 'histogram', 'Размер тела ответа')
+        self.describe('http_responses_total', 'counter', 'Количество ответов по статусам')
+        self.describe('db_pool_acquire_seconds', 'histogram', 'Ожидание соединения из пула')
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        self.help[name] = (metric_type, help_text)
+
+    def observe(self, name: str, labels: Labels, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        series = self.histograms.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1):
+        series = self.counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Labels, float]]]):
+        """Регистрирует функцию, отдающая мгновенные значения (name, type, labels, value)"""
+        self.collectors.append(collector)
+
+    def observe_request(self, method: str, route: str, status_code: int, duration: float,
+                        request_size: int, response_size: int):
+        labels = (('method', method), ('route', route))
+        self.observe('http_request_duration_seconds', labels, duration)
+        if request_size >= 0:
+            self.observe('http_request_size_bytes', labels, request_size, SIZE_BUCKETS)
+        if response_size >= 0:
+            self.observe('http_response_size_bytes', labels, response_size, SIZE_BUCKETS)
+        self.inc('http_responses_total', labels + (('status', str(status_code)),))
+
+    def observe_pool_acquire(self, wait: float):
+        self.observe('db_pool_acquire_seconds', (), wait)
+
+    def render(self) -> str:
+        """Собирает все метрики в текстовый формат Prometheus"""
+        lines = []
+
+        for name, series in self.histograms.items():
+            lines.extend(self._header(name, 'histogram'))
+            for labels, histogram in series.items():
+                lines.extend(histogram.render(name, labels))
+
+        for name, series in self.counters.items():
+            lines.extend(self._header(name, 'counter'))
+            for labels, value in series.items():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        seen = set()
+        for collector in self.collectors:
+            for name, metric_type, labels, value in collector():
+                if name not in seen:
+                    seen.add(name)
+                    lines.extend(self._header(name, metric_type))
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, name: str, default_type: str) -> List[str]:
+        metric_type, help_text = self.help.get(name, (default_type, name))
+        return [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+
+
+# Глобальный реестр метрик
+metrics = Metrics()
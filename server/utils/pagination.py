@@ -0,0 +1,52 @@
+import base64
+import binascii
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+import orjson
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    """Упаковывает позицию выборки в непрозрачную строку для next_cursor"""
+    return base64.urlsafe_b64encode(orjson.dumps(data)).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    Распаковывает курсор, ValueError если строка повреждена или поля не того вида.
+    start и end возвращаются datetime и бывают только вместе
+    """
+    try:
+        data = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, orjson.JSONDecodeError) as e:
+        raise ValueError(f"Некорректный курсор: {e}")
+
+    if not isinstance(data, dict):
+        raise ValueError("Некорректный курсор")
+
+    if ("start" in data) != ("end" in data):
+        raise ValueError("Некорректный курсор: нужны оба поля start и end")
+    for key in ("start", "end"):
+        if key in data:
+            data[key] = _parse_time(data[key], key)
+
+    if "id" in data and (
+        not isinstance(data["id"], int) or isinstance(data["id"], bool) or not 0 <= data["id"] < 2 ** 63
+    ):
+        raise ValueError("Некорректный курсор: id должен быть целым числом")
+    rank = data.get("rank")
+    if rank is not None and (not isinstance(rank, (int, float)) or isinstance(rank, bool)):
+        raise ValueError("Некорректный курсор: rank должен быть числом")
+    if "order" in data and data["order"] not in ("recent", "rank"):
+        raise ValueError("Некорректный курсор: order должен быть recent или rank")
+    return data
+
+
+def _parse_time(value: Any, key: str) -> datetime:
+    if not isinstance(value, str):
+        raise ValueError(f"Некорректный курсор: {key} должен быть ISO-строкой")
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Некорректный курсор: {key} не ISO-время")
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional, Tuple
+
+from utils.blobs import BLOB_GC_MARGIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionManager:
+    """
+    Обслуживание партиций таблицы logs.
+
+    Заранее создает партиции на premake периодов вперед (день или неделя)
+    и удаляет целые партиции, которые полностью вышли за срок хранения.
+    """
+
+    def __init__(self, db, interval: str = "day", premake: int = 7,
+                 retention_days: int = 0, check_interval_minutes: int = 60):
+        if interval not in ("day", "week"):
+            raise ValueError(f"Неизвестный интервал партиций: {interval}")
+
+        self.db = db
+        self.interval = interval
+        self.premake = premake
+        self.retention_days = retention_days
+        self.check_interval = check_interval_minutes * 60
+        self._task: Optional[asyncio.Task] = None
+
+    def period_start(self, moment: datetime) -> datetime:
+        """Начало периода (UTC), в который попадает moment"""
+        start = moment.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.interval == "week":
+            start -= timedelta(days=start.weekday())
+        return start
+
+    def period_length(self) -> timedelta:
+        return timedelta(days=7 if self.interval == "week" else 1)
+
+    def planned_partitions(self, now: datetime) -> List[Tuple[str, datetime, datetime]]:
+        """Партиции, которые должны существовать: текущий период и premake следующих"""
+        start = self.period_start(now)
+        length = self.period_length()
+
+        planned = []
+        for _ in range(self.premake + 1):
+            end = start + length
+            planned.append((f"logs_p{start:%Y%m%d}", start, end))
+            start = end
+        return planned
+
+    async def ensure_partitions(self, now: Optional[datetime] = None) -> List[str]:
+        """Создает недостающие партиции, возвращает имена созданных"""
+        now = now or datetime.now(tz=timezone.utc)
+        existing = await self.db.get_log_partitions()
+
+        # У DEFAULT-партиции границ нет, у MINVALUE/MAXVALUE нет одной из границ: она не ограничена
+        existing = [p for p in existing if p["range_start"] is not None or p["range_end"] is not None]
+
+        created = []
+        for name, start, end in self.planned_partitions(now):
+            # Диапазон уже покрыт (например, недельной партицией после смены интервала)
+            if any(
+                (p["range_start"] is None or p["range_start"] < end)
+                and (p["range_end"] is None or start < p["range_end"])
+                for p in existing
+            ):
+                continue
+
+            await self.db.create_log_partition(name, start, end)
+            existing.append({"name": name, "range_start": start, "range_end": end})
+            created.append(name)
+
+        if created:
+            logger.info(f"Созданы партиции logs: {', '.join(created)}")
+        return created
+
+    async def drop_expired_partitions(self, now: Optional[datetime] = None) -> List[str]:
+        """Удаляет партиции, все строки которых старше срока хранения"""
+        if self.retention_days <= 0:
+            return []
+
+        now = now or datetime.now(tz=timezone.utc)
+        cutoff = now - timedelta(days=self.retention_days)
+
+        dropped = []
+        for partition in await self.db.get_log_partitions():
+            # DEFAULT и MAXVALUE-партиции не устаревают
+            if partition["range_end"] is not None and partition["range_end"] <= cutoff:
+                await self.db.drop_log_partition(partition["name"])
+                dropped.append(partition["name"])
+
+        if dropped:
+            logger.info(f"Удалены партиции logs по сроку хранения: {', '.join(dropped)}")
+        return dropped
+
+    async def prune_blobs(self) -> int:
+        """Удаляет блобы, на которые могли ссылаться только логи уже удаленных партиций"""
+        starts = [p["range_start"] for p in await self.db.get_log_partitions() if p["range_start"]]
+        if not starts:
+            return 0
+
+        deleted = await self.db.delete_unused_log_blobs(min(starts) - timedelta(seconds=BLOB_GC_MARGIN_SECONDS))
+        if deleted:
+            logger.info(f"Удалено неиспользуемых блобов логов: {deleted}")
+        return deleted
+
+    async def run_maintenance(self):
+        """Один проход обслуживания"""
+        await self.ensure_partitions()
+        await self.drop_expired_partitions()
+        await self.prune_blobs()
+
+    async def start(self):
+        """Создает партиции сразу и запускает периодическое обслуживание"""
+        await self.run_maintenance()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.run_maintenance()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания партиций logs: {e}")
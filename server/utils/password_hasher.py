@@ -0,0 +1,72 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """Все слоты bcrypt заняты дольше queue_timeout"""
+
+
+def hash_password(password: str) -> str:
+    """Хеширует пароль с использованием bcrypt"""
+    salt = bcrypt.gensalt()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Проверяет пароль против хеша"""
+    try:
+        return bcrypt.checkpw(
+            plain_password.encode('utf-8'),
+            hashed_password.encode('utf-8')
+        )
+    except (ValueError, TypeError):
+        return False
+
+
+class PasswordHasher:
+    """
+    bcrypt в отдельном пуле потоков.
+
+    bcrypt отпускает GIL, поэтому хеширование в потоках не блокирует цикл событий.
+    Одновременно выполняется не больше max_concurrency операций; запрос, который
+    ждал слота дольше queue_timeout секунд, получает PasswordHasherBusy.
+    """
+
+    def __init__(self, max_concurrency: int = 4, queue_timeout: float = 2.0):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bcrypt")
+
+    async def _run(self, func: Callable, *args):
+        # Семафор создается в работающем цикле событий
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise PasswordHasherBusy("Превышено время ожидания проверки пароля")
+
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,80 @@
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from utils.log_fields import HOT_FIELDS, extract_log_fields
+
+# Колонки logs, которые можно запросить в fields=
+LOG_COLUMNS = (
+    "id", "timestamp", "service", "fingerprint", "log", "ai_analysis", "analysis_time",
+    *HOT_FIELDS, "event_time",
+)
+# JSONB-колонки: в них можно выбрать путь через точку, например log.error.message
+JSON_COLUMNS = ("log", "ai_analysis")
+MAX_FIELDS = 50
+
+_SEGMENT = re.compile(r"^[\w\-]+$")
+
+
+class Field(NamedTuple):
+    name: str
+    column: str
+    path: Tuple[str, ...]
+
+
+def parse_fields(spec: Optional[str]) -> Optional[List[Field]]:
+    """
+    Разбирает fields=id,timestamp,log.error.type,ai_analysis.severity_level.
+    id добавляется всегда: по нему строится курсор следующей страницы.
+    :return: None, если проекция не задана; ValueError при неизвестном поле
+    """
+    if spec is None or not spec.strip():
+        return None
+
+    fields = []
+    names = set()
+    for name in (item.strip() for item in spec.split(",")):
+        if not name or name in names:
+            continue
+
+        column, *path = name.split(".")
+        if column not in LOG_COLUMNS:
+            raise ValueError(f"Неизвестное поле: {column}")
+        if path and column not in JSON_COLUMNS:
+            raise ValueError(f"Поле {column} не JSON, путь {name} недопустим")
+        if not all(_SEGMENT.match(segment) for segment in path):
+            raise ValueError(f"Некорректный путь поля: {name}")
+
+        fields.append(Field(name, column, tuple(path)))
+        names.add(name)
+
+    if "id" not in names:
+        fields.insert(0, Field("id", "id", ()))
+    if len(fields) > MAX_FIELDS:
+        raise ValueError(f"Слишком много полей, максимум {MAX_FIELDS}")
+    return fields
+
+
+def extract_path(value: Any, path: Tuple[str, ...]) -> Any:
+    """Значение по пути, как jsonb #> path: индексы списков - числа, нет пути - None"""
+    for key in path:
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and key.lstrip("-").isdigit():
+            index = int(key)
+            value = value[index] if -len(value) <= index < len(value) else None
+        else:
+            return None
+    return value
+
+
+def project_row(row: Dict[str, Any], fields: Optional[List[Field]]) -> Dict[str, Any]:
+    """
+    Проекция уже прочитанной строки (для логов из холодного архива).
+    В архиве нет колонок level, error_type и др.: они вычисляются из log так же, как при вставке
+    """
+    if fields is None:
+        return row
+    if any(field.column not in row for field in fields) and isinstance(row.get("log"), dict):
+        derived = dict(zip(HOT_FIELDS + ("event_time",), extract_log_fields(row["log"])))
+        row = {**derived, **row}
+    return {field.name: extract_path(row.get(field.column), field.path) for field in fields}
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Tuple
+
+# Больший Retry-After не отдается: при нулевой скорости ведро не наполнится никогда
+MAX_RETRY_AFTER_SECONDS = 3600
+
+
+def retry_after_header(seconds: float) -> str:
+    """Значение Retry-After: целые секунды с округлением вверх, от 1 до MAX_RETRY_AFTER_SECONDS"""
+    return str(int(max(1.0, min(float(MAX_RETRY_AFTER_SECONDS), seconds + 0.999))))
+
+
+class TokenBucket:
+    """Маркерное ведро: rate маркеров в секунду, не больше burst в запасе"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait(self, cost: float) -> float:
+        return max(0.0, cost - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def take(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """Забирает cost маркеров; при нехватке возвращает, через сколько секунд их хватит"""
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True, 0.0
+        return False, self._wait(cost)
+
+    def take_up_to(self, cost: int) -> Tuple[int, float]:
+        """
+        Забирает столько целых маркеров, сколько есть, но не больше cost.
+        :return: сколько выдано и через сколько секунд хватит на остаток (не больше burst)
+        """
+        self._refill()
+        granted = max(0, min(int(cost), int(self.tokens)))
+        self.tokens -= granted
+        rest = cost - granted
+        return granted, self._wait(min(rest, self.burst)) if rest else 0.0
+
+    def refund(self, cost: float):
+        """Возвращает маркеры неиспользованного запроса"""
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class KeyedRateLimiter:
+    """
+    Отдельное ведро на каждый ключ (email, IP, сервис).
+
+    Хранит не больше max_keys ведер, давно не использованные вытесняются:
+    вытесненный ключ начинает с полного ведра. rate <= 0 - без ограничения.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def take(self, key: Hashable, cost: float = 1.0) -> Tuple[bool, float]:
+        if self.rate <= 0:
+            return True, 0.0
+        allowed, retry_after = self.bucket(key).take(cost)
+        if not allowed:
+            self.rejected += 1
+        return allowed, retry_after
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Размеры корзин счетчиков
+BUCKETS = ("minute", "hour", "day")
+
+
+def bucket_start(moment: datetime, bucket: str) -> datetime:
+    """Начало корзины (UTC), в которую попадает moment"""
+    moment = moment.astimezone(timezone.utc)
+    if bucket == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if bucket == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Неизвестный размер корзины: {bucket}")
+
+
+class RollupAggregator:
+    """
+    Счетчики логов по сервису, уровню и отпечатку в корзинах minute/hour/day.
+
+    Вставка логов только увеличивает счетчики в памяти; раз в flush_interval_seconds
+    накопленное одной транзакцией прибавляется к log_rollups. Горячие строки
+    таблицы обновляются раз за интервал, а не на каждый лог. При аварийной остановке
+    теряются счетчики последнего интервала.
+    """
+
+    def __init__(self, db, flush_interval_seconds: float = 10.0,
+                 retention_days: Optional[Dict[str, int]] = None, prune_interval_minutes: int = 60):
+        self.db = db
+        self.flush_interval = flush_interval_seconds
+        self.retention_days = retention_days or {"minute": 8, "hour": 90, "day": 0}
+        self.prune_interval = prune_interval_minutes * 60
+
+        self.counts: Counter = Counter()
+        self.flushed = 0
+        self.failed_flushes = 0
+        self._pruned_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, events: List[Tuple[str, Optional[str], Optional[str]]]):
+        """Учитывает вставленные логи: список (service, level, fingerprint)"""
+        minute = bucket_start(datetime.now(tz=timezone.utc), "minute")
+        for service, level, fingerprint in events:
+            self.counts[(minute, service, level or "", fingerprint or "")] += 1
+
+    def _expand(self, counts: Counter) -> List[Tuple[str, datetime, str, str, str, int]]:
+        """Разворачивает минутные счетчики во все размеры корзин"""
+        rows: Counter = Counter()
+        for (minute, service, level, fingerprint), count in counts.items():
+            for bucket in BUCKETS:
+                rows[(bucket, service, bucket_start(minute, bucket), level, fingerprint)] += count
+
+        # Порядок первичного ключа: параллельные процессы блокируют строки в одном порядке
+        return [
+            (bucket, start, service, level, fingerprint, count)
+            for (bucket, service, start, level, fingerprint), count in sorted(rows.items())
+        ]
+
+    async def flush(self):
+        """Прибавляет накопленные счетчики к log_rollups"""
+        if not self.counts:
+            return
+
+        counts, self.counts = self.counts, Counter()
+        try:
+            await self.db.add_log_rollups(self._expand(counts))
+        except BaseException:
+            # Счетчики не теряются (в том числе при отмене задачи): вернутся в следующую попытку
+            self.counts.update(counts)
+            self.failed_flushes += 1
+            raise
+        self.flushed += sum(counts.values())
+
+    async def prune(self):
+        """Удаляет корзины старше срока хранения"""
+        now = datetime.now(tz=timezone.utc)
+        for bucket, days in self.retention_days.items():
+            if days > 0:
+                await self.db.delete_log_rollups(bucket, now - timedelta(days=days))
+        self._pruned_at = time.monotonic()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Не удалось записать счетчики логов: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._pruned_at >= self.prune_interval:
+                    await self.prune()
+            except Exception as e:
+                logger.error(f"Ошибка записи счетчиков логов: {e}")